@@ -0,0 +1,72 @@
+import collections
+import email.utils
+import gzip
+import hashlib
+import logging
+import os
+import threading
+
+# How long browsers may use a static asset without asking again. After that
+# they revalidate with If-None-Match and normally get a bodiless 304.
+STATIC_MAX_AGE = int(os.getenv("PAYROLL_STATIC_MAX_AGE", "300"))
+
+# One loaded version of an asset. `gzip_body` is None when compressing doesn't help.
+AssetVersion = collections.namedtuple("AssetVersion", "body gzip_body etag gzip_etag last_modified mtime")
+
+class StaticAsset:
+    """A file served from memory with its validators and gzip variant precomputed.
+
+    current() stats the file on each call and reloads it when its inode,
+    mtime or size changed, so editing style.css needs no restart.
+    """
+
+    def __init__(self, path, content_type):
+        self.path = path
+        self.content_type = content_type
+        self.lock = threading.Lock()
+        self._signature = None
+        self._version = None
+
+    def current(self):
+        st = os.stat(self.path)
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature != self._signature:
+            with self.lock:
+                if signature != self._signature:
+                    self._version = self._load(int(st.st_mtime))
+                    self._signature = signature
+                    logging.info(f"[assets] Loaded {self.path} ({len(self._version.body)} bytes)")
+        return self._version
+
+    def _load(self, mtime):
+        with open(self.path, 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gzip_body) >= len(body):
+            gzip_body = None
+        return AssetVersion(
+            body=body,
+            gzip_body=gzip_body,
+            etag=f'"{digest}"',
+            gzip_etag=f'"{digest}-gz"',
+            last_modified=email.utils.formatdate(mtime, usegmt=True),
+            mtime=mtime,
+        )
+
+def not_modified(version, if_none_match, if_modified_since):
+    """Whether a conditional GET can be answered with 304.
+
+    If-None-Match wins when present; either of the asset's ETags matches it,
+    since both name the same content.
+    """
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(',')]
+        return '*' in tags or version.etag in tags or version.gzip_etag in tags
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since is not None and version.mtime <= since.timestamp()
+    return False
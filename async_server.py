@@ -0,0 +1,150 @@
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.client import parse_headers
+from server import TimeClockHandler, HTTP_WORKERS, get_local_ip
+from repository import get_repository
+from event_stream import SSE_HEARTBEAT, format_event
+
+# How long an idle keep-alive connection is held open waiting for its next request
+KEEPALIVE_TIMEOUT = 75
+MAX_HEADER_BYTES = 64 * 1024
+
+class BufferedRequest(TimeClockHandler):
+    """TimeClockHandler's routes run against an already-read request.
+
+    Skips BaseHTTPRequestHandler's socket setup: the request body comes from
+    memory and the response (status line, headers, body) is captured in
+    `self.wfile` for the event loop to send.
+    """
+
+    def __init__(self, method, path, version, headers, body, client_address):
+        self.command = method
+        self.path = path
+        self.request_version = version
+        self.requestline = f"{method} {path} {version}"
+        self.headers = headers
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.client_address = client_address
+        self.close_connection = True
+
+    def run(self):
+        handler = getattr(self, 'do_' + self.command, None)
+        if self.command not in ('GET', 'POST') or handler is None:
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+        else:
+            handler()
+        return self.wfile.getvalue()
+
+def run_route(method, path, version, headers, body, client_address):
+    """Blocking part of a request (disk, PDF rendering, SMTP); runs in the executor."""
+    try:
+        return BufferedRequest(method, path, version, headers, body, client_address).run()
+    except Exception:
+        logging.exception(f"[async_server] {method} {path} failed")
+        return b"HTTP/1.0 500 Internal Server Error\r\nContent-Type: text/plain\r\n\r\nInternal Server Error"
+
+def frame_response(raw, keep_alive):
+    """Re-frame a handler's response for this connection: HTTP/1.1, explicit length (none for 204/304), our Connection header."""
+    head, _, body = raw.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.split(b"\r\n")
+    status_line = b"HTTP/1.1" + status_line[status_line.index(b" "):]
+    kept = [line for line in header_lines
+            if line.split(b":", 1)[0].strip().lower() not in (b"content-length", b"connection")]
+    # 204 and 304 never carry a body, so they get no Content-Length either
+    if status_line.split(b" ")[1] in (b"204", b"304"):
+        body = b""
+    else:
+        kept.append(b"Content-Length: %d" % len(body))
+    kept.append(b"Connection: keep-alive" if keep_alive else b"Connection: close")
+    return b"\r\n".join([status_line] + kept) + b"\r\n\r\n" + body
+
+def wants_keep_alive(version, headers):
+    connection = (headers.get('Connection') or '').lower()
+    if version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+class AsyncTimeClockServer:
+    """asyncio front end serving the same routes as the threaded server.
+
+    Every connection, idle or not, is just a coroutine, so thousands of
+    keep-alive connections cost little. Route handlers block (journal fsync,
+    PDF rendering, email), so each request runs on a bounded thread pool.
+    """
+
+    def __init__(self, workers=HTTP_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="async-route")
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    return
+                request_line, _, header_bytes = head.partition(b"\r\n")
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    headers = parse_headers(io.BytesIO(header_bytes))
+                    length = int(headers.get('Content-Length') or 0)
+                except ValueError:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    await writer.drain()
+                    return
+                if method == "GET" and path.partition('?')[0] == "/events":
+                    await self.stream_events(writer)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                raw = await loop.run_in_executor(self.executor, run_route, method, path, version, headers, body, peer)
+                keep_alive = wants_keep_alive(version, headers)
+                writer.write(frame_response(raw, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream_events(self, writer):
+        """Server-Sent Events for /events, served here rather than by the route handler."""
+        repository = get_repository()
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+
+        def on_change(event):
+            loop.call_soon_threadsafe(pending.put_nowait, format_event(event, repository.time_log_version))
+
+        repository.subscribe(on_change)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\nretry: 3000\n\n")
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(pending.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    message = b": keep-alive\n\n"
+                writer.write(message)
+                await writer.drain()
+        finally:
+            repository.unsubscribe(on_change)
+
+    async def serve(self, host="0.0.0.0", port=8000):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        async with server:
+            await server.serve_forever()
+
+def run_async_server(port=8000, workers=HTTP_WORKERS):
+    logging.info(f"Async HTTP server running at http://{get_local_ip()}:{port} with {workers} route workers")
+    asyncio.run(AsyncTimeClockServer(workers).serve(port=port))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    run_async_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
@@ -0,0 +1,211 @@
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from data import get_backend
+
+# Snapshots of the storage files, taken off the request path by BackupScheduler.
+# Files are split into fixed-size chunks stored once each, gzip-compressed and
+# named by their SHA-256, so a snapshot only adds the chunks that changed since
+# the previous one (appended journal tail, rewritten month partitions, touched
+# SQLite pages). A snapshot itself is a small JSON listing each file's chunks.
+BACKUP_DIR = os.getenv("PAYROLL_BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("PAYROLL_BACKUP_INTERVAL", "3600"))  # seconds
+# Retention: the newest BACKUP_KEEP_LAST snapshots, plus the newest snapshot of
+# each of the last BACKUP_KEEP_DAILY days that have one
+BACKUP_KEEP_LAST = int(os.getenv("PAYROLL_BACKUP_KEEP_LAST", "24"))
+BACKUP_KEEP_DAILY = int(os.getenv("PAYROLL_BACKUP_KEEP_DAILY", "30"))
+CHUNK_SIZE = 64 * 1024
+
+def _snapshots_dir(backup_dir):
+    return os.path.join(backup_dir, "snapshots")
+
+def _objects_dir(backup_dir):
+    return os.path.join(backup_dir, "objects")
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+def _write_atomic(path, content, mode='wb'):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """Snapshot IDs, oldest first. IDs are timestamps, so they sort by age."""
+    try:
+        names = os.listdir(_snapshots_dir(backup_dir))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len(".json")] for name in names if name.endswith(".json"))
+
+def load_snapshot(snapshot_id, backup_dir=BACKUP_DIR):
+    with open(os.path.join(_snapshots_dir(backup_dir), snapshot_id + ".json"), 'r') as f:
+        return json.load(f)
+
+def _store_chunks(path, backup_dir):
+    """Split a file into chunks, storing the ones we don't have yet. Returns their hashes."""
+    chunks = []
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest = hashlib.sha256(chunk).hexdigest()
+            object_path = os.path.join(_objects_dir(backup_dir), digest)
+            if not os.path.exists(object_path):
+                _write_atomic(object_path, gzip.compress(chunk))
+            chunks.append(digest)
+    return chunks
+
+def _read_chunk(digest, backup_dir):
+    with open(os.path.join(_objects_dir(backup_dir), digest), 'rb') as f:
+        return gzip.decompress(f.read())
+
+def create_snapshot(lock=None, backup_dir=BACKUP_DIR):
+    """Snapshot the current storage files. Returns the new snapshot ID, or
+    None if nothing changed since the latest snapshot.
+
+    `lock` (the repository lock) is held only while the live files are
+    listed and the changed ones copied aside, so a snapshot never sees a
+    half-applied write or a file that compaction removed meanwhile. Hashing,
+    compressing and writing chunks happens after it's released.
+    """
+    os.makedirs(_snapshots_dir(backup_dir), exist_ok=True)
+    os.makedirs(_objects_dir(backup_dir), exist_ok=True)
+    existing = list_snapshots(backup_dir)
+    previous = load_snapshot(existing[-1], backup_dir)['files'] if existing else {}
+    files = {}
+    # Next to the backups, so copying aside stays on the same disk
+    workdir = tempfile.mkdtemp(prefix="payroll-backup-", dir=backup_dir)
+    try:
+        backend = get_backend()
+        locked = lock is not None and backend.BACKUP_NEEDS_LOCK
+        if locked:
+            lock.acquire()
+        try:
+            copies = {}
+            for name, path in backend.backup_files(workdir).items():
+                if path != name:
+                    # A private copy already (like SQLite's online backup)
+                    copies[name] = (None, path)
+                    continue
+                signature = _signature(path)
+                if previous.get(name, {}).get('signature') == signature:
+                    # Unchanged live file: reuse its chunk list without reading it
+                    files[name] = previous[name]
+                    continue
+                copy_path = os.path.join(workdir, f"live-{len(copies)}")
+                shutil.copyfile(path, copy_path)
+                copies[name] = (signature, copy_path)
+        finally:
+            if locked:
+                lock.release()
+        for name, (signature, path) in copies.items():
+            files[name] = {'signature': signature, 'size': os.path.getsize(path), 'chunks': _store_chunks(path, backup_dir)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    unchanged = {name: entry['chunks'] for name, entry in files.items()} == \
+        {name: entry['chunks'] for name, entry in previous.items()}
+    if existing and unchanged:
+        logging.debug("[backup] No changes since the last snapshot")
+        return None
+    snapshot_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    if existing and snapshot_id <= existing[-1]:
+        snapshot_id = f"{existing[-1]}-{len(existing)}"
+    _write_atomic(
+        os.path.join(_snapshots_dir(backup_dir), snapshot_id + ".json"),
+        json.dumps({'created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'files': files}, indent=2),
+        mode='w',
+    )
+    added = sum(entry['size'] for name, entry in files.items() if previous.get(name, {}).get('chunks') != entry['chunks'])
+    logging.info(f"[backup] Snapshot {snapshot_id}: {len(files)} files, {added} bytes changed")
+    return snapshot_id
+
+def prune_snapshots(keep_last=BACKUP_KEEP_LAST, keep_daily=BACKUP_KEEP_DAILY, backup_dir=BACKUP_DIR):
+    """Apply the retention rules, then delete chunks no snapshot refers to any more."""
+    snapshots = list_snapshots(backup_dir)
+    keep = set(snapshots[-keep_last:]) if keep_last > 0 else set()
+    newest_per_day = {}
+    for snapshot_id in snapshots:
+        newest_per_day[snapshot_id[:8]] = snapshot_id
+    for day in sorted(newest_per_day)[-keep_daily:] if keep_daily > 0 else []:
+        keep.add(newest_per_day[day])
+    for snapshot_id in snapshots:
+        if snapshot_id not in keep:
+            os.remove(os.path.join(_snapshots_dir(backup_dir), snapshot_id + ".json"))
+            logging.info(f"[backup] Removed snapshot {snapshot_id}")
+    referenced = set()
+    for snapshot_id in keep:
+        for entry in load_snapshot(snapshot_id, backup_dir)['files'].values():
+            referenced.update(entry['chunks'])
+    for name in os.listdir(_objects_dir(backup_dir)):
+        if name not in referenced:
+            os.remove(os.path.join(_objects_dir(backup_dir), name))
+
+def restore_snapshot(snapshot_id, backup_dir=BACKUP_DIR):
+    """Put the storage files back exactly as they were in `snapshot_id`.
+
+    Run it with the app stopped: storage files the snapshot doesn't have
+    (a newer journal, SQLite's -wal) are removed so nothing is replayed on
+    top of the restored data.
+    """
+    files = load_snapshot(snapshot_id, backup_dir)['files']
+    for path in get_backend().storage_files():
+        if path not in files:
+            os.remove(path)
+    for name, entry in files.items():
+        if os.path.dirname(name):
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+        content = b"".join(_read_chunk(digest, backup_dir) for digest in entry['chunks'])
+        _write_atomic(name, content)
+    logging.info(f"[backup] Restored snapshot {snapshot_id} ({len(files)} files)")
+
+class BackupScheduler(threading.Thread):
+    """Snapshot and prune every `interval` seconds on a background thread."""
+
+    def __init__(self, lock=None, interval=BACKUP_INTERVAL, backup_dir=BACKUP_DIR):
+        super().__init__(name="backup-scheduler", daemon=True)
+        self.lock = lock
+        self.interval = interval
+        self.backup_dir = backup_dir
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                if create_snapshot(self.lock, self.backup_dir):
+                    prune_snapshots(backup_dir=self.backup_dir)
+            except Exception as e:
+                logging.error(f"[backup] Snapshot failed: {e}")
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "create":
+        print(create_snapshot() or "No changes since the last snapshot")
+    elif command == "prune":
+        prune_snapshots()
+    elif command == "restore" and len(sys.argv) > 2:
+        restore_snapshot(sys.argv[2])
+    elif command == "list":
+        for snapshot_id in list_snapshots():
+            snapshot = load_snapshot(snapshot_id)
+            print(snapshot_id, snapshot['created'], len(snapshot['files']), "files")
+    else:
+        print("usage: python backup.py [list | create | prune | restore <snapshot id>]")
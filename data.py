@@ -1,67 +1,52 @@
-
 import csv
 import json
 import os
 import hashlib
-from payrollutils import calculate_hours
+import pickle
+from payrollutils import calculate_hours, parse_timestamp, format_timestamp
 import logging
+import threading
 
 # File paths for local storage
 EMPLOYEES_FILE = "employees.csv"
+# Pre-partitioning layout: read until the first checkpoint, afterwards only
+# written on demand by export_time_logs()
 TIME_LOGS_FILE = "timelogs.json"
-BACKUP_TIME_LOGS_FILE = "timelogs_backup.json"
+# Sessions checkpointed into one file per clock-out month, described by a manifest
+TIME_LOGS_DIR = "timelogs"
+TIME_LOGS_MANIFEST_FILE = os.path.join(TIME_LOGS_DIR, "manifest.json")
+# Append-only journal of clock events, replayed on top of TIME_LOGS_FILE
+TIME_LOGS_JOURNAL_FILE = "timelogs.journal"
+# Same idea for single-employee upserts/deletes on top of EMPLOYEES_FILE
+EMPLOYEES_JOURNAL_FILE = "employees.journal"
 ADMIN_PIN_HASH = hashlib.sha256("5197".encode()).hexdigest()  # Admin PIN: 5197
 
-def init_employees_file():
-    if not os.path.exists(EMPLOYEES_FILE):
-        with open(EMPLOYEES_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "employee_id",
-                "name",
-                "hourly_rate",
-                "ssn",
-                "address",
-                "email",
-                "visa_status",
-                "w4_nonresident_alien",
-                "payment_method",
-                "bank_routing",
-                "bank_account",
-                "payroll_card_id",
-                "pin"
-            ])
+# Storage backend: "files" (employees.csv + timelogs.json) or "sqlite"
+STORAGE_BACKEND = os.getenv("PAYROLL_STORAGE", "files").lower()
+DATABASE_FILE = os.getenv("PAYROLL_DB", "payroll.db")
 
-def load_employees():
-    employees = {}
-    try:
-        with open(EMPLOYEES_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Backward compatibility for older CSVs without new columns
-                def get_val(key, default=""):
-                    return row[key] if key in row and row[key] is not None else default
-
-                employees[row['employee_id']] = {
-                    'name': get_val('name'),
-                    'hourly_rate': float(get_val('hourly_rate', 0) or 0),
-                    'ssn': get_val('ssn'),
-                    'address': get_val('address'),
-                    'email': get_val('email'),
-                    'visa_status': get_val('visa_status'),
-                    'w4_nonresident_alien': get_val('w4_nonresident_alien'),
-                    'payment_method': get_val('payment_method'),
-                    'bank_routing': get_val('bank_routing'),
-                    'bank_account': get_val('bank_account'),
-                    'payroll_card_id': get_val('payroll_card_id'),
-                    'pin': get_val('pin'),
-                }
-    except FileNotFoundError:
-        init_employees_file()
-    return employees
+# Pickled copies of the parsed employees/time logs (file backend), keyed on
+# the source files' inode/mtime/size, so a warm start skips CSV/JSON parsing.
+# Bump STARTUP_CACHE_FORMAT whenever the in-memory structures change shape.
+STARTUP_CACHE_DIR = os.getenv("PAYROLL_CACHE_DIR", ".cache")
+STARTUP_CACHE_FORMAT = 1
 
-def save_employee(
-    employee_id,
+EMPLOYEE_FIELDS = [
+    "name",
+    "hourly_rate",
+    "ssn",
+    "address",
+    "email",
+    "visa_status",
+    "w4_nonresident_alien",
+    "payment_method",
+    "bank_routing",
+    "bank_account",
+    "payroll_card_id",
+    "pin",
+]
+
+def employee_record(
     name,
     hourly_rate,
     ssn,
@@ -75,8 +60,7 @@ def save_employee(
     payroll_card_id="",
     pin="",
 ):
-    employees = load_employees()
-    employees[employee_id] = {
+    return {
         'name': name,
         'hourly_rate': hourly_rate,
         'ssn': ssn,
@@ -90,66 +74,782 @@ def save_employee(
         'payroll_card_id': payroll_card_id,
         'pin': pin,
     }
-    with open(EMPLOYEES_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "employee_id",
-            "name",
-            "hourly_rate",
-            "ssn",
-            "address",
-            "email",
-            "visa_status",
-            "w4_nonresident_alien",
-            "payment_method",
-            "bank_routing",
-            "bank_account",
-            "payroll_card_id",
-            "pin",
+
+class Session:
+    """One completed clock-in/clock-out pair, stored compactly.
+
+    Times are int seconds from payrollutils.parse_timestamp and the location
+    is a bare lat/lon pair. Item access mirrors the JSON form
+    (`session['clock_out']`, `'location' in session`), which from_dict and
+    to_dict convert to and from at the storage edges.
+    """
+
+    __slots__ = ('clock_in_ts', 'clock_out_ts', 'hours', 'manager_override', 'lat', 'lon')
+
+    def __init__(self, clock_in_ts, clock_out_ts, hours, manager_override=None, lat=None, lon=None):
+        self.clock_in_ts = clock_in_ts
+        self.clock_out_ts = clock_out_ts
+        self.hours = hours
+        self.manager_override = manager_override
+        self.lat = lat
+        self.lon = lon
+
+    @classmethod
+    def from_dict(cls, data):
+        location = data.get('location') or {}
+        lat, lon = location.get('lat'), location.get('lon')
+        if lat is None or lon is None:
+            lat = lon = None
+        return cls(
+            parse_timestamp(data['clock_in']),
+            parse_timestamp(data['clock_out']),
+            data['hours'],
+            data.get('manager_override'),
+            lat,
+            lon,
+        )
+
+    def to_dict(self):
+        data = {
+            'clock_in': format_timestamp(self.clock_in_ts),
+            'clock_out': format_timestamp(self.clock_out_ts),
+            'hours': self.hours,
+        }
+        if self.lat is not None:
+            data['location'] = {'lat': self.lat, 'lon': self.lon}
+        if self.manager_override is not None:
+            data['manager_override'] = self.manager_override
+        return data
+
+    def __getitem__(self, key):
+        if key == 'clock_in':
+            return format_timestamp(self.clock_in_ts)
+        if key == 'clock_out':
+            return format_timestamp(self.clock_out_ts)
+        if key == 'hours':
+            return self.hours
+        if key == 'location' and self.lat is not None:
+            return {'lat': self.lat, 'lon': self.lon}
+        if key == 'manager_override' and self.manager_override is not None:
+            return self.manager_override
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, changes):
+        """Apply a partial dict in JSON form, like an 'edit' event's changes."""
+        if 'clock_in' in changes:
+            self.clock_in_ts = parse_timestamp(changes['clock_in'])
+        if 'clock_out' in changes:
+            self.clock_out_ts = parse_timestamp(changes['clock_out'])
+        if 'hours' in changes:
+            self.hours = changes['hours']
+        if 'manager_override' in changes:
+            self.manager_override = changes['manager_override']
+        if 'location' in changes:
+            location = changes['location'] or {}
+            self.lat, self.lon = location.get('lat'), location.get('lon')
+
+    def __eq__(self, other):
+        if isinstance(other, Session):
+            return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __deepcopy__(self, memo):
+        # Every field is immutable
+        return Session(self.clock_in_ts, self.clock_out_ts, self.hours, self.manager_override, self.lat, self.lon)
+
+    def __repr__(self):
+        return f"Session({self.to_dict()!r})"
+
+def to_json(value):
+    """json.dump(default=...) hook for structures holding Session objects."""
+    if isinstance(value, Session):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _since_ts(since):
+    # `since` is a date ('YYYY-MM-DD') or a full timestamp
+    return parse_timestamp(since if len(since) > 10 else since + " 00:00:00")
+
+def _read_startup_cache(name, key):
+    try:
+        with open(os.path.join(STARTUP_CACHE_DIR, name + ".pickle"), 'rb') as f:
+            cached_key, value = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"[startup cache] Ignoring unreadable {name} cache: {e}")
+        return None
+    return value if cached_key == key else None
+
+def _write_startup_cache(name, key, value):
+    path = os.path.join(STARTUP_CACHE_DIR, name + ".pickle")
+    try:
+        os.makedirs(STARTUP_CACHE_DIR, exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        # Only a missed speed-up; the next start parses again
+        logging.warning(f"[startup cache] Could not write {name} cache: {e}")
+
+def _file_signature(*paths):
+    """(inode, mtime, size) per path; changes whenever any of the files is rewritten or appended to."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+class FileBackend:
+    """employees.csv, timelogs.json and the clock-event journal."""
+
+    # backup_files() hands out the live files: list and read them under the write lock
+    BACKUP_NEEDS_LOCK = True
+
+    def employees_version(self):
+        return _file_signature(EMPLOYEES_FILE, EMPLOYEES_JOURNAL_FILE)
+
+    def time_logs_version(self):
+        return _file_signature(TIME_LOGS_MANIFEST_FILE, TIME_LOGS_FILE, TIME_LOGS_JOURNAL_FILE)
+
+    def init_employees_file(self):
+        if not os.path.exists(EMPLOYEES_FILE):
+            with open(EMPLOYEES_FILE, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["employee_id"] + EMPLOYEE_FIELDS)
+
+    def load_employees(self):
+        key = (STARTUP_CACHE_FORMAT, self.employees_version())
+        employees = _read_startup_cache('employees', key)
+        if employees is None:
+            employees = self.parse_employees()
+            # Only freshly compacted state is worth caching; with a journal the key changes on every write
+            if self.journal_empty(EMPLOYEES_JOURNAL_FILE):
+                _write_startup_cache('employees', key, employees)
+        return employees
+
+    def parse_employees(self):
+        employees = {}
+        try:
+            with open(EMPLOYEES_FILE, 'r') as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    # Backward compatibility for older CSVs without new columns
+                    def get_val(key, default=""):
+                        return row[key] if key in row and row[key] is not None else default
+
+                    record = {key: get_val(key) for key in EMPLOYEE_FIELDS}
+                    record['hourly_rate'] = float(get_val('hourly_rate', 0) or 0)
+                    employees[row['employee_id']] = record
+        except FileNotFoundError:
+            self.init_employees_file()
+        for event in self.read_journal(EMPLOYEES_JOURNAL_FILE):
+            if event['type'] == 'upsert':
+                employees[event['employee_id']] = event['record']
+            elif event['type'] == 'delete':
+                employees.pop(event['employee_id'], None)
+        return employees
+
+    def save_employee(self, employee_id, record):
+        self.append_journal(EMPLOYEES_JOURNAL_FILE, [{'type': 'upsert', 'employee_id': employee_id, 'record': record}])
+
+    def upsert_employees(self, employees):
+        self.append_journal(EMPLOYEES_JOURNAL_FILE, [
+            {'type': 'upsert', 'employee_id': emp_id, 'record': record} for emp_id, record in employees.items()
         ])
-        for emp_id, data in employees.items():
-            writer.writerow([
-                emp_id,
-                data.get('name', ''),
-                data.get('hourly_rate', 0),
-                data.get('ssn', ''),
-                data.get('address', ''),
-                data.get('email', ''),
-                data.get('visa_status', ''),
-                data.get('w4_nonresident_alien', ''),
-                data.get('payment_method', ''),
-                data.get('bank_routing', ''),
-                data.get('bank_account', ''),
-                data.get('payroll_card_id', ''),
-                data.get('pin', ''),
-            ])
+
+    def delete_employee(self, employee_id):
+        self.append_journal(EMPLOYEES_JOURNAL_FILE, [{'type': 'delete', 'employee_id': employee_id}])
+
+    def save_employees(self, employees):
+        tmp_path = EMPLOYEES_FILE + ".tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["employee_id"] + EMPLOYEE_FIELDS)
+            for emp_id, data in employees.items():
+                writer.writerow([emp_id] + [data.get(key, 0 if key == 'hourly_rate' else '') for key in EMPLOYEE_FIELDS])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, EMPLOYEES_FILE)
+        self.truncate_journal(EMPLOYEES_JOURNAL_FILE)
+
+    def compact_employees(self):
+        if os.path.exists(EMPLOYEES_JOURNAL_FILE) and os.path.getsize(EMPLOYEES_JOURNAL_FILE) > 0:
+            employees = self.load_employees()
+            self.save_employees(employees)
+            # Warm the startup cache for the files we just wrote
+            _write_startup_cache('employees', (STARTUP_CACHE_FORMAT, self.employees_version()), employees)
+
+    # Partition layout: TIME_LOGS_MANIFEST_FILE holds each employee's clock
+    # state and session count plus, per month, the partition file name, a
+    # digest of its contents, its clock_out range and per-employee counts.
+    # Partition files map employee_id -> [[session_index, session], ...] so
+    # sessions keep their position in the employee's full history.
+
+    def read_manifest(self):
+        try:
+            with open(TIME_LOGS_MANIFEST_FILE, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read_partition(self, manifest, month):
+        with open(os.path.join(TIME_LOGS_DIR, manifest['partitions'][month]['file']), 'r') as f:
+            partition = json.load(f)
+        return {
+            employee_id: [(index, Session.from_dict(session)) for index, session in indexed]
+            for employee_id, indexed in partition.items()
+        }
+
+    def write_file(self, path, content):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_time_logs(self):
+        key = (STARTUP_CACHE_FORMAT, self.time_logs_version())
+        logs = _read_startup_cache('time_logs', key)
+        if logs is None:
+            logs = self.parse_time_logs()
+            if self.journal_empty(TIME_LOGS_JOURNAL_FILE):
+                _write_startup_cache('time_logs', key, logs)
+        return logs
+
+    def parse_time_logs(self):
+        manifest = self.read_manifest()
+        if manifest is None:
+            try:
+                with open(TIME_LOGS_FILE, 'r') as f:
+                    logs = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                logs = {}
+            for entry in logs.values():
+                entry['sessions'] = [Session.from_dict(session) for session in entry.get('sessions', [])]
+        else:
+            logs = {}
+            for employee_id, state in manifest['employees'].items():
+                entry = {key: value for key, value in state.items() if key != 'session_count'}
+                entry['sessions'] = [None] * state['session_count']
+                logs[employee_id] = entry
+            for month in manifest['partitions']:
+                for employee_id, indexed in self.read_partition(manifest, month).items():
+                    for index, session in indexed:
+                        logs[employee_id]['sessions'][index] = session
+        for event in self.read_journal(TIME_LOGS_JOURNAL_FILE):
+            apply_time_log_event(logs, event)
+        return logs
+
+    def journal_overlay(self, manifest):
+        """What the journal changes on top of the partitions.
+
+        Returns (employee_ids whose partitioned history was deleted,
+        {(employee_id, session_index): merged edit changes} for partitioned
+        sessions, {employee_id: {session_index: Session}} clocked out since
+        the last checkpoint).
+        """
+        counts = {emp_id: state['session_count'] for emp_id, state in manifest['employees'].items()}
+        deleted = set()
+        edits = {}
+        appended = {}
+        for event in self.read_journal(TIME_LOGS_JOURNAL_FILE):
+            emp_id = event['employee_id']
+            if event['type'] == 'clock_out':
+                index = counts.get(emp_id, 0)
+                counts[emp_id] = index + 1
+                appended.setdefault(emp_id, {})[index] = Session.from_dict(event['session'])
+            elif event['type'] == 'edit':
+                index = event['session_index']
+                if index in appended.get(emp_id, {}):
+                    appended[emp_id][index].update(event['changes'])
+                elif emp_id not in deleted:
+                    edits.setdefault((emp_id, index), {}).update(event['changes'])
+            elif event['type'] == 'delete':
+                deleted.add(emp_id)
+                counts[emp_id] = 0
+                appended.pop(emp_id, None)
+                for key in [key for key in edits if key[0] == emp_id]:
+                    del edits[key]
+        return deleted, edits, appended
+
+    def iter_indexed_sessions(self, employee_id=None, start=None, end=None):
+        """Yield (employee_id, session_index, session) with start <= clock_out < end.
+
+        Reads one month partition at a time and skips partitions outside the
+        range, so memory is bounded by the largest month, not the history.
+        """
+        start_ts = _since_ts(start) if start else None
+        end_ts = _since_ts(end) if end else None
+
+        def in_range(ts):
+            return (start_ts is None or ts >= start_ts) and (end_ts is None or ts < end_ts)
+
+        manifest = self.read_manifest()
+        if manifest is None:
+            # Not partitioned yet (before the first compaction): no way around a full load
+            for emp_id, entry in self.load_time_logs().items():
+                if employee_id is None or emp_id == employee_id:
+                    for index, session in enumerate(entry.get('sessions', [])):
+                        if in_range(session.clock_out_ts):
+                            yield emp_id, index, session
+            return
+        deleted, edits, appended = self.journal_overlay(manifest)
+        # Older sessions edited into the range live in partitions we'd otherwise skip
+        edited_in = {
+            emp_id for (emp_id, index), changes in edits.items()
+            if 'clock_out' in changes and in_range(parse_timestamp(changes['clock_out']))
+        }
+        partitions = manifest['partitions']
+        for month in sorted(partitions):
+            info = partitions[month]
+            if employee_id is not None and employee_id not in info['employees']:
+                continue
+            overlaps = ((start_ts is None or parse_timestamp(info['max_clock_out']) >= start_ts)
+                        and (end_ts is None or parse_timestamp(info['min_clock_out']) < end_ts))
+            if not overlaps and edited_in.isdisjoint(info['employees']):
+                continue
+            for emp_id, indexed in self.read_partition(manifest, month).items():
+                if emp_id in deleted or (employee_id is not None and emp_id != employee_id):
+                    continue
+                for index, session in indexed:
+                    changes = edits.get((emp_id, index))
+                    if changes:
+                        session.update(changes)
+                    if in_range(session.clock_out_ts):
+                        yield emp_id, index, session
+        for emp_id, indexed in appended.items():
+            if employee_id is None or emp_id == employee_id:
+                for index, session in indexed.items():
+                    if in_range(session.clock_out_ts):
+                        yield emp_id, index, session
+
+    def iter_time_logs(self, employee_id=None, start=None, end=None):
+        for emp_id, _, session in self.iter_indexed_sessions(employee_id, start, end):
+            yield emp_id, session
+
+    def load_sessions_since(self, since, employee_id=None):
+        sessions = {}
+        for emp_id, index, session in self.iter_indexed_sessions(employee_id, start=since):
+            sessions.setdefault(emp_id, {})[index] = session
+        return {emp_id: [indexed[index] for index in sorted(indexed)] for emp_id, indexed in sessions.items()}
+
+    def save_time_logs(self, logs):
+        os.makedirs(TIME_LOGS_DIR, exist_ok=True)
+        manifest = self.read_manifest() or {'generation': 0, 'partitions': {}}
+        generation = manifest['generation'] + 1
+        employees = {}
+        grouped = {}
+        for employee_id, entry in logs.items():
+            state = {key: value for key, value in entry.items() if key != 'sessions'}
+            sessions = entry.get('sessions', [])
+            state['session_count'] = len(sessions)
+            employees[employee_id] = state
+            for index, session in enumerate(sessions):
+                if not isinstance(session, Session):
+                    session = Session.from_dict(session)
+                month = format_timestamp(session.clock_out_ts)[:7]
+                grouped.setdefault(month, {}).setdefault(employee_id, []).append([index, session])
+        partitions = {}
+        for month in sorted(grouped):
+            content = json.dumps(grouped[month], indent=2, default=to_json)
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            previous = manifest['partitions'].get(month)
+            if previous and previous['sha256'] == digest:
+                partitions[month] = previous
+                continue
+            filename = f"{month}.{generation}.json"
+            self.write_file(os.path.join(TIME_LOGS_DIR, filename), content)
+            clock_outs = [session.clock_out_ts for indexed in grouped[month].values() for _, session in indexed]
+            partitions[month] = {
+                'file': filename,
+                'sha256': digest,
+                'min_clock_out': format_timestamp(min(clock_outs)),
+                'max_clock_out': format_timestamp(max(clock_outs)),
+                'employees': {employee_id: len(indexed) for employee_id, indexed in grouped[month].items()},
+            }
+        # The manifest is the commit point: until it's replaced, readers see the old partitions
+        self.write_file(TIME_LOGS_MANIFEST_FILE, json.dumps(
+            {'generation': generation, 'employees': employees, 'partitions': partitions}, indent=2))
+        # Everything in the journal is now part of the partitions
+        self.truncate_journal(TIME_LOGS_JOURNAL_FILE)
+        live = {info['file'] for info in partitions.values()} | {os.path.basename(TIME_LOGS_MANIFEST_FILE)}
+        for filename in os.listdir(TIME_LOGS_DIR):
+            if filename not in live and filename.endswith(".json"):
+                os.remove(os.path.join(TIME_LOGS_DIR, filename))
+
+    def storage_files(self):
+        """Every file that currently makes up the stored data."""
+        files = [EMPLOYEES_FILE, EMPLOYEES_JOURNAL_FILE, TIME_LOGS_JOURNAL_FILE]
+        # Once partitioned, timelogs.json is at most an export, not stored data
+        if not os.path.exists(TIME_LOGS_MANIFEST_FILE):
+            files.insert(2, TIME_LOGS_FILE)
+        if os.path.isdir(TIME_LOGS_DIR):
+            files.extend(
+                os.path.join(TIME_LOGS_DIR, filename)
+                for filename in sorted(os.listdir(TIME_LOGS_DIR))
+                if filename.endswith(".json")
+            )
+        return [path for path in files if os.path.exists(path)]
+
+    def backup_files(self, workdir):
+        """{stored path: path to read it from} for a backup. These are the live
+        files, so callers hold the write lock while listing and reading them."""
+        return {path: path for path in self.storage_files()}
+
+    def compact_time_logs(self):
+        journal_pending = os.path.exists(TIME_LOGS_JOURNAL_FILE) and os.path.getsize(TIME_LOGS_JOURNAL_FILE) > 0
+        unpartitioned = not os.path.exists(TIME_LOGS_MANIFEST_FILE) and os.path.exists(TIME_LOGS_FILE)
+        if journal_pending or unpartitioned:
+            logs = self.load_time_logs()
+            self.save_time_logs(logs)
+            _write_startup_cache('time_logs', (STARTUP_CACHE_FORMAT, self.time_logs_version()), logs)
+
+    def read_journal(self, path):
+        try:
+            with open(path, 'r') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write after a crash; everything before it is intact
+                        logging.warning(f"[read_journal] Skipping unreadable journal line {line_no}")
+        except FileNotFoundError:
+            return
+
+    def journal_empty(self, path):
+        return not os.path.exists(path) or os.path.getsize(path) == 0
+
+    def append_journal(self, path, events):
+        records = "".join(json.dumps(event, separators=(',', ':')) + "\n" for event in events)
+        with open(path, 'a') as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def truncate_journal(self, path):
+        with open(path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_time_log_event(self, event):
+        self.append_journal(TIME_LOGS_JOURNAL_FILE, [event])
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "sqlite":
+            from sqlite_store import SQLiteBackend, migrate_files_to_sqlite
+            if not os.path.exists(DATABASE_FILE) and os.path.exists(EMPLOYEES_FILE):
+                # First run against SQLite: carry over the existing CSV/JSON data
+                _backend = migrate_files_to_sqlite(DATABASE_FILE)
+            else:
+                _backend = SQLiteBackend(DATABASE_FILE)
+        else:
+            _backend = FileBackend()
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+class EmployeeStore:
+    """Employees indexed by ID, loaded from the backend once per process.
+
+    Upserts and deletes touch a single record in memory and a single
+    record (journal line or table row) in storage.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._employees = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    def all(self):
+        """The live index, reloaded in place if storage changed behind our back."""
+        with self._lock:
+            version = self.backend.employees_version()
+            if self._employees is None:
+                self._employees = self.backend.load_employees()
+            elif version != self._version:
+                logging.info("[EmployeeStore] Employee storage changed on disk, reloading")
+                employees = self.backend.load_employees()
+                self._employees.clear()
+                self._employees.update(employees)
+            self._version = version
+            return self._employees
+
+    def version(self):
+        """The storage version the index matches; it changes whenever the index does."""
+        with self._lock:
+            self.all()
+            return self._version
+
+    def _written(self):
+        # Our own write is already applied in memory; don't reload for it
+        self._version = self.backend.employees_version()
+
+    def get(self, employee_id):
+        return self.all().get(employee_id)
+
+    def upsert(self, employee_id, record):
+        with self._lock:
+            index = self.all()
+            self.backend.save_employee(employee_id, record)
+            index[employee_id] = record
+            self._written()
+
+    def upsert_many(self, employees):
+        with self._lock:
+            index = self.all()
+            self.backend.upsert_employees(employees)
+            index.update(employees)
+            self._written()
+
+    def delete(self, employee_id):
+        with self._lock:
+            index = self.all()
+            if employee_id not in index:
+                return False
+            self.backend.delete_employee(employee_id)
+            del index[employee_id]
+            self._written()
+            return True
+
+    def replace_all(self, employees):
+        with self._lock:
+            index = self.all()
+            self.backend.save_employees(employees)
+            index.clear()
+            index.update(employees)
+            self._written()
+
+_employee_store = None
+
+def get_employee_store():
+    global _employee_store
+    if _employee_store is None or _employee_store.backend is not get_backend():
+        _employee_store = EmployeeStore(get_backend())
+    return _employee_store
+
+def init_employees_file():
+    if isinstance(get_backend(), FileBackend):
+        get_backend().init_employees_file()
+
+def load_employees():
+    """The shared {employee_id: record} index. Treat it as read-only and
+    change it through save_employee/delete_employee/upsert_employees."""
+    return get_employee_store().all()
+
+def save_employee(
+    employee_id,
+    name,
+    hourly_rate,
+    ssn,
+    address,
+    email="",
+    visa_status="",
+    w4_nonresident_alien="",
+    payment_method="",
+    bank_routing="",
+    bank_account="",
+    payroll_card_id="",
+    pin="",
+):
+    get_employee_store().upsert(employee_id, employee_record(
+        name,
+        hourly_rate,
+        ssn,
+        address,
+        email,
+        visa_status,
+        w4_nonresident_alien,
+        payment_method,
+        bank_routing,
+        bank_account,
+        payroll_card_id,
+        pin,
+    ))
+
+def upsert_employees(employees):
+    """Bulk insert/update of {employee_id: record} without touching other rows."""
+    get_employee_store().upsert_many(employees)
+
+def delete_employee(employee_id):
+    return get_employee_store().delete(employee_id)
+
+def save_employees(employees):
+    """Replace the stored roster with `employees` ({employee_id: record})."""
+    get_employee_store().replace_all(employees)
 
 def load_time_logs():
-    try:
-        with open(TIME_LOGS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+    """The stored time logs as {employee_id: {'name', 'clock_in', 'sessions', ...}}."""
+    return get_backend().load_time_logs()
+
+def load_sessions_since(since, employee_id=None):
+    """{employee_id: [session, ...]} for sessions with clock_out >= since.
+
+    Reads only the partitions (or index ranges) that can contain them, so
+    pay-period and year-to-date queries don't pay for the whole history.
+    """
+    return get_backend().load_sessions_since(since, employee_id)
+
+def iter_time_logs(employee_id=None, start=None, end=None):
+    """Lazily yield (employee_id, session) for sessions with start <= clock_out < end.
+
+    start/end are dates ('YYYY-MM-DD') or timestamps and either may be None.
+    Memory stays bounded by one month partition (file backend) or one row
+    (SQLite) however long the history is, which suits batch jobs like the
+    W-2 summary. Sessions come roughly in clock-out month order.
+    """
+    return get_backend().iter_time_logs(employee_id, start, end)
 
 def save_time_logs(logs):
-    with open(TIME_LOGS_FILE, 'w') as f:
-        json.dump(logs, f, indent=2)
-    with open(BACKUP_TIME_LOGS_FILE, 'w') as f:
-        json.dump(logs, f, indent=2)
-
-def edit_time_log_session(employee_id, session_index, new_clock_in, new_clock_out, manager_override=True):
-    logging.debug(f"[edit_time_log_session] Attempting to edit log for employee_id: {employee_id}, session_index: {session_index}")
-    logs = load_time_logs()
-    logging.debug(f"[edit_time_log_session] Logs before modification: {logs.get(employee_id)}")
-    if employee_id in logs and 'sessions' in logs[employee_id] and 0 <= session_index < len(logs[employee_id]['sessions']):
-        session = logs[employee_id]['sessions'][session_index]
-        session['clock_in'] = new_clock_in
-        session['clock_out'] = new_clock_out
-        session['hours'] = calculate_hours(new_clock_in, new_clock_out)
-        session['manager_override'] = manager_override
-        logging.debug(f"[edit_time_log_session] Log after modification (before save): {logs[employee_id]['sessions'][session_index]}")
-        save_time_logs(logs)
-        logging.debug(f"[edit_time_log_session] Logs after save: {load_time_logs().get(employee_id)}")
-        return True
-    logging.warning(f"[edit_time_log_session] Failed to find log entry for employee_id: {employee_id}, session_index: {session_index}")
-    return False
+    """Replace the stored time logs with `logs` in one go.
+
+    With the file backend this is the partition checkpoint (only months whose
+    contents changed are rewritten) and it also resets the journal; punches
+    go through record_clock_in/record_clock_out.
+    """
+    get_backend().save_time_logs(logs)
+
+def export_time_logs(path=TIME_LOGS_FILE):
+    """Write the current time logs to `path` in the single-file timelogs.json layout.
+
+    Works with either backend. Returns the number of sessions written.
+    """
+    backend = get_backend()
+    if (isinstance(backend, FileBackend) and backend.read_manifest() is None
+            and os.path.abspath(path) == os.path.abspath(TIME_LOGS_FILE)):
+        # Still the live store, with the journal replayed on top of it
+        raise ValueError(f"{TIME_LOGS_FILE} has not been partitioned yet; compact the time logs first")
+    logs = backend.load_time_logs()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(logs, f, indent=2, default=to_json)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return sum(len(entry.get('sessions', [])) for entry in logs.values())
+
+def compact_time_logs():
+    """Fold the journal into the time log partitions. Safe to call at startup."""
+    backend = get_backend()
+    if hasattr(backend, 'compact_time_logs'):
+        backend.compact_time_logs()
+
+def compact_storage():
+    """Fold both journals into employees.csv and the time log partitions (file backend only)."""
+    backend = get_backend()
+    if hasattr(backend, 'compact_employees'):
+        backend.compact_employees()
+    compact_time_logs()
+
+def append_time_log_event(event):
+    """Durably persist a single clock event (one fsync/commit per event)."""
+    get_backend().append_time_log_event(event)
+
+def apply_time_log_event(logs, event):
+    """Apply one journal event to an in-memory time log dict."""
+    employee_id = event['employee_id']
+    kind = event['type']
+    if kind == 'clock_in':
+        entry = {
+            'name': event.get('name', ''),
+            'clock_in': event['clock_in'],
+            'sessions': logs.get(employee_id, {}).get('sessions', []),
+        }
+        if event.get('last_location'):
+            entry['last_location'] = event['last_location']
+        if event.get('manager_override'):
+            entry['manager_override'] = True
+        logs[employee_id] = entry
+    elif kind == 'clock_out':
+        entry = logs.setdefault(employee_id, {'name': event.get('name', ''), 'sessions': []})
+        entry.setdefault('sessions', []).append(Session.from_dict(event['session']))
+        entry.pop('clock_in', None)
+    elif kind == 'edit':
+        sessions = logs.get(employee_id, {}).get('sessions', [])
+        index = event['session_index']
+        if 0 <= index < len(sessions):
+            sessions[index].update(event['changes'])
+    elif kind == 'delete':
+        logs.pop(employee_id, None)
+    else:
+        logging.warning(f"[apply_time_log_event] Unknown event type: {kind}")
+
+def record_time_log_event(logs, event):
+    # Persist first: if the append fails (disk full, database locked) the
+    # in-memory logs must still match what's stored
+    append_time_log_event(event)
+    apply_time_log_event(logs, event)
+
+def record_clock_in(logs, employee_id, name, clock_in, location=None, manager_override=False):
+    event = {'type': 'clock_in', 'employee_id': employee_id, 'name': name, 'clock_in': clock_in}
+    if location:
+        event['last_location'] = location
+    if manager_override:
+        event['manager_override'] = True
+    record_time_log_event(logs, event)
+    return logs[employee_id]
+
+def record_clock_out(logs, employee_id, clock_out, location=None, manager_override=False):
+    clock_in = logs[employee_id]['clock_in']
+    session = {
+        'clock_in': clock_in,
+        'clock_out': clock_out,
+        'hours': calculate_hours(clock_in, clock_out),
+    }
+    if location:
+        session['location'] = location
+    if manager_override:
+        session['manager_override'] = True
+    event = {'type': 'clock_out', 'employee_id': employee_id, 'name': logs[employee_id].get('name', ''), 'session': session}
+    record_time_log_event(logs, event)
+    return session
+
+def delete_time_logs(logs, employee_id):
+    if employee_id in logs:
+        record_time_log_event(logs, {'type': 'delete', 'employee_id': employee_id})
+
+if __name__ == "__main__":
+    import sys
+    # Go through the importable module so its Session class is the one the
+    # backends (and the startup cache) use, not this script's copy
+    from data import export_time_logs
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        path = sys.argv[2] if len(sys.argv) > 2 else TIME_LOGS_FILE
+        try:
+            logging.info(f"Exported {export_time_logs(path)} sessions to {path}")
+        except ValueError as e:
+            sys.exit(str(e))
+    else:
+        print("usage: python data.py export [path]")
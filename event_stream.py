@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+from repository import get_repository
+
+# Server-Sent Events: every repository ChangeEvent is pushed to the open
+# /events streams, so the admin page's tables update without polling.
+SSE_MAX_STREAMS = int(os.getenv("PAYROLL_SSE_MAX_STREAMS", "50"))
+# Comment line sent on idle streams so proxies (ngrok) keep them open and dead clients are noticed
+SSE_HEARTBEAT = 15
+# A client that can't take an event within this many seconds is dropped
+SSE_WRITE_TIMEOUT = 5
+# In shared (pre-fork) mode other processes' writes only arrive through
+# Repository.sync(), so an open stream checks for them this often
+SSE_SYNC_INTERVAL = 1
+
+def format_event(event, version):
+    data = json.dumps({'kind': event.kind, 'employee_id': event.employee_id, 'version': version})
+    return f"id: {version}\nevent: {event.kind}\ndata: {data}\n\n".encode()
+
+class EventStreams(threading.Thread):
+    """Writes repository changes to every open event stream socket.
+
+    Streams are handed over by the HTTP handler once their headers are out,
+    so they don't hold a request worker. Writes happen on this one thread,
+    so a slow client never holds up the writer that made the change.
+    """
+
+    def __init__(self, repository):
+        super().__init__(name="event-streams", daemon=True)
+        self.repository = repository
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.streams = []
+        repository.subscribe(self.on_change)
+
+    def on_change(self, event):
+        self.pending.put(format_event(event, self.repository.time_log_version))
+
+    def add(self, sock):
+        """Take over a connected socket whose response headers were sent. False if we're full."""
+        with self.lock:
+            if len(self.streams) >= SSE_MAX_STREAMS:
+                return False
+            sock.settimeout(SSE_WRITE_TIMEOUT)
+            self.streams.append(sock)
+        logging.info(f"[event_stream] Stream opened ({len(self.streams)} open)")
+        return True
+
+    def run(self):
+        shared = self.repository.process_lock is not None
+        idle = 0
+        while True:
+            try:
+                message = self.pending.get(timeout=SSE_SYNC_INTERVAL if shared else SSE_HEARTBEAT)
+                idle = 0
+            except queue.Empty:
+                if shared and self.streams:
+                    self.repository.sync()  # Publishes what other processes wrote
+                idle += SSE_SYNC_INTERVAL if shared else SSE_HEARTBEAT
+                if idle < SSE_HEARTBEAT:
+                    continue
+                idle = 0
+                message = b": keep-alive\n\n"
+            self.broadcast(message)
+
+    def broadcast(self, message):
+        with self.lock:
+            streams = list(self.streams)
+        dropped = []
+        for sock in streams:
+            try:
+                sock.sendall(message)
+            except OSError:
+                dropped.append(sock)
+        if dropped:
+            with self.lock:
+                self.streams = [sock for sock in self.streams if sock not in dropped]
+            for sock in dropped:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+            logging.info(f"[event_stream] Dropped {len(dropped)} closed stream(s) ({len(self.streams)} open)")
+
+_event_streams = None
+_event_streams_lock = threading.Lock()
+
+def get_event_streams():
+    """The process's EventStreams, started on first use for the current repository."""
+    global _event_streams
+    with _event_streams_lock:
+        if _event_streams is None or _event_streams.repository is not get_repository():
+            _event_streams = EventStreams(get_repository())
+            _event_streams.start()
+        return _event_streams
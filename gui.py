@@ -1,36 +1,23 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-from data import (
-    load_employees,
-    save_employee,
-    load_time_logs,
-    save_time_logs,
-    ADMIN_PIN_HASH,
-    edit_time_log_session,
-)
-from payrollutils import calculate_hours, calculate_pay_with_profile
+from data import ADMIN_PIN_HASH
+from payroll_engine import run_payroll
+from repository import get_repository, AlreadyClockedIn, NotClockedIn
+from payrollutils import normalize_timestamp
 import hashlib
 import datetime
-import csv
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import logging
 from logging.handlers import RotatingFileHandler
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
 import tkinter.ttk as ttk
-import server
+import queue
 
 class PayrollApp:
-    def __init__(self, root):
+    def __init__(self, root, repository=None):
         self.root = root
         self.root.title("Freezy Frenzy Payroll & Time Clock")
-        self.employees = load_employees()
-        self.time_logs = load_time_logs()
+        self.repo = repository or get_repository()
         # Load .env relative to project root to ensure variables are available
         try:
             this_dir = os.path.dirname(__file__)
@@ -56,8 +43,12 @@ class PayrollApp:
             pass
         self.root = root
         self.root.title("Freezy Frenzy Payroll & Time Clock")
-        self.employees = load_employees()
-        self.time_logs = load_time_logs()
+
+        # Changes made by the HTTP server thread arrive here and are applied
+        # on the Tk thread, one employee's rows at a time.
+        self.pending_changes = queue.Queue()
+        self.repo.subscribe(self.pending_changes.put)
+        self.root.after(250, self.apply_pending_changes)
 
         # Main frame
         self.main_frame = tk.Frame(root)
@@ -86,6 +77,32 @@ class PayrollApp:
         )
         tk.Label(self.main_frame, textvariable=self.status_var).pack(pady=10)
 
+    @property
+    def employees(self):
+        return self.repo.employees
+
+    @property
+    def time_logs(self):
+        return self.repo.time_logs
+
+    def apply_pending_changes(self):
+        touched_employees = set()
+        touched_time_logs = set()
+        while True:
+            try:
+                event = self.pending_changes.get_nowait()
+            except queue.Empty:
+                break
+            if event.kind in ("employee_saved", "employee_deleted"):
+                touched_employees.add(event.employee_id)
+            if event.kind != "employee_saved":
+                touched_time_logs.add(event.employee_id)
+        for emp_id in touched_employees:
+            self.refresh_employee_row(emp_id)
+        for emp_id in touched_time_logs:
+            self.refresh_time_log_rows(emp_id)
+        self.root.after(250, self.apply_pending_changes)
+
     def clock_in(self):
         employee_id = self.employee_id_entry.get()
         pin = self.pin_entry.get()
@@ -102,18 +119,14 @@ class PayrollApp:
             messagebox.showerror("Error", "Invalid PIN.")
             return
             
-        if employee_id in self.time_logs and self.time_logs[employee_id].get(
-            "clock_in"
-        ):
+        try:
+            self.repo.clock_in(
+                employee_id,
+                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        except AlreadyClockedIn:
             messagebox.showerror("Error", "Employee already clocked in.")
             return
-            
-        self.time_logs[employee_id] = {
-            "name": self.employees[employee_id]["name"],
-            "clock_in": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "sessions": self.time_logs.get(employee_id, {}).get("sessions", []),
-        }
-        save_time_logs(self.time_logs)
         self.status_var.set(
             f"{self.employees[employee_id]['name']} clocked in at {self.time_logs[employee_id]['clock_in']}."
         )
@@ -136,24 +149,17 @@ class PayrollApp:
             messagebox.showerror("Error", "Invalid PIN.")
             return
             
-        if (
-            not employee_id
-            or employee_id not in self.time_logs
-            or not self.time_logs[employee_id].get("clock_in")
-        ):
+        clock_out_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            session = self.repo.clock_out(employee_id, clock_out_time)
+        except NotClockedIn:
             messagebox.showerror("Error", "Employee not clocked in.")
             return
-        clock_out_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        hours = calculate_hours(self.time_logs[employee_id]["clock_in"], clock_out_time)
-        self.time_logs[employee_id]["sessions"].append(
-            {
-                "clock_in": self.time_logs[employee_id]["clock_in"],
-                "clock_out": clock_out_time,
-                "hours": hours,
-            }
-        )
-        del self.time_logs[employee_id]["clock_in"]
-        save_time_logs(self.time_logs)
+        except ValueError:
+            logging.exception(f"[clock_out] Could not clock out employee_id: {employee_id}")
+            messagebox.showerror("Error", "Could not clock out; ask a manager to correct the clock-in time.")
+            return
+        hours = session["hours"]
         self.status_var.set(
             f"{self.employees[employee_id]['name']} clocked out. Hours: {hours:.2f}."
         )
@@ -353,7 +359,7 @@ class PayrollApp:
         # Run Payroll Tab
         payroll_frame = tk.Frame(notebook)
         notebook.add(payroll_frame, text="Run Payroll")
-        tk.Button(payroll_frame, text="Run Payroll", command=self.run_payroll).pack(
+        tk.Button(payroll_frame, text="Run Payroll", command=self.start_payroll).pack(
             pady=20
         )
 
@@ -456,7 +462,7 @@ class PayrollApp:
             messagebox.showerror("Error", "Invalid hourly rate.")
             return
         current = self.employees[emp_id]
-        save_employee(
+        self.repo.save_employee(
             emp_id,
             name or current["name"],
             new_rate,
@@ -471,7 +477,6 @@ class PayrollApp:
             current.get("payroll_card_id", ""),
             pin or current.get("pin", ""),
         )
-        server.TimeClckHandler.employees = load_employees()
         messagebox.showinfo("Success", "Employee updated.")
 
     def update_payment_method(self, emp_id, method, routing, account, card_id):
@@ -479,7 +484,7 @@ class PayrollApp:
             messagebox.showerror("Error", "Employee ID not found.")
             return
         current = self.employees[emp_id]
-        save_employee(
+        self.repo.save_employee(
             emp_id,
             current["name"],
             current["hourly_rate"],
@@ -493,7 +498,6 @@ class PayrollApp:
             account or current.get("bank_account", ""),
             card_id or current.get("payroll_card_id", ""),
         )
-        self.employees = load_employees()
         messagebox.showinfo("Success", "Payment method updated.")
 
     def add_employee(
@@ -520,7 +524,7 @@ class PayrollApp:
             if emp_id in self.employees:
                 messagebox.showerror("Error", "Employee ID already exists.")
                 return
-            save_employee(
+            self.repo.save_employee(
                 emp_id,
                 name,
                 rate,
@@ -535,7 +539,6 @@ class PayrollApp:
                 payroll_card_id,
                 pin,
             )
-            self.employees = load_employees()
             print(f"[DEBUG] Employees after add: {self.employees}")
             # Update the employee menu if it exists (for backward compatibility)
             if hasattr(self, 'employee_menu'):
@@ -549,42 +552,6 @@ class PayrollApp:
             messagebox.showinfo("Success", "Employee added.")
         except ValueError:
             messagebox.showerror("Error", "Invalid hourly rate.")
-    
-    def save_all_employees(self):
-        """Save all employees to the CSV file"""
-        with open("employees.csv", "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "employee_id",
-                "name",
-                "hourly_rate",
-                "ssn",
-                "address",
-                "email",
-                "visa_status",
-                "w4_nonresident_alien",
-                "payment_method",
-                "bank_routing",
-                "bank_account",
-                "payroll_card_id",
-                "pin",
-            ])
-            for emp_id, data in self.employees.items():
-                writer.writerow([
-                    emp_id,
-                    data.get('name', ''),
-                    data.get('hourly_rate', 0),
-                    data.get('ssn', ''),
-                    data.get('address', ''),
-                    data.get('email', ''),
-                    data.get('visa_status', ''),
-                    data.get('w4_nonresident_alien', ''),
-                    data.get('payment_method', ''),
-                    data.get('bank_routing', ''),
-                    data.get('bank_account', ''),
-                    data.get('payroll_card_id', ''),
-                    data.get('pin', ''),
-                ])
 
     def populate_edit_fields_from_tree(self, emp_id):
         """Populate edit employee tab fields from tree selection"""
@@ -636,16 +603,9 @@ class PayrollApp:
         if emp_id in self.employees:
             emp_name = self.employees[emp_id]["name"]
             if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete employee {emp_name} (ID: {emp_id})?"):
-                # Remove from employees
-                del self.employees[emp_id]
-                # Remove from time logs if exists
-                if emp_id in self.time_logs:
-                    del self.time_logs[emp_id]
-                # Save changes
-                self.save_all_employees()
-                save_time_logs(self.time_logs)
-                # Refresh the table
-                self.populate_employee_table()
+                # Remove the employee and their time logs; the tables
+                # refresh from the change event
+                self.repo.delete_employee(emp_id)
                 messagebox.showinfo("Success", f"Employee {emp_name} has been deleted.")
 
     def show_context_menu_from_tree(self, event):
@@ -672,45 +632,55 @@ class PayrollApp:
                 self.employee_tree.delete(item)
             
             # Add employee data
-            for emp_id, emp_data in self.employees.items():
+            with self.repo.lock:
+                employee_items = list(self.employees.items())
+            for emp_id, emp_data in employee_items:
                 print(f"[DEBUG] Inserting employee: {emp_id}")
-                item_id = self.employee_tree.insert("", "end", iid=emp_id, values=(
-                    emp_id,
-                    emp_data.get("name", ""),
-                    f"${emp_data.get('hourly_rate', 0):.2f}",
-                    emp_data.get("ssn", ""),
-                    emp_data.get("address", "")[:50] + "..." if len(emp_data.get("address", "")) > 50 else emp_data.get("address", ""),
-                    emp_data.get("email", ""),
-                    emp_data.get("visa_status", ""),
-                    emp_data.get("w4_nonresident_alien", ""),
-                    emp_data.get("pin", "")
-                ))
+                item_id = self.employee_tree.insert("", "end", iid=emp_id, values=self.employee_row_values(emp_id, emp_data))
                 print(f"[DEBUG] Item inserted with ID: {item_id}")
             print(f"[DEBUG] Tree children: {self.employee_tree.get_children()}")
         else:
             print("[DEBUG] employee_tree not found")
 
+    def employee_row_values(self, emp_id, emp_data):
+        return (
+            emp_id,
+            emp_data.get("name", ""),
+            f"${emp_data.get('hourly_rate', 0):.2f}",
+            emp_data.get("ssn", ""),
+            emp_data.get("address", "")[:50] + "..." if len(emp_data.get("address", "")) > 50 else emp_data.get("address", ""),
+            emp_data.get("email", ""),
+            emp_data.get("visa_status", ""),
+            emp_data.get("w4_nonresident_alien", ""),
+            emp_data.get("pin", "")
+        )
+
+    def refresh_employee_row(self, emp_id):
+        """Update, add or remove a single row in the employee table"""
+        if not hasattr(self, 'employee_tree') or not self.employee_tree.winfo_exists():
+            return
+        emp_data = self.employees.get(emp_id)
+        if emp_data is None:
+            if self.employee_tree.exists(emp_id):
+                self.employee_tree.delete(emp_id)
+        elif self.employee_tree.exists(emp_id):
+            self.employee_tree.item(emp_id, values=self.employee_row_values(emp_id, emp_data))
+        else:
+            self.employee_tree.insert("", "end", iid=emp_id, values=self.employee_row_values(emp_id, emp_data))
+
     def override_clock_in(self, emp_id, clock_in_time):
         if not emp_id or emp_id not in self.employees:
             messagebox.showerror("Error", "Invalid Employee ID.")
             return
-        if emp_id in self.time_logs and self.time_logs[emp_id].get("clock_in"):
-            messagebox.showerror("Error", "Employee already clocked in.")
-            return
         try:
-            datetime.datetime.strptime(clock_in_time, "%Y-%m-%d %H:%M:%S")
-            self.time_logs[emp_id] = {
-                "name": self.employees[emp_id]["name"],
-                "clock_in": clock_in_time,
-                "sessions": self.time_logs.get(emp_id, {}).get("sessions", []),
-                "manager_override": True,
-            }
-            save_time_logs(self.time_logs)
-            self.time_logs = load_time_logs() # Reload time logs after saving
+            clock_in_time = normalize_timestamp(clock_in_time)
+            self.repo.clock_in(emp_id, clock_in_time, manager_override=True)
             messagebox.showinfo(
                 "Success",
                 f"Clock-in time set to {clock_in_time} for {self.employees[emp_id]['name']}.",
             )
+        except AlreadyClockedIn:
+            messagebox.showerror("Error", "Employee already clocked in.")
         except ValueError:
             messagebox.showerror(
                 "Error", "Invalid time format. Use YYYY-MM-DD HH:MM:SS."
@@ -720,401 +690,40 @@ class PayrollApp:
         if not emp_id or emp_id not in self.employees:
             messagebox.showerror("Error", "Invalid Employee ID.")
             return
-        if emp_id not in self.time_logs or not self.time_logs[emp_id].get("clock_in"):
-            messagebox.showerror("Error", "Employee not clocked in.")
-            return
         try:
-            datetime.datetime.strptime(clock_out_time, "%Y-%m-%d %H:%M:%S")
-            clock_in_time = self.time_logs[emp_id]["clock_in"]
-            hours = calculate_hours(clock_in_time, clock_out_time)
-            self.time_logs[emp_id]["sessions"].append(
-                {
-                    "clock_in": clock_in_time,
-                    "clock_out": clock_out_time,
-                    "hours": hours,
-                    "manager_override": True,
-                }
-            )
-            del self.time_logs[emp_id]["clock_in"]
-            save_time_logs(self.time_logs)
-            self.time_logs = load_time_logs() # Reload time logs after saving
+            clock_out_time = normalize_timestamp(clock_out_time)
+            session = self.repo.clock_out(emp_id, clock_out_time, manager_override=True)
+            hours = session["hours"]
             messagebox.showinfo(
                 "Success",
                 f"Clock-out time set to {clock_out_time} for {self.employees[emp_id]['name']}. Hours: {hours:.2f}",
             )
+        except NotClockedIn:
+            messagebox.showerror("Error", "Employee not clocked in.")
         except ValueError:
             messagebox.showerror(
                 "Error", "Invalid time format. Use YYYY-MM-DD HH:MM:SS."
             )
 
-    def run_payroll(self):
-        pay_period_start = (
-            datetime.datetime.now() - datetime.timedelta(days=14)
-        ).strftime("%Y-%m-%d")
-        report = [
-            "Payroll Report",
-            f"Pay Period: {pay_period_start} to {datetime.datetime.now().strftime('%Y-%m-%d')}\n",
-        ]
-        payments = [
-            ["employee_id", "name", "method", "routing", "account", "amount", "date"]
-        ]
-        tax_deposits = [["date", "federal_withholding_total"]]
-        total_federal = 0.0
-        os.makedirs("paystubs", exist_ok=True)
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        for emp_id, data in self.time_logs.items():
-            if "sessions" not in data:
-                continue
-            total_hours = sum(
-                session["hours"]
-                for session in data["sessions"]
-                if session["clock_out"] >= pay_period_start
-            )
-            if total_hours == 0:
-                continue
-            is_nra = str(
-                self.employees[emp_id].get("w4_nonresident_alien", "")
-            ).lower() in ["yes", "true", "1"]
-            rate = self.employees[emp_id]["hourly_rate"]
-            gross, federal_tax, state_tax, net_pay = calculate_pay_with_profile(
-                total_hours, rate, is_nra
-            )
-            report.append(f"Employee: {data['name']} (ID: {emp_id})")
-            report.append(f"SSN: {self.employees[emp_id]['ssn']}")
-            report.append(f"Address: {self.employees[emp_id]['address']}")
-            report.append(f"Total Hours: {total_hours:.2f}")
-            report.append(f"Gross Pay: ${gross:.2f}")
-            report.append(f"Federal Tax: ${federal_tax:.2f}")
-            report.append(f"State Tax: ${state_tax:.2f}")
-            report.append(f"Net Pay: ${net_pay:.2f}\n")
-
-            total_federal += federal_tax
-            method = self.employees[emp_id].get("payment_method", "") or "payroll_card"
-            routing = self.employees[emp_id].get("bank_routing", "")
-            account = self.employees[emp_id].get("bank_account", "")
-            payroll_card_id = self.employees[emp_id].get("payroll_card_id", "")
-            routing_mask = (routing[-4:]).rjust(len(routing), "•") if routing else ""
-            account_mask = (
-                (account[-4:]).rjust(len(account), "•") if account else payroll_card_id
+    def start_payroll(self):
+        if not self.repo.payroll_lock.acquire(blocking=False):
+            messagebox.showwarning(
+                "Payroll", "Payroll is already running. Try again when it finishes."
             )
-            payments.append(
-                [
-                    emp_id,
-                    data["name"],
-                    method,
-                    routing_mask,
-                    account_mask,
-                    f"{net_pay:.2f}",
-                    today,
-                ]
-            )
-
-            email_addr = self.employees[emp_id].get("email", "")
-            stub_path = os.path.join("paystubs", f"{emp_id}_{today}.html")
-            with open(stub_path, "w", encoding="utf-8") as sf:
-                sf.write(f"""
-                <html><body>
-                <h3>Paystub - {today}</h3>
-                <p>Employee: {data['name']} (ID: {emp_id})</p>
-                <p>Total Hours: {total_hours:.2f}</p>
-                <p>Hourly Rate: ${rate:.2f}</p>
-                <p>Gross Pay: ${gross:.2f}</p>
-                <p>Federal Tax: ${federal_tax:.2f}</p>
-                <p>State Tax: ${state_tax:.2f}</p>
-                <p>Net Pay: ${net_pay:.2f}</p>
-                <p>Payment Method: {method}</p>
-                </body></html>
-                """)
-
-            # PDF paystub (styled)
-            pdf_path = os.path.join("paystubs", f"{emp_id}_{today}.pdf")
-            c = canvas.Canvas(pdf_path, pagesize=LETTER)
-            width, height = LETTER
-            margin = 54
-
-            # Outer border removed for cleaner spacing
-
-            header_h = 70
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.roundRect(
-                margin,
-                height - margin - header_h,
-                width - 2 * margin,
-                header_h,
-                12,
-                stroke=0,
-                fill=1,
-            )
-            c.setFillColor(colors.white)
-            company_name = "Freezy Frenzy"
-            company_address = "17458 Northwest Fwy, Jersey Village, TX 77040"
-            c.setFont("Helvetica-Bold", 20)
-            c.drawString(margin + 16, height - margin - 40, f"{company_name}")
-            c.setFont("Helvetica", 10)
-            c.drawString(margin + 16, height - margin - 56, company_address)
-            c.setFont("Helvetica", 12)
-            c.drawRightString(
-                width - margin - 16, height - margin - 46, f"Paystub • {today}"
-            )
-
-            content_top = height - margin - header_h - 12
-
-            col_gap = 12
-            col_w = (width - 2 * margin - col_gap) / 2
-            box_h = 100
-            c.setStrokeColor(colors.HexColor("#8792B0"))
-            c.roundRect(margin, content_top - box_h, col_w, box_h, 8, stroke=1, fill=0)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + 10, content_top - 18, "Employee")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-            c.drawString(margin + 10, content_top - 36, f"Name: {data['name']}")
-            c.drawString(margin + 10, content_top - 52, f"Employee ID: {emp_id}")
-            addr = self.employees[emp_id].get("address", "") or ""
-            parts = [
-                p.strip() for p in addr.replace("\n", ", ").split(",") if p.strip()
-            ]
-            if len(parts) >= 3:
-                addr_line1 = ", ".join(parts[:-2])
-                addr_line2 = ", ".join(parts[-2:])
-            elif len(parts) == 2:
-                addr_line1 = parts[0]
-                addr_line2 = parts[1]
-            else:
-                words = addr.split()
-                split_index = max(1, min(len(words), len(words) // 2))
-                addr_line1 = " ".join(words[:split_index])
-                addr_line2 = " ".join(words[split_index:])
-            c.drawString(margin + 10, content_top - 68, "Address:")
-            c.drawString(margin + 70, content_top - 68, addr_line1)
-            if addr_line2:
-                c.drawString(margin + 70, content_top - 84, addr_line2)
-
-            c.roundRect(
-                margin + col_w + col_gap,
-                content_top - box_h,
-                col_w,
-                box_h,
-                8,
-                stroke=1,
-                fill=0,
-            )
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + col_w + col_gap + 10, content_top - 18, "Pay Period")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-            c.drawString(
-                margin + col_w + col_gap + 10,
-                content_top - 36,
-                f"Start: {pay_period_start}",
-            )
-            c.drawString(
-                margin + col_w + col_gap + 10, content_top - 52, f"End: {today}"
-            )
-
-            earnings_top = content_top - box_h - 16
-            earnings_h = 180
-            c.setStrokeColor(colors.HexColor("#8792B0"))
-            c.roundRect(
-                margin,
-                earnings_top - earnings_h,
-                width - 2 * margin,
-                earnings_h,
-                8,
-                stroke=1,
-                fill=0,
-            )
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + 10, earnings_top - 18, "Earnings & Deductions")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-
-            row_y = earnings_top - 40
-            row_h = 22
-            left_x = margin + 14
-            right_x = width - margin - 14
-
-            def row(label, value):
-                nonlocal row_y
-                c.drawString(left_x, row_y, label)
-                c.drawRightString(right_x, row_y, value)
-                c.setStrokeColor(colors.HexColor("#E1E5EE"))
-                c.line(margin + 10, row_y - 6, width - margin - 10, row_y - 6)
-                row_y -= row_h
-
-            row("Hours", f"{total_hours:.2f}")
-            row("Hourly Rate", f"${rate:.2f}")
-            row("Gross Pay", f"${gross:.2f}")
-            row("Federal Tax", f"${federal_tax:.2f}")
-            row("State Tax", f"${state_tax:.2f}")
-
-            net_box_h = 70
-            net_box_y = margin + 30
-            c.setStrokeColor(colors.HexColor("#2E3A59"))
-            c.roundRect(
-                margin, net_box_y, width - 2 * margin, net_box_h, 10, stroke=1, fill=0
-            )
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.drawString(margin + 16, net_box_y + net_box_h - 24, "Net Pay")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica-Bold", 18)
-            c.drawRightString(
-                width - margin - 16, net_box_y + net_box_h - 28, f"${net_pay:.2f}"
-            )
-
-            c.setFont("Helvetica", 8)
-            c.setFillColor(colors.HexColor("#666666"))
-            c.drawCentredString(
-                width / 2, margin + 10, "This is a computer-generated paystub."
-            )
-
-            c.showPage()
-            c.save()
-
-            try:
-                print("Reading SMTP_HOST from environment")
-                smtp_host = 'smtp.gmail.com'
-                print("SMTP_HOST: {}".format(smtp_host))
-
-                print("Reading SMTP_PORT from environment")
-                smtp_port = int(os.getenv("SMTP_PORT", "0") or 0)
-                print("SMTP_PORT: {}".format(smtp_port))
-
-                print("Reading SMTP_USER from environment")
-                smtp_user = os.getenv("SMTP_USER")
-                print("SMTP_USER: {}".format(smtp_user))
-
-                print("Reading SMTP_PASS from environment")
-                smtp_pass = os.getenv("SMTP_PASS")
-                print("SMTP_PASS: {}".format('***' if smtp_pass else None))
-
-                print("Reading FROM_EMAIL from environment or using SMTP_USER")
-                from_email = os.getenv("FROM_EMAIL") or smtp_user
-                print("FROM_EMAIL: {}".format(from_email))
-
-                print("Reading SMTP_USE_SSL from environment")
-                smtp_use_ssl = str(os.getenv("SMTP_USE_SSL", "true")).lower() in [
-                    "1",
-                    "true",
-                    "yes",
-                ]
-                print("SMTP_USE_SSL: {}".format(smtp_use_ssl))
-
-                print("Reading SMTP_USE_STARTTLS from environment")
-                smtp_use_starttls = str(
-                    os.getenv("SMTP_USE_STARTTLS", "false")
-                ).lower() in ["1", "true", "yes"]
-                print("SMTP_USE_STARTTLS: {}".format(smtp_use_starttls))
-
-                print("Checking if all SMTP and email parameters are present")
-                if (
-                    smtp_host
-                    and smtp_port
-                    and smtp_user
-                    and smtp_pass
-                    and from_email
-                    and email_addr
-                ):
-                    logging.info(
-                        f"SMTP attempt host={smtp_host} port={smtp_port} ssl={smtp_use_ssl} starttls={smtp_use_starttls} from={from_email} to={email_addr}"
-                    )
-
-                    logging.debug(f"Opening HTML paystub at {stub_path} for reading")
-                    with open(stub_path, "r", encoding="utf-8") as f:
-                        html_content = f.read()
-                        logging.debug("Read HTML content for paystub email")
-
-                    logging.debug("Creating MIMEMultipart message for paystub email")
-                    msg = MIMEMultipart("alternative")
-                    msg["Subject"] = f"Paystub - {today}"
-                    logging.debug(f"Set email subject: Paystub - {today}")
-                    msg["From"] = from_email
-                    logging.debug(f"Set email from: {from_email}")
-                    msg["To"] = email_addr
-                    logging.debug(f"Set email to: {email_addr}")
-
-                    logging.debug("Attaching HTML content to email")
-                    part = MIMEText(html_content, "html")
-                    msg.attach(part)
-
-                    if smtp_use_ssl:
-                        logging.info("Using SMTP_SSL for sending paystub email")
-                        with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
-                            logging.debug("Logging in to SMTP server with SSL")
-                            server.login(smtp_user, smtp_pass)
-                            logging.debug("Sending email via SMTP_SSL")
-                            server.sendmail(from_email, [email_addr], msg.as_string())
-                    else:
-                        logging.info("Using SMTP (non-SSL) for sending paystub email")
-                        with smtplib.SMTP(smtp_host, smtp_port) as server:
-                            if smtp_use_starttls:
-                                logging.debug("Starting TLS for SMTP connection")
-                                server.starttls()
-                            logging.debug("Logging in to SMTP server")
-                            server.login(smtp_user, smtp_pass)
-                            logging.debug("Sending email via SMTP")
-                            server.sendmail(from_email, [email_addr], msg.as_string())
-                    logging.info(f"SMTP sent paystub to {email_addr}")
-                else:
-                    logging.warning(
-                        "SMTP not configured or recipient email missing; skipping send"
-                    )
-            except Exception as e:
-                logging.error(f"Failed to send paystub email to {email_addr}: {e}")
+            return
+        try:
+            self.run_payroll()
+        finally:
+            self.repo.payroll_lock.release()
 
-        with open("payroll_report.csv", "w", newline="") as f:
-            writer = csv.writer(f)
-            for line in report:
-                writer.writerow([line])
-        with open("payments.csv", "w", newline="") as pf:
-            writer = csv.writer(pf)
-            writer.writerows(payments)
-        with open("tax_deposit.csv", "w", newline="") as tf:
-            tf_writer = csv.writer(tf)
-            tax_deposits.append([today, f"{total_federal:.2f}"])
-            tf_writer.writerows(tax_deposits)
-        with open("w2_summary.csv", "w", newline="") as wf:
-            w = csv.writer(wf)
-            w.writerow(
-                [
-                    "employee_id",
-                    "name",
-                    "ssn",
-                    "wages",
-                    "federal_income_tax_withheld",
-                    "year",
-                ]
+    def run_payroll(self):
+        run = run_payroll(self.repo, detailed=True)
+        if run.paystub_failures:
+            messagebox.showwarning(
+                "Payroll Complete",
+                f"Payroll report and CSVs generated, but paystubs could not be created for employee(s) {', '.join(run.paystub_failures)}. See app.log.",
             )
-            year = datetime.datetime.now().strftime("%Y")
-            for emp_id, data in self.time_logs.items():
-                if "sessions" not in data:
-                    continue
-                hours_ytd = 0
-                for s in data["sessions"]:
-                    if s.get("clock_out", "").startswith(year):
-                        hours_ytd += s.get("hours", 0)
-                if hours_ytd == 0:
-                    continue
-                is_nra = str(
-                    self.employees[emp_id].get("w4_nonresident_alien", "")
-                ).lower() in ["yes", "true", "1"]
-                gross, fed, state, net = calculate_pay_with_profile(
-                    hours_ytd, self.employees[emp_id]["hourly_rate"], is_nra
-                )
-                w.writerow(
-                    [
-                        emp_id,
-                        data["name"],
-                        self.employees[emp_id]["ssn"],
-                        f"{gross:.2f}",
-                        f"{fed:.2f}",
-                        year,
-                    ]
-                )
+            return
         messagebox.showinfo(
             "Payroll Complete",
             "Payroll report generated as payroll_report.csv. Payments/taxes CSVs and paystubs created. Email sent if configured.",
@@ -1124,61 +733,85 @@ class PayrollApp:
         """Populate the time logs table with all clock-ins and clock-outs"""
         # Clear existing items
         self.time_logs_tree.delete(*self.time_logs_tree.get_children())
-        
-        # Get current time logs
-        current_time_logs = load_time_logs()
-        
-        # Add current clock-ins
-        for emp_id, data in current_time_logs.items():
-            if 'clock_in' in data:
-                # Current clock-in
+        self.time_log_items = {}
+
+        with self.repo.lock:
+            for emp_id, data in self.time_logs.items():
+                self.insert_time_log_rows(emp_id, data)
+
+    def insert_time_log_rows(self, emp_id, data, index="end"):
+        """Insert one employee's active clock-in and sessions, remembering their item IDs"""
+        items = []
+        rows = []
+        if 'clock_in' in data:
+            # Current clock-in
+            location_info = ""
+            if 'last_location' in data:
+                lat = data['last_location'].get('lat', '')
+                lon = data['last_location'].get('lon', '')
+                if lat and lon:
+                    location_info = f"Lat: {lat:.4f}, Lon: {lon:.4f}"
+
+            rows.append((f"{emp_id}_active", (
+                emp_id,
+                data.get('name', ''),
+                'Clock In',
+                data['clock_in'],
+                'Active',
+                location_info
+            )))
+
+        # Add completed sessions
+        if 'sessions' in data:
+            for idx, session in enumerate(data['sessions']):
                 location_info = ""
-                if 'last_location' in data:
-                    lat = data['last_location'].get('lat', '')
-                    lon = data['last_location'].get('lon', '')
+                if 'location' in session:
+                    lat = session['location'].get('lat', '')
+                    lon = session['location'].get('lon', '')
                     if lat and lon:
                         location_info = f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-                
-                self.time_logs_tree.insert("", "end", iid=f"{emp_id}_active", values=(
+
+                # Clock-in entry
+                rows.append((f"{emp_id}_{idx}_in", (
                     emp_id,
                     data.get('name', ''),
                     'Clock In',
-                    data['clock_in'],
-                    'Active',
-                    location_info
-                ))
-            
-            # Add completed sessions
-            if 'sessions' in data:
-                for idx, session in enumerate(data['sessions']):
-                    location_info = ""
-                    if 'location' in session:
-                        lat = session['location'].get('lat', '')
-                        lon = session['location'].get('lon', '')
-                        if lat and lon:
-                            location_info = f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-                    
-                    # Clock-in entry
-                    self.time_logs_tree.insert("", "end", iid=f"{emp_id}_{idx}_in", values=(
-                        emp_id,
-                        data.get('name', ''),
-                        'Clock In',
-                        session['clock_in'],
-                        f"{session['hours']:.2f}",
-                        location_info,
-                        idx # Store index for editing
-                    ))
-                    
-                    # Clock-out entry
-                    self.time_logs_tree.insert("", "end", iid=f"{emp_id}_{idx}_out", values=(
-                        emp_id,
-                        data.get('name', ''),
-                        'Clock Out',
-                        session['clock_out'],
-                        f"{session['hours']:.2f}",
-                        location_info,
-                        idx # Store index for editing
-                    ))
+                    session['clock_in'],
+                    f"{session['hours']:.2f}",
+                    location_info,
+                    idx # Store index for editing
+                )))
+
+                # Clock-out entry
+                rows.append((f"{emp_id}_{idx}_out", (
+                    emp_id,
+                    data.get('name', ''),
+                    'Clock Out',
+                    session['clock_out'],
+                    f"{session['hours']:.2f}",
+                    location_info,
+                    idx # Store index for editing
+                )))
+
+        for iid, values in rows:
+            self.time_logs_tree.insert("", index, iid=iid, values=values)
+            items.append(iid)
+            if index != "end":
+                index += 1
+        self.time_log_items[emp_id] = items
+
+    def refresh_time_log_rows(self, emp_id):
+        """Redraw only this employee's rows in the time logs table"""
+        if not hasattr(self, 'time_logs_tree') or not self.time_logs_tree.winfo_exists():
+            return
+        old_items = [iid for iid in self.time_log_items.pop(emp_id, []) if self.time_logs_tree.exists(iid)]
+        index = self.time_logs_tree.index(old_items[0]) if old_items else "end"
+        if old_items:
+            self.time_logs_tree.delete(*old_items)
+        with self.repo.lock:
+            data = self.time_logs.get(emp_id)
+            if data:
+                self.insert_time_log_rows(emp_id, data, index)
 
     def show_time_log_context_menu(self, event):
         """Show context menu for time log selection"""
@@ -1196,7 +829,7 @@ class PayrollApp:
 
     def edit_time_log_entry(self, emp_id, session_index):
         """Opens a dialog to edit a specific time log entry."""
-        logs = load_time_logs()
+        logs = self.time_logs
         if emp_id not in logs or 'sessions' not in logs[emp_id] or not (0 <= session_index < len(logs[emp_id]['sessions'])):
             messagebox.showerror("Error", "Time log entry not found.")
             return
@@ -1230,15 +863,14 @@ class PayrollApp:
                 return
 
             try:
-                datetime.datetime.strptime(updated_clock_in, "%Y-%m-%d %H:%M:%S")
-                datetime.datetime.strptime(updated_clock_out, "%Y-%m-%d %H:%M:%S")
+                updated_clock_in = normalize_timestamp(updated_clock_in)
+                updated_clock_out = normalize_timestamp(updated_clock_out)
             except ValueError:
                 messagebox.showerror("Error", "Invalid time format. Use YYYY-MM-DD HH:MM:SS.")
                 return
             
-            if edit_time_log_session(emp_id, session_index, updated_clock_in, updated_clock_out):
+            if self.repo.edit_session(emp_id, session_index, updated_clock_in, updated_clock_out):
                 messagebox.showinfo("Success", "Time log updated successfully.")
-                self.populate_time_logs_table() # Refresh the table
                 edit_window.destroy()
             else:
                 messagebox.showerror("Error", "Failed to update time log.")
@@ -1,20 +1,35 @@
 
+import os
 import threading
 from gui import PayrollApp
 from server import run_server
+from async_server import run_async_server
+from data import compact_storage
+from repository import get_repository
+from backup import BackupScheduler
 import tkinter as tk
 import logging
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
-    # Start HTTP server in a thread
-    server_thread = threading.Thread(target=run_server, daemon=True)
+    # Fold anything journaled since the last run into employees.csv/timelogs.json
+    compact_storage()
+
+    # One shared copy of employees/time logs for both the server and the GUI
+    repository = get_repository()
+
+    # Compressed, incremental snapshots on a background thread (see backup.py)
+    BackupScheduler(repository.lock).start()
+
+    # Start HTTP server in a thread (PAYROLL_SERVER=async for the asyncio front end)
+    serve = run_async_server if os.getenv("PAYROLL_SERVER", "threaded") == "async" else run_server
+    server_thread = threading.Thread(target=serve, daemon=True)
     server_thread.start()
 
     # Start GUI
     root = tk.Tk()
-    app = PayrollApp(root)
+    app = PayrollApp(root, repository)
     print("Desktop GUI launched. For mobile clock-in and management:")
     print("1. Download and install ngrok from https://ngrok.com (free tier).")
     print("2. Run: ngrok http 8000")
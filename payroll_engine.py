@@ -0,0 +1,482 @@
+import csv
+import datetime
+import logging
+import multiprocessing
+import os
+import smtplib
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from reportlab.lib.pagesizes import LETTER
+from reportlab.pdfgen import canvas
+from reportlab.lib import colors
+from data import iter_time_logs
+from payrollutils import calculate_pay_batch, calculate_pay_with_profile
+
+# A payroll run in four stages, shared by the web admin, the desktop GUI and
+# `python payroll_engine.py`:
+#   compute - pay for every employee from one snapshot, no I/O
+#   render  - HTML and PDF paystubs under PAYSTUB_DIR
+#   deliver - email each paystub, when SMTP is configured
+#   export  - payroll_report.csv, payments.csv, tax_deposit.csv, w2_summary.csv
+PAY_PERIOD_DAYS = 14
+PAYSTUB_DIR = "paystubs"
+# Processes drawing paystubs in parallel, and the smallest batch worth starting them for:
+# a paystub takes ~3 ms, the first pool of a process ~300 ms to start
+PAYSTUB_WORKERS = int(os.getenv("PAYROLL_PAYSTUB_WORKERS", str(os.cpu_count() or 1)))
+PAYSTUB_PARALLEL_MIN = 100
+COMPANY_NAME = "Freezy Frenzy"
+COMPANY_ADDRESS = "17458 Northwest Fwy, Jersey Village, TX 77040"
+
+# One employee's pay for the period, with what the later stages need from their profile
+PayResult = namedtuple("PayResult", [
+    "employee_id", "name", "hours", "hourly_rate", "gross", "federal_tax", "state_tax", "net_pay",
+    "payment_method", "routing_mask", "account_mask", "email", "address", "ssn", "nonresident_alien",
+])
+# Year-to-date wages for the W-2 summary
+W2Row = namedtuple("W2Row", ["employee_id", "name", "ssn", "wages", "federal_tax"])
+Paystub = namedtuple("Paystub", ["result", "html", "html_path", "pdf_path"])
+
+class PayrollRun:
+    """The computed results of one payroll run; the later stages only read it."""
+
+    def __init__(self, start, end, year, results, w2):
+        self.start = start
+        self.end = end
+        self.year = year
+        self.results = results
+        self.w2 = w2
+        # {employee_id: error} for paystubs that couldn't be rendered, filled in by run_payroll
+        self.paystub_failures = {}
+
+    @property
+    def total_federal(self):
+        return sum(result.federal_tax for result in self.results)
+
+def pay_period(now=None):
+    """(start, end) dates of the pay period ending today."""
+    now = now or datetime.datetime.now()
+    return (now - datetime.timedelta(days=PAY_PERIOD_DAYS)).strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+
+def is_nonresident_alien(employee):
+    return str(employee.get('w4_nonresident_alien', '')).lower() in ['yes', 'true', '1']
+
+def mask(number):
+    """All but the last four digits hidden."""
+    return (number[-4:]).rjust(len(number), '•') if number else ''
+
+def year_to_date_hours(year):
+    """{employee_id: hours} for `year`, streamed a partition at a time so multi-year histories stay in bounded memory."""
+    hours = {}
+    for emp_id, session in iter_time_logs(start=f"{year}-01-01", end=f"{int(year) + 1}-01-01"):
+        hours[emp_id] = hours.get(emp_id, 0) + session.get('hours', 0)
+    return hours
+
+def compute(employees, time_logs, start, end, hours_ytd=None):
+    """PayrollRun for the sessions in `time_logs` that ended on or after `start`.
+
+    `time_logs` is what Repository.snapshot(since=start) returns;
+    `hours_ytd` ({employee_id: hours}, see year_to_date_hours) fills the W-2 summary.
+    """
+    results = []
+    for emp_id, data in time_logs.items():
+        if 'sessions' not in data:
+            continue
+        total_hours = sum(session['hours'] for session in data['sessions'] if session['clock_out'] >= start)
+        if total_hours == 0:
+            continue
+        employee = employees[emp_id]
+        hourly_rate = employee['hourly_rate']
+        nonresident_alien = is_nonresident_alien(employee)
+        gross, federal_tax, state_tax, net_pay = calculate_pay_with_profile(total_hours, hourly_rate, nonresident_alien)
+        account = employee.get('bank_account', '')
+        results.append(PayResult(
+            emp_id, data['name'], total_hours, hourly_rate, gross, federal_tax, state_tax, net_pay,
+            employee.get('payment_method', '') or 'payroll_card',
+            mask(employee.get('bank_routing', '')),
+            mask(account) if account else employee.get('payroll_card_id', ''),
+            employee.get('email', ''), employee.get('address', '') or '', employee.get('ssn', ''), nonresident_alien,
+        ))
+
+    w2 = []
+    for emp_id, employee in employees.items():
+        hours = (hours_ytd or {}).get(emp_id, 0)
+        if hours == 0:
+            continue
+        gross, federal_tax, _, _ = calculate_pay_with_profile(hours, employee['hourly_rate'], is_nonresident_alien(employee))
+        w2.append(W2Row(emp_id, employee['name'], employee['ssn'], gross, federal_tax))
+    return PayrollRun(start, end, end[:4], results, w2)
+
+def what_if(run, hourly_rates=None, nonresident_alien=None):
+    """`run` repriced with some employees' rate or withholding changed; nothing is written.
+
+    `hourly_rates` and `nonresident_alien` map employee_id to the value to
+    try; everyone else keeps their own. The whole roster goes through one
+    calculate_pay_batch call, so pricing many scenarios stays cheap.
+    """
+    hourly_rates = hourly_rates or {}
+    nonresident_alien = nonresident_alien or {}
+    rates = [hourly_rates.get(result.employee_id, result.hourly_rate) for result in run.results]
+    pay = calculate_pay_batch(
+        [result.hours for result in run.results],
+        rates,
+        [nonresident_alien.get(result.employee_id, result.nonresident_alien) for result in run.results],
+    )
+    results = [
+        result._replace(hourly_rate=rate, gross=gross, federal_tax=federal_tax, state_tax=state_tax, net_pay=net_pay,
+                        nonresident_alien=nonresident_alien.get(result.employee_id, result.nonresident_alien))
+        for result, rate, gross, federal_tax, state_tax, net_pay in zip(run.results, rates, *pay)
+    ]
+    return PayrollRun(run.start, run.end, run.year, results, run.w2)
+
+def paystub_html(run, result):
+    return f"""
+                <html><body>
+                <h3>Paystub - {run.end}</h3>
+                <p>Employee: {result.name} (ID: {result.employee_id})</p>
+                <p>Total Hours: {result.hours:.2f}</p>
+                <p>Hourly Rate: ${result.hourly_rate:.2f}</p>
+                <p>Gross Pay: ${result.gross:.2f}</p>
+                <p>Federal Tax: ${result.federal_tax:.2f}</p>
+                <p>State Tax: ${result.state_tax:.2f}</p>
+                <p>Net Pay: ${result.net_pay:.2f}</p>
+                <p>Payment Method: {result.payment_method}</p>
+                </body></html>
+                """
+
+def address_lines(address):
+    """The address split over two lines: street, then city/state/zip."""
+    parts = [p.strip() for p in address.replace('\n', ', ').split(',') if p.strip()]
+    if len(parts) >= 3:
+        return ', '.join(parts[:-2]), ', '.join(parts[-2:])
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    # Fallback simple wrap if no commas present
+    words = address.split()
+    split_index = max(1, min(len(words), len(words) // 2))
+    return ' '.join(words[:split_index]), ' '.join(words[split_index:])
+
+def draw_paystub_pdf(run, result, pdf_path):
+    c = canvas.Canvas(pdf_path, pagesize=LETTER)
+    width, height = LETTER
+    margin = 54
+
+    # Header banner
+    header_h = 70
+    c.setFillColor(colors.HexColor("#2E3A59"))
+    c.roundRect(margin, height - margin - header_h, width - 2*margin, header_h, 12, stroke=0, fill=1)
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(margin + 16, height - margin - 40, COMPANY_NAME)
+    c.setFont("Helvetica", 10)
+    c.drawString(margin + 16, height - margin - 56, COMPANY_ADDRESS)
+    c.setFont("Helvetica", 12)
+    c.drawRightString(width - margin - 16, height - margin - 46, f"Paystub • {run.end}")
+
+    content_top = height - margin - header_h - 12
+
+    # Employee and Period boxes
+    col_gap = 12
+    col_w = (width - 2*margin - col_gap) / 2
+    box_h = 100
+    # Employee box
+    c.setStrokeColor(colors.HexColor("#8792B0"))
+    c.roundRect(margin, content_top - box_h, col_w, box_h, 8, stroke=1, fill=0)
+    c.setFillColor(colors.HexColor("#2E3A59"))
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(margin + 10, content_top - 18, "Employee")
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+    c.drawString(margin + 10, content_top - 36, f"Name: {result.name}")
+    c.drawString(margin + 10, content_top - 52, f"Employee ID: {result.employee_id}")
+    addr_line1, addr_line2 = address_lines(result.address)
+    c.drawString(margin + 10, content_top - 68, "Address:")
+    c.drawString(margin + 70, content_top - 68, addr_line1)
+    if addr_line2:
+        c.drawString(margin + 70, content_top - 84, addr_line2)
+
+    # Period box
+    c.roundRect(margin + col_w + col_gap, content_top - box_h, col_w, box_h, 8, stroke=1, fill=0)
+    c.setFillColor(colors.HexColor("#2E3A59"))
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(margin + col_w + col_gap + 10, content_top - 18, "Pay Period")
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+    c.drawString(margin + col_w + col_gap + 10, content_top - 36, f"Start: {run.start}")
+    c.drawString(margin + col_w + col_gap + 10, content_top - 52, f"End: {run.end}")
+
+    # Earnings box
+    earnings_top = content_top - box_h - 16
+    earnings_h = 180
+    c.setStrokeColor(colors.HexColor("#8792B0"))
+    c.roundRect(margin, earnings_top - earnings_h, width - 2*margin, earnings_h, 8, stroke=1, fill=0)
+    c.setFillColor(colors.HexColor("#2E3A59"))
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(margin + 10, earnings_top - 18, "Earnings & Deductions")
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+
+    # Table rows
+    row_y = earnings_top - 40
+    row_h = 22
+    left_x = margin + 14
+    right_x = width - margin - 14
+    def row(label, value):
+        nonlocal row_y
+        c.drawString(left_x, row_y, label)
+        c.drawRightString(right_x, row_y, value)
+        c.setStrokeColor(colors.HexColor("#E1E5EE"))
+        c.line(margin + 10, row_y - 6, width - margin - 10, row_y - 6)
+        row_y -= row_h
+
+    row("Hours", f"{result.hours:.2f}")
+    row("Hourly Rate", f"${result.hourly_rate:.2f}")
+    row("Gross Pay", f"${result.gross:.2f}")
+    row("Federal Tax", f"${result.federal_tax:.2f}")
+    row("State Tax", f"${result.state_tax:.2f}")
+
+    # Net pay highlight box
+    net_box_h = 70
+    net_box_y = margin + 30
+    c.setStrokeColor(colors.HexColor("#2E3A59"))
+    c.roundRect(margin, net_box_y, width - 2*margin, net_box_h, 10, stroke=1, fill=0)
+    c.setFont("Helvetica-Bold", 12)
+    c.setFillColor(colors.HexColor("#2E3A59"))
+    c.drawString(margin + 16, net_box_y + net_box_h - 24, "Net Pay")
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica-Bold", 18)
+    c.drawRightString(width - margin - 16, net_box_y + net_box_h - 28, f"${result.net_pay:.2f}")
+
+    # Footer note
+    c.setFont("Helvetica", 8)
+    c.setFillColor(colors.HexColor("#666666"))
+    c.drawCentredString(width / 2, margin + 10, "This is a computer-generated paystub.")
+
+    c.showPage()
+    c.save()
+
+def paystub_mp_context():
+    """Where paystub workers come from. Never plain fork: the server and GUI
+    have threads running, and a lock one of them holds would stay held in the child.
+
+    A fork server is a clean single-threaded process started once, with this
+    module preloaded, so later pools start in ~40 ms (spawn takes ~1 s each
+    time). Windows has no fork server and gets its default, spawn.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["payroll_engine"])
+    return context
+
+def render_paystub(period, result, directory):
+    """Write one employee's HTML and PDF paystub: (Paystub, None), or (None, error) if that failed.
+
+    Runs in a worker process; `period` is the run without its results, to keep the job small.
+    """
+    try:
+        html = paystub_html(period, result)
+        html_path = os.path.join(directory, f"{result.employee_id}_{period.end}.html")
+        with open(html_path, 'w', encoding='utf-8') as sf:
+            sf.write(html)
+        pdf_path = os.path.join(directory, f"{result.employee_id}_{period.end}.pdf")
+        draw_paystub_pdf(period, result, pdf_path)
+        return Paystub(result, html, html_path, pdf_path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def log_progress(done, total):
+    """Default render() progress: a line at every tenth of the way."""
+    if done == total or done * 10 // total != (done - 1) * 10 // total:
+        logging.info(f"[payroll_engine] Rendered {done}/{total} paystubs")
+
+def render(run, directory=PAYSTUB_DIR, workers=PAYSTUB_WORKERS, progress=log_progress):
+    """Write each result's HTML and PDF paystub: (Paystubs in result order, {employee_id: error}).
+
+    PDF drawing is CPU-bound, so batches of PAYSTUB_PARALLEL_MIN or more are
+    spread over `workers` processes. A paystub that fails is logged and left
+    out; the rest are still written. `progress(done, total)` is called as
+    each one finishes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    period = PayrollRun(run.start, run.end, run.year, [], [])
+    total = len(run.results)
+    rendered = [None] * total
+    errors = [None] * total
+    done = 0
+
+    def finished(index, paystub, error):
+        nonlocal done
+        done += 1
+        if paystub is not None:
+            rendered[index] = paystub
+        else:
+            errors[index] = error
+            logging.error(f"[payroll_engine] Paystub for {run.results[index].employee_id} failed: {error}")
+        if progress:
+            progress(done, total)
+
+    if workers > 1 and total >= PAYSTUB_PARALLEL_MIN:
+        with ProcessPoolExecutor(min(workers, total), mp_context=paystub_mp_context()) as pool:
+            futures = {pool.submit(render_paystub, period, result, directory): index for index, result in enumerate(run.results)}
+            for future in as_completed(futures):
+                try:
+                    paystub, error = future.result()
+                except Exception as e:  # The worker process died
+                    paystub, error = None, f"{type(e).__name__}: {e}"
+                finished(futures[future], paystub, error)
+    else:
+        for index, result in enumerate(run.results):
+            finished(index, *render_paystub(period, result, directory))
+    failures = {result.employee_id: error for result, error in zip(run.results, errors) if error is not None}
+    return [paystub for paystub in rendered if paystub is not None], failures
+
+def smtp_settings():
+    """SMTP connection settings from the environment (.env), or None if incomplete."""
+    settings = {
+        'host': 'smtp.gmail.com',
+        'port': int(os.getenv('SMTP_PORT', '0') or 0),
+        'user': os.getenv('SMTP_USER'),
+        'password': os.getenv('SMTP_PASS'),
+        'from_email': os.getenv('FROM_EMAIL') or os.getenv('SMTP_USER'),
+        'use_ssl': str(os.getenv('SMTP_USE_SSL', 'true')).lower() in ['1', 'true', 'yes'],
+        'use_starttls': str(os.getenv('SMTP_USE_STARTTLS', 'false')).lower() in ['1', 'true', 'yes'],
+    }
+    if not (settings['host'] and settings['port'] and settings['user'] and settings['password'] and settings['from_email']):
+        return None
+    return settings
+
+def send_paystub(settings, paystub, subject):
+    email_addr = paystub.result.email
+    logging.info(f"SMTP attempt host={settings['host']} port={settings['port']} ssl={settings['use_ssl']} starttls={settings['use_starttls']} from={settings['from_email']} to={email_addr}")
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = settings['from_email']
+    msg['To'] = email_addr
+    msg.attach(MIMEText(paystub.html, 'html'))
+    if settings['use_ssl']:
+        with smtplib.SMTP_SSL(settings['host'], settings['port']) as server:
+            server.login(settings['user'], settings['password'])
+            server.sendmail(settings['from_email'], [email_addr], msg.as_string())
+    else:
+        with smtplib.SMTP(settings['host'], settings['port']) as server:
+            if settings['use_starttls']:
+                server.starttls()
+            server.login(settings['user'], settings['password'])
+            server.sendmail(settings['from_email'], [email_addr], msg.as_string())
+    logging.info(f"SMTP sent paystub to {email_addr}")
+
+def deliver(run, paystubs):
+    """Email each paystub to its employee. Returns how many were sent; one failure doesn't stop the rest."""
+    settings = smtp_settings()
+    sent = 0
+    for paystub in paystubs:
+        email_addr = paystub.result.email
+        if settings is None or not email_addr:
+            logging.warning(f"SMTP not configured or recipient email missing; skipping send to {paystub.result.employee_id}")
+            continue
+        try:
+            send_paystub(settings, paystub, f"Paystub - {run.end}")
+            sent += 1
+        except Exception as e:
+            logging.error(f"Failed to send paystub email to {email_addr}: {e}")
+    return sent
+
+def report_lines(run, detailed=False):
+    """payroll_report.csv lines; `detailed` adds each employee's SSN, address and state tax."""
+    lines = ["Payroll Report", f"Pay Period: {run.start} to {run.end}\n"]
+    for result in run.results:
+        lines.append(f"Employee: {result.name} (ID: {result.employee_id})")
+        if detailed:
+            lines.append(f"SSN: {result.ssn}")
+            lines.append(f"Address: {result.address}")
+        lines.append(f"Total Hours: {result.hours:.2f}")
+        lines.append(f"Gross Pay: ${result.gross:.2f}")
+        lines.append(f"Federal Tax: ${result.federal_tax:.2f}")
+        if detailed:
+            lines.append(f"State Tax: ${result.state_tax:.2f}")
+        lines.append(f"Net Pay: ${result.net_pay:.2f}\n")
+    return lines
+
+def export(run, detailed=False):
+    """Write payroll_report.csv, payments.csv, tax_deposit.csv and w2_summary.csv."""
+    with open("payroll_report.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        for line in report_lines(run, detailed):
+            writer.writerow([line])
+
+    with open("payments.csv", 'w', newline='') as pf:
+        writer = csv.writer(pf)
+        writer.writerow(["employee_id", "name", "method", "routing", "account", "amount", "date"])
+        for result in run.results:
+            writer.writerow([result.employee_id, result.name, result.payment_method, result.routing_mask,
+                             result.account_mask, f"{result.net_pay:.2f}", run.end])
+
+    with open("tax_deposit.csv", 'w', newline='') as tf:
+        writer = csv.writer(tf)
+        writer.writerow(["date", "federal_withholding_total"])
+        writer.writerow([run.end, f"{run.total_federal:.2f}"])
+
+    with open("w2_summary.csv", 'w', newline='') as wf:
+        writer = csv.writer(wf)
+        writer.writerow(["employee_id", "name", "ssn", "wages", "federal_income_tax_withheld", "year"])
+        for row in run.w2:
+            writer.writerow([row.employee_id, row.name, row.ssn, f"{row.wages:.2f}", f"{row.federal_tax:.2f}", run.year])
+
+def run_payroll(repository, detailed=False, send_email=True):
+    """All four stages over a fresh snapshot of `repository`; the PayrollRun.
+
+    Callers hold repository.payroll_lock. Each stage's time is logged.
+    """
+    start, end = pay_period()
+    stage_started = time.perf_counter()
+    def stage_done(name, detail):
+        nonlocal stage_started
+        now = time.perf_counter()
+        logging.info(f"[payroll_engine] {name}: {detail} in {(now - stage_started) * 1000:.1f} ms")
+        stage_started = now
+
+    # Only the current pay period; the W-2 summary's year-to-date hours are streamed
+    employees, time_logs = repository.snapshot(since=start)
+    run = compute(employees, time_logs, start, end, year_to_date_hours(end[:4]))
+    stage_done("compute", f"{len(run.results)} employee(s)")
+    paystubs, run.paystub_failures = render(run)
+    stage_done("render", f"{len(paystubs)} paystub(s), {len(run.paystub_failures)} failed")
+    if send_email:
+        sent = deliver(run, paystubs)
+        stage_done("deliver", f"{sent} email(s) sent")
+    export(run, detailed)
+    stage_done("export", "4 CSV files")
+    return run
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from repository import get_repository
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    load_dotenv(os.path.join(os.path.dirname(__file__), '.env'), override=True)
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    repository = get_repository()
+    if command == "compute":
+        start, end = pay_period()
+        employees, time_logs = repository.snapshot(since=start)
+        run = compute(employees, time_logs, start, end)
+        for line in report_lines(run):
+            print(line)
+    elif command == "whatif" and len(sys.argv) > 2:
+        # Cost of an across-the-board raise of N percent for the current period
+        raise_percent = float(sys.argv[2])
+        start, end = pay_period()
+        employees, time_logs = repository.snapshot(since=start)
+        run = compute(employees, time_logs, start, end)
+        raised = what_if(run, {result.employee_id: result.hourly_rate * (1 + raise_percent / 100) for result in run.results})
+        for label, scenario in (("Current", run), (f"With {raise_percent:g}% raise", raised)):
+            print(f"{label}: gross ${sum(r.gross for r in scenario.results):.2f}, net ${sum(r.net_pay for r in scenario.results):.2f}")
+    elif command == "run":
+        with repository.payroll_lock:
+            run = run_payroll(repository, send_email="--no-email" not in sys.argv[2:])
+        print(f"Paid {len(run.results)} employee(s) for {run.start} to {run.end}")
+    else:
+        print("usage: python payroll_engine.py [run [--no-email] | compute | whatif <raise percent>]")
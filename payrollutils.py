@@ -2,31 +2,80 @@
 import datetime
 import math
 
+try:
+    import numpy
+except ImportError:  # Optional: calculate_pay_batch falls back to the scalar functions
+    numpy = None
+
 # Shop location (Freezy Frenzy: 17458 Northwest Fwy, Jersey Village, TX 77040)
 SHOP_LAT = 29.8814  # Latitude
 SHOP_LON = -95.5693  # Longitude
 ALLOWED_RADIUS_METERS = 100  # Allow clock-in/out within 100 meters
 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+def parse_timestamp(text):
+    """'YYYY-MM-DD HH:MM:SS' wall-clock time -> int seconds since 1970-01-01 00:00:00.
+
+    No time zone is applied, so differences match naive datetime arithmetic.
+    Much cheaper than strptime for the zero-padded form everything is stored
+    in; anything else strptime accepts (like '2026-10-17 8:00:00', written
+    before entry points normalized their input) takes the slow path.
+    """
+    if len(text) != 19 or text[4] != '-' or text[7] != '-' or text[10] != ' ' or text[13] != ':' or text[16] != ':':
+        return (datetime.datetime.strptime(text, TIMESTAMP_FORMAT) - _EPOCH) // _SECOND
+    return (datetime.datetime.fromisoformat(text) - _EPOCH) // _SECOND
+
+def normalize_timestamp(text):
+    """Validate a user-entered timestamp and return it zero-padded, as it must be stored.
+
+    Stored times are compared as strings (range queries, partitions), so
+    '8:00:00' has to become '08:00:00'. Raises ValueError on bad input.
+    """
+    return datetime.datetime.strptime(text, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+
+def format_timestamp(seconds):
+    return str(_EPOCH + datetime.timedelta(seconds=seconds))
+
 def calculate_hours(clock_in, clock_out):
-    in_time = datetime.datetime.strptime(clock_in, "%Y-%m-%d %H:%M:%S")
-    out_time = datetime.datetime.strptime(clock_out, "%Y-%m-%d %H:%M:%S")
-    return (out_time - in_time).total_seconds() / 3600
+    return (parse_timestamp(clock_out) - parse_timestamp(clock_in)) / 3600
+
+FEDERAL_TAX_RATE = 0.15  # 15% federal tax estimate
+# Simplified placeholder: 30% federal withholding for NRAs
+NONRESIDENT_ALIEN_TAX_RATE = 0.30
+STATE_TAX = 0  # No state income tax in Texas
 
 def calculate_pay(hours, hourly_rate):
     gross = hours * hourly_rate
-    federal_tax = gross * 0.15  # 15% federal tax estimate
-    state_tax = 0  # No state income tax in Texas
+    federal_tax = gross * FEDERAL_TAX_RATE
+    state_tax = STATE_TAX
     net_pay = gross - federal_tax
     return gross, federal_tax, state_tax, net_pay
 
 def calculate_pay_with_profile(hours, hourly_rate, is_nonresident_alien=False):
     gross, federal_tax, state_tax, net_pay = calculate_pay(hours, hourly_rate)
     if is_nonresident_alien:
-        # Simplified placeholder: 30% federal withholding for NRAs
-        federal_tax = gross * 0.30
+        federal_tax = gross * NONRESIDENT_ALIEN_TAX_RATE
         net_pay = gross - federal_tax
     return gross, federal_tax, state_tax, net_pay
 
+def calculate_pay_batch(hours, hourly_rates, is_nonresident_alien):
+    """calculate_pay_with_profile for a whole roster: lists (gross, federal_tax, state_tax, net_pay).
+
+    With NumPy this is a few array operations over all employees. Every
+    element goes through the same float64 multiply and subtract as the
+    scalar function, so the results are identical to calling it in a loop.
+    """
+    if numpy is None:
+        pay = [calculate_pay_with_profile(h, r, n) for h, r, n in zip(hours, hourly_rates, is_nonresident_alien)]
+        return tuple(list(column) for column in zip(*pay)) if pay else ([], [], [], [])
+    gross = numpy.asarray(hours, dtype=float) * numpy.asarray(hourly_rates, dtype=float)
+    federal_tax = gross * numpy.where(numpy.asarray(is_nonresident_alien, dtype=bool), NONRESIDENT_ALIEN_TAX_RATE, FEDERAL_TAX_RATE)
+    net_pay = gross - federal_tax
+    return gross.tolist(), federal_tax.tolist(), [STATE_TAX] * len(gross), net_pay.tolist()
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     R = 6371000  # Earth radius in meters
     phi1 = math.radians(lat1)
@@ -0,0 +1,97 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import data
+from data import STORAGE_BACKEND, get_backend
+from repository import init_repository, ProcessLock
+from server import PooledHTTPServer, TimeClockHandler, HTTP_WORKERS, get_local_ip
+from backup import BackupScheduler
+
+# Worker processes accepting on one shared listening socket. They all use the
+# SQLite store; whichever holds LEADER_LOCK_FILE runs the scheduled jobs.
+PREFORK_PROCESSES = int(os.getenv("PAYROLL_PROCESSES", str(os.cpu_count() or 2)))
+LEADER_LOCK_FILE = "payroll.leader.lock"
+# A worker that exits within RESPAWN_MIN_UPTIME seconds of starting is crashing:
+# wait before replacing it, doubling up to RESPAWN_MAX_DELAY, rather than fork in a loop
+RESPAWN_MIN_UPTIME = 10
+RESPAWN_MAX_DELAY = 30
+_leader_lock = None
+
+def elect_leader(repository):
+    """Wait in the background for the leader lock, then run the scheduled jobs in this process.
+
+    The OS drops the lock when its holder exits, so a surviving worker takes over.
+    """
+    def wait_and_lead():
+        global _leader_lock
+        lock = ProcessLock(LEADER_LOCK_FILE)
+        lock.acquire()
+        # Keep it referenced for the life of the process: closing the file drops the lock
+        _leader_lock = lock
+        logging.info(f"[prefork] Worker {os.getpid()} is running the scheduled jobs")
+        BackupScheduler(repository.lock).start()
+
+    threading.Thread(target=wait_and_lead, name="leader-election", daemon=True).start()
+
+def serve_worker(sock, workers):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops us with SIGTERM
+    # SQLite connections must not cross a fork: open our own
+    data.set_backend(None)
+    repository = init_repository(shared=True)
+    elect_leader(repository)
+    server = PooledHTTPServer(sock.getsockname(), TimeClockHandler, workers, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    logging.info(f"[prefork] Worker {os.getpid()} serving")
+    server.serve_forever()
+
+def run_prefork_server(port=8000, processes=PREFORK_PROCESSES, workers=HTTP_WORKERS):
+    if STORAGE_BACKEND != "sqlite":
+        sys.exit("Pre-fork mode needs a store shared across processes: set PAYROLL_STORAGE=sqlite")
+    get_backend()  # Create (or migrate into) the database once, before forking
+    sock = socket.create_server(("0.0.0.0", port), backlog=128)
+    children = {}  # pid -> when it started
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # The parent's SIGTERM handler and child list aren't ours: SIGTERM just ends this worker
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            children.clear()
+            try:
+                serve_worker(sock, workers)
+            finally:
+                os._exit(1)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(processes):
+        spawn()
+    logging.info(f"HTTP server running at http://{get_local_ip()}:{port} with {processes} processes x {workers} workers")
+    delay = 0
+    while True:
+        pid, status = os.wait()
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        if time.monotonic() - started < RESPAWN_MIN_UPTIME:
+            delay = min(max(delay * 2, 1), RESPAWN_MAX_DELAY)
+        else:
+            delay = 0
+        logging.warning(f"[prefork] Worker {pid} exited with status {status}, starting a new one in {delay} s")
+        time.sleep(delay)
+        spawn()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    run_prefork_server(processes=int(sys.argv[1]) if len(sys.argv) > 1 else PREFORK_PROCESSES)
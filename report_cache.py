@@ -0,0 +1,80 @@
+import logging
+import threading
+from repository import get_repository
+
+class ReportCache:
+    """Rendered /report pages, one per pay-period window, dropped only by writes that change them.
+
+    An entry remembers the employees it shows and the name it shows for
+    each. Repository changes then invalidate just the affected windows:
+    - a completed or edited session ending inside the window;
+    - an employee in the report saved (rate, SSN, address...) or deleted;
+    - a clock-in that renamed an employee in the report.
+    Anything it can't place (a shared-mode reload, an edit replayed from
+    another process) drops every entry.
+    """
+
+    # Only today's window is ever asked for; keep a spare across midnight
+    MAX_ENTRIES = 2
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.lock = threading.Lock()
+        self.entries = {}
+        # Bumped by every invalidation, so a page rendered across a write isn't stored
+        self.generation = 0
+        repository.subscribe(self.on_change)
+
+    def get(self, window):
+        """(body or None, generation); pass the generation back to put()."""
+        with self.lock:
+            entry = self.entries.get(window)
+            return (entry[0] if entry else None), self.generation
+
+    def put(self, window, body, names, generation):
+        """Store `body` for `window` unless something changed since `generation` was read."""
+        with self.lock:
+            if generation != self.generation:
+                return
+            if len(self.entries) >= self.MAX_ENTRIES:
+                self.entries.clear()
+            self.entries[window] = (body, names)
+
+    def _invalidate(self, windows):
+        with self.lock:
+            self.generation += 1
+            for window in windows:
+                self.entries.pop(window, None)
+        if windows:
+            logging.debug(f"[ReportCache] Invalidated {len(windows)} report(s)")
+
+    def on_change(self, event):
+        with self.lock:
+            entries = dict(self.entries)
+        if event.kind in ('clock_out', 'edit'):
+            ended = [event.data['session']['clock_out']]
+            if event.kind == 'edit':
+                if 'previous_clock_out' not in event.data:
+                    self._invalidate(list(entries))
+                    return
+                ended.append(event.data['previous_clock_out'])
+            self._invalidate([window for window in entries if any(window[0] <= clock_out for clock_out in ended)])
+        elif event.kind in ('employee_saved', 'employee_deleted'):
+            self._invalidate([window for window, (_, names) in entries.items() if event.employee_id in names])
+        elif event.kind == 'clock_in':
+            name = self.repository.time_logs.get(event.employee_id, {}).get('name')
+            self._invalidate([window for window, (_, names) in entries.items()
+                              if event.employee_id in names and names[event.employee_id] != name])
+        else:
+            self._invalidate(list(entries))
+
+_report_cache = None
+_report_cache_lock = threading.Lock()
+
+def get_report_cache():
+    """The process's ReportCache, for the current repository."""
+    global _report_cache
+    with _report_cache_lock:
+        if _report_cache is None or _report_cache.repository is not get_repository():
+            _report_cache = ReportCache(get_repository())
+        return _report_cache
@@ -0,0 +1,379 @@
+import contextlib
+import copy
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from data import (
+    load_employees,
+    get_backend,
+    get_employee_store,
+    load_sessions_since,
+    employee_record,
+    apply_time_log_event,
+    record_time_log_event,
+    record_clock_in,
+    record_clock_out,
+    delete_time_logs,
+)
+from payrollutils import calculate_hours, normalize_timestamp
+from time_log_index import TimeLogIndex
+
+# flock'ed by every process sharing one store (pre-fork mode) around each write
+SHARED_WRITE_LOCK_FILE = "payroll.write.lock"
+# flock'ed for a whole payroll run in pre-fork mode, so only one process writes the reports
+SHARED_PAYROLL_LOCK_FILE = "payroll.run.lock"
+# Time log changes remembered for delta sync (time_log_changes_since); a
+# client further behind than this starts over with a full load
+TIME_LOG_CHANGE_HISTORY = 10000
+TIME_LOG_CHANGE_KINDS = ("clock_in", "clock_out", "edit", "employee_deleted")
+
+# kind is one of: clock_in, clock_out, edit, employee_saved, employee_deleted,
+# or reloaded (time logs replaced wholesale after falling behind; employee_id None)
+ChangeEvent = namedtuple("ChangeEvent", ["kind", "employee_id", "data"])
+
+class TimeClockError(Exception):
+    pass
+
+class AlreadyClockedIn(TimeClockError):
+    pass
+
+class NotClockedIn(TimeClockError):
+    pass
+
+class ProcessLock:
+    """Exclusive flock on a lock file, held across processes (POSIX only).
+
+    Open it after forking: each process needs its own open file, and
+    threads within a process must serialize on their own lock first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        import fcntl
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        import fcntl
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class PayrollLock:
+    """Held for a whole payroll run, which writes the shared report/CSV files.
+
+    Shared repositories also take SHARED_PAYROLL_LOCK_FILE, so two runs
+    started on different pre-fork workers can't overwrite each other.
+    """
+
+    def __init__(self, shared=False):
+        self._lock = threading.Lock()
+        self._process_lock = ProcessLock(SHARED_PAYROLL_LOCK_FILE) if shared else None
+
+    def acquire(self, blocking=True):
+        # Threads first: flock doesn't exclude threads sharing one open file
+        if not self._lock.acquire(blocking):
+            return False
+        if self._process_lock is not None and not self._process_lock.acquire(blocking):
+            self._lock.release()
+            return False
+        return True
+
+    def release(self):
+        if self._process_lock is not None:
+            self._process_lock.release()
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class Repository:
+    """The one in-memory copy of employees and time logs for this process.
+
+    The GUI and the HTTP server thread both read and write through it, so
+    neither has to reload from disk to see the other's changes. Every write
+    is checked and applied under a single lock and then announced to
+    subscribers as a ChangeEvent.
+
+    With `shared=True` other processes write the same (SQLite) store too:
+    writes also hold a cross-process file lock, and sync() catches up on
+    the other processes' changes from the store's version counters.
+    """
+
+    def __init__(self, shared=False):
+        self.lock = threading.RLock()
+        self.payroll_lock = PayrollLock(shared)
+        self.process_lock = ProcessLock(SHARED_WRITE_LOCK_FILE) if shared else None
+        self._time_logs_version = get_backend().time_logs_version()
+        self._employees_version = get_backend().employees_version()
+        self.employees = load_employees()
+        # Mutated in place by every write below
+        self.time_logs = get_backend().load_time_logs()
+        self._subscribers = []
+        # Bumped by every time log change. Shared repositories use the store's
+        # counter, which all processes agree on; otherwise it starts from the
+        # clock, so a version from before a restart is never taken as current.
+        self.time_log_version = self._time_logs_version if shared else int(time.time() * 1000)
+        self._time_log_changes = deque(maxlen=TIME_LOG_CHANGE_HISTORY)
+        # Sorted row keys for the paged time log API
+        self.time_log_index = TimeLogIndex(self.time_logs)
+        self.subscribe(self.time_log_index.on_change)
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Hold the lock(s) for a check-then-write, starting from up-to-date state."""
+        with self.lock:
+            if self.process_lock is None:
+                yield
+                return
+            with self.process_lock:
+                self.sync()
+                try:
+                    yield
+                finally:
+                    # Nobody else can write while we hold the file lock, so these are our own versions
+                    self._time_logs_version = get_backend().time_logs_version()
+                    self._employees_version = get_backend().employees_version()
+
+    def sync(self):
+        """Catch up on writes made by other processes sharing the store. No-op unless shared.
+
+        Their changes are published like our own: replayed time log events,
+        then employee_saved/employee_deleted for the employee records that differ.
+        """
+        if self.process_lock is None:
+            return
+        with self.lock:
+            backend = get_backend()
+            employees_version = backend.employees_version()
+            employees_before = dict(self.employees) if employees_version != self._employees_version else None
+            load_employees()  # The employee index revalidates against the store's version
+            self._employees_version = employees_version
+            deleted = self._sync_time_logs(backend)
+            if employees_before is not None:
+                self._publish_employee_changes(employees_before, deleted)
+
+    def _sync_time_logs(self, backend):
+        """Apply other processes' time log events; the employee IDs whose deletion was replayed."""
+        deleted = set()
+        version = backend.time_logs_version()
+        if version == self._time_logs_version:
+            return deleted
+        events = backend.time_log_events_since(self._time_logs_version) if hasattr(backend, 'time_log_events_since') else []
+        versions = [event_version for event_version, _ in events]
+        if versions and versions == list(range(self._time_logs_version + 1, versions[-1] + 1)) and versions[-1] >= version:
+            for event_version, event in events:
+                apply_time_log_event(self.time_logs, event)
+                self._publish_replayed(event, event_version)
+                if event['type'] == 'delete':
+                    deleted.add(event['employee_id'])
+            self._time_logs_version = versions[-1]
+        else:
+            # Too far behind, or a bulk rewrite without events: start over
+            logs = backend.load_time_logs()
+            self.time_logs.clear()
+            self.time_logs.update(logs)
+            self._time_logs_version = version
+            self._time_log_changes.clear()
+            self.time_log_version = version
+            self._publish('reloaded', None)
+        return deleted
+
+    def _publish_employee_changes(self, before, already_deleted):
+        """employee_saved/employee_deleted for each record that differs from `before` (a reload replaces them)."""
+        for employee_id, record in self.employees.items():
+            if before.get(employee_id) != record:
+                self._publish('employee_saved', employee_id)
+        for employee_id in before.keys() - self.employees.keys() - already_deleted:
+            # No time logs, so no replayed event: the time log version is unchanged
+            self._publish('employee_deleted', employee_id, version=self.time_log_version)
+
+    def _publish_replayed(self, event, version):
+        employee_id = event['employee_id']
+        if event['type'] == 'clock_in':
+            self._publish('clock_in', employee_id, {'clock_in': event['clock_in']}, version)
+        elif event['type'] == 'clock_out':
+            index = len(self.time_logs[employee_id]['sessions']) - 1
+            self._publish('clock_out', employee_id, {'session_index': index, 'session': event['session']}, version)
+        elif event['type'] == 'edit':
+            index = event['session_index']
+            sessions = self.time_logs.get(employee_id, {}).get('sessions', [])
+            if 0 <= index < len(sessions):
+                self._publish('edit', employee_id, {'session_index': index, 'session': sessions[index]}, version)
+        elif event['type'] == 'delete':
+            self._publish('employee_deleted', employee_id, version=version)
+
+    def subscribe(self, callback):
+        """Call `callback(event)` after every change. Runs on the writer's thread."""
+        with self.lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _publish(self, kind, employee_id, data=None, version=None):
+        event = ChangeEvent(kind, employee_id, data or {})
+        if kind in TIME_LOG_CHANGE_KINDS:
+            if version is None:
+                # Our own write; in shared mode we still hold the file lock, so the store's version is ours
+                version = get_backend().time_logs_version() if self.process_lock is not None else self.time_log_version + 1
+            self.time_log_version = version
+            self._time_log_changes.append((version, event))
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                logging.error(f"[Repository] Subscriber failed on {kind} for {employee_id}: {e}")
+
+    def time_log_changes_since(self, version):
+        """The ChangeEvents after time log `version`, oldest first, or None if
+        they're no longer all remembered (or `version` isn't one of ours).
+        """
+        with self.lock:
+            if version == self.time_log_version:
+                return []
+            if version > self.time_log_version or not self._time_log_changes or self._time_log_changes[0][0] > version + 1:
+                return None
+            return [event for event_version, event in self._time_log_changes if event_version > version]
+
+    def snapshot(self, since=None):
+        """Private copies of (employees, time_logs) for long-running readers like payroll.
+
+        With `since`, time_logs only holds sessions with clock_out >= since
+        (see time_logs_since) instead of the whole history.
+        """
+        with self.lock:
+            # Picks up edits made to the employee files outside this process
+            load_employees()
+            if since is not None:
+                return copy.deepcopy(self.employees), self.time_logs_since(since)
+            return copy.deepcopy(self.employees), copy.deepcopy(self.time_logs)
+
+    def time_logs_since(self, since, employee_id=None):
+        """{employee_id: {'name', 'sessions'}} for sessions with clock_out >= since.
+
+        Served from storage, which only opens the partitions covering the
+        range; every write is persisted before the lock is released, so it
+        agrees with the in-memory copy.
+        """
+        with self.lock:
+            sessions = load_sessions_since(since, employee_id)
+            return {
+                emp_id: {'name': self.time_logs.get(emp_id, {}).get('name', ''), 'sessions': emp_sessions}
+                for emp_id, emp_sessions in sessions.items()
+                if emp_sessions
+            }
+
+    def is_clocked_in(self, employee_id):
+        return bool(self.time_logs.get(employee_id, {}).get('clock_in'))
+
+    def clock_in(self, employee_id, clock_in, location=None, manager_override=False):
+        clock_in = normalize_timestamp(clock_in)
+        with self.writing():
+            if self.is_clocked_in(employee_id):
+                raise AlreadyClockedIn(employee_id)
+            entry = record_clock_in(
+                self.time_logs,
+                employee_id,
+                self.employees[employee_id]['name'],
+                clock_in,
+                location=location,
+                manager_override=manager_override,
+            )
+            self._publish('clock_in', employee_id, {'clock_in': clock_in})
+            return entry
+
+    def clock_out(self, employee_id, clock_out, location=None, manager_override=False):
+        clock_out = normalize_timestamp(clock_out)
+        with self.writing():
+            if not self.is_clocked_in(employee_id):
+                raise NotClockedIn(employee_id)
+            session = record_clock_out(
+                self.time_logs,
+                employee_id,
+                clock_out,
+                location=location,
+                manager_override=manager_override,
+            )
+            index = len(self.time_logs[employee_id]['sessions']) - 1
+            self._publish('clock_out', employee_id, {'session_index': index, 'session': session})
+            return session
+
+    def edit_session(self, employee_id, session_index, new_clock_in, new_clock_out, manager_override=True):
+        new_clock_in = normalize_timestamp(new_clock_in)
+        new_clock_out = normalize_timestamp(new_clock_out)
+        with self.writing():
+            sessions = self.time_logs.get(employee_id, {}).get('sessions', [])
+            if not 0 <= session_index < len(sessions):
+                logging.warning(f"[Repository.edit_session] No session {session_index} for employee_id: {employee_id}")
+                return False
+            previous_clock_out = sessions[session_index]['clock_out']
+            changes = {
+                'clock_in': new_clock_in,
+                'clock_out': new_clock_out,
+                'hours': calculate_hours(new_clock_in, new_clock_out),
+                'manager_override': manager_override,
+            }
+            record_time_log_event(self.time_logs, {
+                'type': 'edit',
+                'employee_id': employee_id,
+                'session_index': session_index,
+                'changes': changes,
+            })
+            self._publish('edit', employee_id, {
+                'session_index': session_index,
+                'session': sessions[session_index],
+                'previous_clock_out': previous_clock_out,
+            })
+            return True
+
+    def save_employee(self, employee_id, *fields, **kwargs):
+        """Insert or update one employee; arguments as for data.save_employee."""
+        with self.writing():
+            get_employee_store().upsert(employee_id, employee_record(*fields, **kwargs))
+            self._publish('employee_saved', employee_id)
+
+    def delete_employee(self, employee_id):
+        with self.writing():
+            if not get_employee_store().delete(employee_id):
+                return False
+            delete_time_logs(self.time_logs, employee_id)
+            self._publish('employee_deleted', employee_id)
+            return True
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def get_repository():
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = Repository()
+        return _repository
+
+def init_repository(shared=False):
+    """Replace the process-wide repository, e.g. with a shared one in a pre-fork worker."""
+    global _repository
+    with _repository_lock:
+        _repository = Repository(shared=shared)
+        return _repository
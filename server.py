@@ -1,25 +1,197 @@
 
+import collections
 import http.server
 import socketserver
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, quote
 import logging
 import socket
 import hashlib
 import datetime
-import csv
+import gzip
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 from logging.handlers import RotatingFileHandler
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from data import load_employees, load_time_logs, save_time_logs, save_employee, ADMIN_PIN_HASH, edit_time_log_session
-from payrollutils import haversine_distance, calculate_hours, calculate_pay_with_profile, SHOP_LAT, SHOP_LON, ALLOWED_RADIUS_METERS
+from data import ADMIN_PIN_HASH, get_employee_store
+from assets import AssetVersion, StaticAsset, STATIC_MAX_AGE, not_modified
+from templates import Template, TEMPLATES_DIR, load_template
+from time_log_index import OPEN_SESSION, decode_cursor, encode_cursor
+from event_stream import SSE_MAX_STREAMS, get_event_streams
+from report_cache import get_report_cache
+from payroll_engine import run_payroll
+from repository import get_repository, AlreadyClockedIn, NotClockedIn
+from payrollutils import haversine_distance, calculate_pay_with_profile, normalize_timestamp, SHOP_LAT, SHOP_LON, ALLOWED_RADIUS_METERS
+
+# Requests are served by a fixed pool of worker threads (see PooledHTTPServer)
+HTTP_WORKERS = int(os.getenv("PAYROLL_HTTP_WORKERS", "8"))
+# An idle keep-alive connection holds a worker, so it's closed after this many seconds
+KEEPALIVE_TIMEOUT = float(os.getenv("PAYROLL_KEEPALIVE_TIMEOUT", "5"))
+# /get_time_logs pages: rows per page unless the client asks, and the most it may ask for
+TIME_LOGS_PAGE_SIZE = 100
+TIME_LOGS_MAX_PAGE_SIZE = 1000
+# /get_time_logs?type=... values, as TimeLogIndex kinds
+TIME_LOG_TYPES = {'': None, 'in': 'in', 'clock in': 'in', 'out': 'out', 'clock out': 'out'}
+# Distinct queries cached per route by the conditional hook, for the current generation
+RESPONSE_CACHE_ENTRIES = 64
+# Bodies smaller than this go out uncompressed: gzip wouldn't save a round trip
+GZIP_MIN_BYTES = 1024
+
+class Route:
+    """One entry in the route table (see ROUTES).
+
+    `params` names the query string (GET) or form (POST) fields the handler
+    reads; it gets exactly those as keyword arguments, '' when missing.
+    `hooks` wrap the handler, outermost first: each is called once as
+    hook(route, call) and returns the call to use instead, where
+    call(request, params) returns the response body: str, bytes, an
+    AssetVersion or PreparedBody, or None if the handler already sent its
+    own response.
+    """
+
+    def __init__(self, path, handler, methods=("GET",), params=(), content_type="text/html", hooks=()):
+        self.path = path
+        self.handler = handler
+        self.methods = methods
+        self.params = params
+        self.content_type = content_type
+        call = lambda request, params: handler(request, **params)
+        for hook in reversed(hooks):
+            call = hook(self, call)
+        self.call = call
+
+def timed(route, call):
+    """Route hook: log how long each request to the route took."""
+    def timed_call(request, params):
+        started = time.perf_counter()
+        try:
+            return call(request, params)
+        finally:
+            logging.info(f"[server] {request.command} {route.path} took {(time.perf_counter() - started) * 1000:.1f} ms")
+    return timed_call
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip (and doesn't give it q=0)."""
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def location_info(location):
+    lat = location.get('lat', '')
+    lon = location.get('lon', '')
+    if lat and lon:
+        return f"Lat: {lat:.4f}, Lon: {lon:.4f}"
+    return ""
+
+def time_log_row_id(emp_id, session_index, kind):
+    """Stable ID of a /get_time_logs row, for clients patching their table from a delta."""
+    if session_index == OPEN_SESSION:
+        return f"{emp_id}:open"
+    return f"{emp_id}:{session_index}:{kind}"
+
+def time_log_row(emp_id, data, session_index, kind):
+    """One /get_time_logs row: the clock-in or clock-out of a session, or an open clock-in (OPEN_SESSION)."""
+    if session_index == OPEN_SESSION:
+        return {
+            'id': time_log_row_id(emp_id, session_index, kind),
+            'employee_id': emp_id,
+            'name': data.get('name', ''),
+            'type': 'Clock In',
+            'time': data['clock_in'],
+            'hours': 'Active',
+            'location': location_info(data.get('last_location', {})),
+        }
+    session = data['sessions'][session_index]
+    return {
+        'id': time_log_row_id(emp_id, session_index, kind),
+        'employee_id': emp_id,
+        'name': data.get('name', ''),
+        'type': 'Clock In' if kind == 'in' else 'Clock Out',
+        'time': session['clock_in'] if kind == 'in' else session['clock_out'],
+        'hours': f"{session['hours']:.2f}",
+        'location': location_info(session['location']) if 'location' in session else "",
+        'session_index': session_index,
+    }
+
+# A response body encoded once, with its gzip variant if worth sending (see conditional)
+PreparedBody = collections.namedtuple("PreparedBody", "body gzip_body")
+
+def prepare_body(body):
+    body = body if isinstance(body, bytes) else body.encode()
+    return PreparedBody(body, gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None)
+
+def conditional(version_of):
+    """Route hook factory for responses that only change with a store generation.
+
+    version_of(request) returns that generation. Responses get a weak ETag
+    made from it and the request's parameters, a matching If-None-Match gets
+    a bodiless 304, and bodies are kept, encoded and compressed, for the
+    current generation so repeated polls skip the handler.
+    """
+    def hook(route, call):
+        cache = {}
+        lock = threading.Lock()
+
+        def conditional_call(request, params):
+            # Read before the handler runs: a body is never older than its ETag says
+            version = version_of(request)
+            key = tuple(sorted(params.items()))
+            etag = 'W/"' + hashlib.sha256(repr((version, key)).encode()).hexdigest()[:24] + '"'
+            request.response_headers += [("ETag", etag), ("Cache-Control", "no-cache")]
+            if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+                request.send_response(304)
+                for name, value in request.response_headers:
+                    request.send_header(name, value)
+                request.end_headers()
+                return None
+            with lock:
+                body = cache.get((version, key))
+            if body is None:
+                body = call(request, params)
+                if body is None:
+                    return None  # The handler sent its own (error) response
+                body = prepare_body(body)
+                with lock:
+                    if any(cached_version != version for cached_version, _ in cache) or len(cache) >= RESPONSE_CACHE_ENTRIES:
+                        cache.clear()
+                    cache[(version, key)] = body
+            return body
+        return conditional_call
+    return hook
+
+def employees_generation(request):
+    return get_employee_store().version()
+
+def time_logs_generation(request):
+    return request.repo.time_log_version
+
+def is_admin_pin(pin):
+    return hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH
+
+# Pages compiled once at import; see templates.py. The static ones are
+# StaticAssets, so they're kept encoded and precompressed, and reload on edit.
+OVERRIDE_PAGE = StaticAsset(os.path.join(TEMPLATES_DIR, "override.html"), "text/html")
+ADMIN_PAGE = StaticAsset(os.path.join(TEMPLATES_DIR, "admin.html"), "text/html")
+STATUS_PAGE = load_template("status.html")
+REPORT_PAGE = load_template("report.html")
+REPORT_EMPLOYEE = load_template("report_employee.html")
+MESSAGE = Template("<h2>{{ message }}</h2><a href='/'>Back</a>")
+EMPLOYEE_MESSAGE = Template("<h2>{{ message }}</h2><p>Employee: {{ name }}</p><a href='/'>Back</a>")
+TIME_LOG_UPDATED = Template("<h2>Time log for {{ employee_id }} (session {{ session_index }}) updated successfully.</h2><a href=\"/admin?pin={{ pin }}\">Back to Admin</a>")
+
+INVALID_PIN = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
+EMPLOYEE_NOT_FOUND = "<h2>Error: Employee not found</h2><a href='/'>Back</a>"
 
 class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
+    # Persistent connections: every response carries a Content-Length
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body are separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
     # Load .env relative to this file to avoid CWD issues
     load_dotenv(os.path.join(os.path.dirname(__file__), '.env'), override=True)
     # Configure file logging for SMTP and app events
@@ -33,184 +205,222 @@ class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
             logging.getLogger().setLevel(logging.INFO)
     except Exception:
         pass
-    employees = load_employees()
-    time_logs = load_time_logs()
+
+    @property
+    def repo(self):
+        return get_repository()
+
+    @property
+    def employees(self):
+        return self.repo.employees
+
+    @property
+    def time_logs(self):
+        return self.repo.time_logs
 
     def do_GET(self):
         logging.info(f"GET request from {self.client_address}")
-        
-        # Handle CSS file
-        if self.path == "/style.css":
-            self.send_response(200)
-            self.send_header("Content-type", "text/css")
-            self.end_headers()
-            with open("style.css", 'rb') as f:
-                self.wfile.write(f.read())
-            return
-        
-        # Handle JSON endpoints first
-        if self.path == "/get_employees":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            import json
-            employees_list = []
-            for emp_id, emp_data in self.employees.items():
-                employees_list.append({
-                    'employee_id': emp_id,
-                    'name': emp_data.get('name', ''),
-                    'hourly_rate': emp_data.get('hourly_rate', 0),
-                    'ssn': emp_data.get('ssn', ''),
-                    'address': emp_data.get('address', ''),
-                    'email': emp_data.get('email', ''),
-                    'visa_status': emp_data.get('visa_status', ''),
-                    'w4_nonresident_alien': emp_data.get('w4_nonresident_alien', ''),
-                    'pin': emp_data.get('pin', '')
-                })
-            self.wfile.write(json.dumps(employees_list).encode())
+        self.repo.sync()
+        self.dispatch()
+
+    def do_POST(self):
+        logging.info(f"POST request from {self.client_address}")
+        self.repo.sync()
+        self.dispatch()
+
+    def dispatch(self):
+        path, _, query = self.path.partition('?')
+        route = ROUTES.get((self.command, path))
+        if route is None:
+            if path in ROUTE_PATHS:
+                self.send_error(405)
+            else:
+                self.send_error(404)
             return
-        
-        if self.path == "/get_time_logs":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
+        if self.command == "POST":
+            query = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        fields = parse_qs(query)
+        # Hooks add headers for the 200 response here
+        self.response_headers = []
+        body = route.call(self, {name: fields.get(name, [''])[0] for name in route.params})
+        if body is None:
+            return  # The handler sent its own response
+        self.send_response(200)
+        self.send_header("Content-type", route.content_type)
+        for name, value in self.response_headers:
+            self.send_header(name, value)
+        if isinstance(body, (AssetVersion, PreparedBody)):
+            self.send_body(body.body, body.gzip_body)
+        else:
+            self.send_body(body if isinstance(body, bytes) else body.encode())
+
+    def send_body(self, body, gzip_body=None):
+        """End the headers and send `body`, gzip-compressed when it's big enough and the client accepts it.
+
+        `gzip_body`, if given, is the already-compressed variant to use instead.
+        """
+        if len(body) >= GZIP_MIN_BYTES:
+            self.send_header("Vary", "Accept-Encoding")
+            if accepts_gzip(self.headers.get('Accept-Encoding', '')):
+                body = gzip_body or gzip.compress(body, compresslevel=6, mtime=0)
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_static(self, asset):
+        """Serve a StaticAsset from memory, or a 304 if the client's copy is current."""
+        version = asset.current()
+        use_gzip = version.gzip_body is not None and accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        fresh = not_modified(version, self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since'))
+        self.send_response(304 if fresh else 200)
+        self.send_header("ETag", version.gzip_etag if use_gzip else version.etag)
+        self.send_header("Cache-Control", f"public, max-age={STATIC_MAX_AGE}")
+        self.send_header("Vary", "Accept-Encoding")
+        if fresh:
             self.end_headers()
-            import json
-            time_logs_list = []
-            
-            # Get current time logs
-            current_time_logs = load_time_logs()
-            
-            # Add current clock-ins
-            for emp_id, data in current_time_logs.items():
-                if 'clock_in' in data:
-                    # Current clock-in
-                    location_info = ""
-                    if 'last_location' in data:
-                        lat = data['last_location'].get('lat', '')
-                        lon = data['last_location'].get('lon', '')
-                        if lat and lon:
-                            location_info = f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-                    
-                    time_logs_list.append({
-                        'employee_id': emp_id,
-                        'name': data.get('name', ''),
-                        'type': 'Clock In',
-                        'time': data['clock_in'],
-                        'hours': 'Active',
-                        'location': location_info
-                    })
-                
-                # Add completed sessions
-                if 'sessions' in data:
-                    for idx, session in enumerate(data['sessions']):
-                        location_info = ""
-                        if 'location' in session:
-                            lat = session['location'].get('lat', '')
-                            lon = session['location'].get('lon', '')
-                            if lat and lon:
-                                location_info = f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-                        
-                        # Clock-in entry
-                        time_logs_list.append({
-                            'employee_id': emp_id,
-                            'name': data.get('name', ''),
-                            'type': 'Clock In',
-                            'time': session['clock_in'],
-                            'hours': f"{session['hours']:.2f}",
-                            'location': location_info,
-                            'session_index': idx # Add session index
-                        })
-                        
-                        # Clock-out entry
-                        time_logs_list.append({
-                            'employee_id': emp_id,
-                            'name': data.get('name', ''),
-                            'type': 'Clock Out',
-                            'time': session['clock_out'],
-                            'hours': f"{session['hours']:.2f}",
-                            'location': location_info,
-                            'session_index': idx # Add session index
-                        })
-            
-            self.wfile.write(json.dumps(time_logs_list).encode())
             return
-        
-        # Handle HTML endpoints
+        body = version.gzip_body if use_gzip else version.body
+        self.send_header("Content-type", asset.content_type)
+        self.send_header("Last-Modified", version.last_modified)
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def event_stream(self):
+        """Server-Sent Events, one per repository change (see event_stream.py)."""
+        streams = get_event_streams()
+        if getattr(self.server, 'detach', None) is None or len(streams.streams) >= SSE_MAX_STREAMS:
+            self.send_error(503, "Live updates unavailable")
+            return None
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
         self.end_headers()
-        
-        if self.path == "/report":
-            response = self.view_report()
-        elif self.path.startswith("/override"):
-            pin = parse_qs(self.path.split('?')[1] if '?' in self.path else '').get('pin', [''])[0]
-            pin = pin.strip()
-            print(f"[DEBUG] Override GET - Received PIN: {pin}")
-            print(f"[DEBUG] Override GET - ADMIN_PIN_HASH: {ADMIN_PIN_HASH}")
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.override_form()
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path.startswith("/status"):
-            params = parse_qs(self.path.split('?')[1] if '?' in self.path else '')
-            employee_id = params.get('employee_id', [''])[0]
-            pin = params.get('pin', [''])[0]
-            response = self.show_status(employee_id, pin)
-        else:
-            response = """
-            <html>
-            <head>
-                <title>Freezy Frenzy Time Clock</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <link rel="stylesheet" href="/style.css">
-            </head>
-            <body>
-                <h2>Freezy Frenzy Employee Clock-In/Out</h2>
-                <form action="/status" method="GET">
-                    Employee ID: <input type="text" name="employee_id"><br><br>
-                    PIN: <input type="password" name="pin"><br><br>
-                    <input type="submit" value="Check Status">
-                </form>
-                <br>
-                <form method="POST" action="/" onsubmit="return getLocation()">
-                    Employee ID: <input type="text" name="employee_id"><br><br>
-                    PIN: <input type="password" name="pin"><br><br>
-                    <input type="hidden" name="latitude" id="latitude">
-                    <input type="hidden" name="longitude" id="longitude">
-                    <input type="submit" name="action" value="Clock In">
-                    <input type="submit" name="action" value="Clock Out">
-                </form>
-                <br>
-                <form method="POST" action="/admin">
-                    PIN: <input type="password" name="pin"><br><br>
-                    <input type="submit" value="Admin Panel">
-                </form>
-                <script>
-                    function getLocation() {
-                        if (navigator.geolocation) {
-                            navigator.geolocation.getCurrentPosition(
-                                (position) => {
-                                    document.getElementById("latitude").value = position.coords.latitude;
-                                    document.getElementById("longitude").value = position.coords.longitude;
-                                    document.forms[1].submit();
-                                },
-                                (error) => {
-                                    alert("Please enable location services to clock in/out.");
-                                    return false;
-                                }
-                            );
-                        } else {
-                            alert("Geolocation not supported by your browser.");
-                            return false;
-                        }
-                        return false;
-                    }
-                </script>
-            </body>
-            </html>
-            """
-        
-        self.wfile.write(response.encode())
+        # Reconnect after 3 s if the stream drops; the client then re-syncs with since=version
+        self.wfile.write(b"retry: 3000\n\n")
+        self.close_connection = True
+        if streams.add(self.request):
+            self.server.detach(self.request)
+        return None
+
+    def get_employees_json(self):
+        employees_list = []
+        with self.repo.lock:
+            employee_items = list(self.employees.items())
+        for emp_id, emp_data in employee_items:
+            employees_list.append({
+                'employee_id': emp_id,
+                'name': emp_data.get('name', ''),
+                'hourly_rate': emp_data.get('hourly_rate', 0),
+                'ssn': emp_data.get('ssn', ''),
+                'address': emp_data.get('address', ''),
+                'email': emp_data.get('email', ''),
+                'visa_status': emp_data.get('visa_status', ''),
+                'w4_nonresident_alien': emp_data.get('w4_nonresident_alien', ''),
+                'pin': emp_data.get('pin', '')
+            })
+        return json.dumps(employees_list)
+
+    def get_time_logs_json(self, employee_id, start, end, type, limit, cursor, since):
+        """Every time log row, one page of them when any filter or paging
+        parameter is given, or with `since` only what changed after that version.
+        """
+        if since:
+            return self.time_logs_delta(since, employee_id, start, end, type)
+        if any((employee_id, start, end, type, limit, cursor)):
+            return self.time_logs_page(employee_id, start, end, type, limit, cursor)
+        time_logs_list = []
+        with self.repo.lock:
+            for emp_id, data in self.time_logs.items():
+                # Current clock-in
+                if 'clock_in' in data:
+                    time_logs_list.append(time_log_row(emp_id, data, OPEN_SESSION, 'in'))
+                # Completed sessions
+                for idx in range(len(data.get('sessions', []))):
+                    time_logs_list.append(time_log_row(emp_id, data, idx, 'in'))
+                    time_logs_list.append(time_log_row(emp_id, data, idx, 'out'))
+        return json.dumps(time_logs_list)
+
+    def time_logs_page(self, employee_id, start, end, type, limit, cursor):
+        """{"rows": [...], "next_cursor": ...}, newest first, served from the repository's TimeLogIndex.
+
+        Pass next_cursor back as `cursor`, with the same filters, for the next page.
+        """
+        try:
+            kind = TIME_LOG_TYPES[type.strip().lower()]
+            limit = min(int(limit or TIME_LOGS_PAGE_SIZE), TIME_LOGS_MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit}")
+            after = decode_cursor(cursor) if cursor else None
+        except (KeyError, ValueError) as e:
+            self.send_error(400, f"Bad time log query: {e}")
+            return None
+        with self.repo.lock:
+            keys, next_key = self.repo.time_log_index.page(employee_id or None, kind, start or None, end or None, limit, after)
+            rows = [time_log_row(key[1], self.time_logs[key[1]], key[2], key[3]) for key in keys]
+            version = self.repo.time_log_version
+        return json.dumps({'rows': rows, 'next_cursor': encode_cursor(next_key) if next_key else None, 'version': version})
+
+    def time_logs_delta(self, since, employee_id, start, end, type):
+        """What changed after time log version `since`, under the same filters as time_logs_page.
+
+        {"version", "rows": rows added or changed, "removed": row IDs, "removed_employees": IDs
+        whose rows all went, "names": {employee ID: the name now shown on all their rows}},
+        or {"version", "reset": true} when the client must load in full.
+        Clients apply removed_employees, then removed, then rows, then names.
+        """
+        try:
+            since = int(since)
+            kind = TIME_LOG_TYPES[type.strip().lower()]
+        except (KeyError, ValueError) as e:
+            self.send_error(400, f"Bad time log query: {e}")
+            return None
+        with self.repo.lock:
+            version = self.repo.time_log_version
+            changes = self.repo.time_log_changes_since(since)
+            if changes is None:
+                return json.dumps({'version': version, 'reset': True})
+            touched = {}
+            removed_employees = []
+            for event in changes:
+                emp_id = event.employee_id
+                if event.kind == 'clock_in':
+                    touched[time_log_row_id(emp_id, OPEN_SESSION, 'in')] = (emp_id, OPEN_SESSION, 'in')
+                elif event.kind in ('clock_out', 'edit'):
+                    if event.kind == 'clock_out':
+                        touched[time_log_row_id(emp_id, OPEN_SESSION, 'in')] = (emp_id, OPEN_SESSION, 'in')
+                    for row_kind in ('in', 'out'):
+                        index = event.data['session_index']
+                        touched[time_log_row_id(emp_id, index, row_kind)] = (emp_id, index, row_kind)
+                elif event.kind == 'employee_deleted':
+                    removed_employees.append(emp_id)
+            rows, removed = [], []
+            for row_id, (emp_id, index, row_kind) in touched.items():
+                data = self.time_logs.get(emp_id, {})
+                if index == OPEN_SESSION:
+                    exists = bool(data.get('clock_in'))
+                else:
+                    exists = index < len(data.get('sessions', []))
+                row = time_log_row(emp_id, data, index, row_kind) if exists else None
+                if row is not None and (not employee_id or emp_id == employee_id) and (kind is None or row_kind == kind) \
+                        and (not start or row['time'] >= start) and (not end or row['time'][:len(end)] <= end):
+                    rows.append(row)
+                else:
+                    removed.append(row_id)
+            # A clock-in refreshes the stored name, which every row of that employee shows
+            names = {emp_id: self.time_logs[emp_id].get('name', '') for emp_id, _, _ in touched.values() if emp_id in self.time_logs}
+        return json.dumps({'version': version, 'rows': rows, 'removed': removed, 'removed_employees': removed_employees, 'names': names})
+
+    def override(self, pin):
+        pin = pin.strip()
+        print(f"[DEBUG] Override GET - Received PIN: {pin}")
+        print(f"[DEBUG] Override GET - ADMIN_PIN_HASH: {ADMIN_PIN_HASH}")
+        if is_admin_pin(pin):
+            return self.override_form()
+        return INVALID_PIN
 
     def show_status(self, employee_id, pin):
         if not employee_id or employee_id not in self.employees:
@@ -222,71 +432,27 @@ class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
             status = f"Clocked in since {self.time_logs[employee_id]['clock_in']}"
             if self.time_logs[employee_id].get('manager_override'):
                 status += " (Manager Override)"
-        return f"""
-        <html>
-        <head>
-            <title>Employee Status</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <link rel="stylesheet" href="/style.css">
-        </head>
-        <body>
-            <h2>Employee Status</h2>
-            <p>Employee: {self.employees[employee_id]['name']} (ID: {employee_id})</p>
-            <p>Status: {status}</p>
-            <a href='/'>Back to Clock-In/Out</a>
-        </body>
-        </html>
-        """
+        return STATUS_PAGE.render(name=self.employees[employee_id]['name'], employee_id=employee_id, status=status)
 
     def override_form(self):
-        html_content = """
-        <html>
-        <head>
-            <title>Manager Override</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <link rel="stylesheet" href="/style.css">
-        </head>
-        <body>
-            <h2>Manager Override: Set Clock-In/Out Time</h2>
-            <form method="POST" action="/set_override">
-                Employee ID: <input type="text" name="employee_id"><br><br>
-                Clock-In Time (YYYY-MM-DD HH:MM:SS): <input type="text" name="clock_in_time" id="clock_in_time"><br><br>
-                PIN: <input type="password" name="pin"><br><br>
-                <input type="submit" value="Set Clock-In">
-            </form>
-            <form method="POST" action="/set_override_clockout">
-                Employee ID: <input type="text" name="employee_id"><br><br>
-                Clock-Out Time (YYYY-MM-DD HH:MM:SS): <input type="text" name="clock_out_time" id="clock_out_time"><br><br>
-                PIN: <input type="password" name="pin"><br><br>
-                <input type="submit" value="Set Clock-Out">
-            </form>
-            <script>
-                function getCurrentDateTime() {
-                    const now = new Date();
-                    const year = now.getFullYear();
-                    const month = String(now.getMonth() + 1).padStart(2, '0');
-                    const day = String(now.getDate()).padStart(2, '0');
-                    const hours = String(now.getHours()).padStart(2, '0');
-                    const minutes = String(now.getMinutes()).padStart(2, '0');
-                    const seconds = String(now.getSeconds()).padStart(2, '0');
-                    return `${year}-${month}-${day} ${hours}:${minutes}:${seconds}`;
-                }
-                document.getElementById('clock_in_time').value = getCurrentDateTime();
-                document.getElementById('clock_out_time').value = getCurrentDateTime();
-            </script>
-            <a href='/'>Back</a>
-        </body>
-        </html>
-        """
-        return html_content
+        return OVERRIDE_PAGE.current()
 
     def view_report(self):
         pay_period_start = (datetime.datetime.now() - datetime.timedelta(days=14)).strftime("%Y-%m-%d")
-        report_lines = []
-        report_lines.append("<html><head><title>Payroll Report</title><link rel=\"stylesheet\" href=\"/style.css\"></head><body>")
-        report_lines.append("<h2>Payroll Report</h2>")
-        report_lines.append(f"<p>Pay Period: {pay_period_start} to {datetime.datetime.now().strftime('%Y-%m-%d')}</p>")
-        for emp_id, data in self.time_logs.items():
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        cache = get_report_cache()
+        body, generation = cache.get((pay_period_start, today))
+        if body is None:
+            names = {}
+            body = prepare_body(self.render_report(pay_period_start, today, names))
+            cache.put((pay_period_start, today), body, names, generation)
+        return body
+
+    def render_report(self, pay_period_start, today, names):
+        """The report page for sessions ending from pay_period_start on; fills `names` with the employees shown."""
+        rows = []
+        time_log_items = self.repo.time_logs_since(pay_period_start).items()
+        for emp_id, data in time_log_items:
             if 'sessions' not in data:
                 continue
             total_hours = sum(session['hours'] for session in data['sessions'] if session['clock_out'] >= pay_period_start)
@@ -294,606 +460,166 @@ class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
                 continue
             is_nra = str(self.employees[emp_id].get('w4_nonresident_alien', '')).lower() in ['yes', 'true', '1']
             gross, federal_tax, state_tax, net_pay = calculate_pay_with_profile(total_hours, self.employees[emp_id]['hourly_rate'], is_nra)
-            report_lines.append(f"<p>Employee: {data['name']} (ID: {emp_id})</p>")
-            report_lines.append(f"<p>SSN: {self.employees[emp_id]['ssn']}</p>")
-            report_lines.append(f"<p>Address: {self.employees[emp_id]['address']}</p>")
-            report_lines.append(f"<p>Total Hours: {total_hours:.2f}</p>")
-            report_lines.append(f"<p>Gross Pay: ${gross:.2f}</p>")
-            report_lines.append(f"<p>Federal Tax: ${federal_tax:.2f}</p>")
-            report_lines.append(f"<p>State Tax: ${state_tax:.2f}</p>")
-            report_lines.append(f"<p>Net Pay: ${net_pay:.2f}</p><br>")
-        report_lines.append("<a href='/'>Back</a>")
-        report_lines.append("</body></html>")
-        return "\n".join(report_lines)
+            names[emp_id] = data['name']
+            rows.append(REPORT_EMPLOYEE.render(
+                name=data['name'],
+                employee_id=emp_id,
+                ssn=self.employees[emp_id]['ssn'],
+                address=self.employees[emp_id]['address'],
+                hours=f"{total_hours:.2f}",
+                gross=f"{gross:.2f}",
+                federal_tax=f"{federal_tax:.2f}",
+                state_tax=f"{state_tax:.2f}",
+                net_pay=f"{net_pay:.2f}",
+            ))
+        return REPORT_PAGE.render(start=pay_period_start, end=today, employees=b"".join(rows))
+
+    def admin(self, pin):
+        if is_admin_pin(pin):
+            return self.admin_form()
+        return INVALID_PIN
+
+    def add_employee(self, employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, pin, payment_method, bank_routing, bank_account, payroll_card_id):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        w4_nonresident_alien = 'yes' if w4_nonresident_alien else ''
+        return self.save_employee(employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, payment_method, bank_routing, bank_account, payroll_card_id, pin)
+
+    def update_employee(self, employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, pin):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        if employee_id not in self.employees:
+            return EMPLOYEE_NOT_FOUND
+        w4_nonresident_alien = 'yes' if w4_nonresident_alien else ''
+        try:
+            hourly_rate = float(hourly_rate) if hourly_rate else self.employees[employee_id]['hourly_rate']
+            self.repo.save_employee(
+                employee_id,
+                name or self.employees[employee_id]['name'],
+                hourly_rate,
+                ssn or self.employees[employee_id]['ssn'],
+                address or self.employees[employee_id]['address'],
+                email or self.employees[employee_id].get('email',''),
+                visa_status or self.employees[employee_id].get('visa_status',''),
+                w4_nonresident_alien or self.employees[employee_id].get('w4_nonresident_alien',''),
+                self.employees[employee_id].get('payment_method',''),
+                self.employees[employee_id].get('bank_routing',''),
+                self.employees[employee_id].get('bank_account',''),
+                self.employees[employee_id].get('payroll_card_id',''),
+                pin or self.employees[employee_id].get('pin',''),
+            )
+            return "<h2>Employee updated</h2><a href='/'>Back</a>"
+        except ValueError:
+            return "<h2>Error: Invalid hourly rate</h2><a href='/'>Back</a>"
 
-    def do_POST(self):
-        logging.info(f"POST request from {self.client_address}")
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length).decode()
-        params = parse_qs(post_data)
-
-        employee_id = params.get('employee_id', [''])[0]
-        pin = params.get('pin', [''])[0]
-        action = params.get('action', [''])[0]
-        latitude = params.get('latitude', [''])[0]
-        longitude = params.get('longitude', [''])[0]
-        clock_in_time = params.get('clock_in_time', [''])[0]
-
-        response = ""
-        if self.path == "/admin":
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.admin_form()
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/save_employee":
-            employee_id = params.get('employee_id', [''])[0]
-            name = params.get('name', [''])[0]
-            hourly_rate = params.get('hourly_rate', [''])[0]
-            ssn = params.get('ssn', [''])[0]
-            address = params.get('address', [''])[0]
-            email = params.get('email', [''])[0]
-            visa_status = params.get('visa_status', [''])[0]
-            w4_nonresident_alien = 'yes' if ('w4_nonresident_alien' in params) else ''
-            pin = params.get('pin', [''])[0]
-            payment_method = params.get('payment_method', [''])[0]
-            bank_routing = params.get('bank_routing', [''])[0]
-            bank_account = params.get('bank_account', [''])[0]
-            payroll_card_id = params.get('payroll_card_id', [''])[0]
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.save_employee(employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, payment_method, bank_routing, bank_account, payroll_card_id, pin)
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/update_employee":
-            employee_id = params.get('employee_id', [''])[0]
-            name = params.get('name', [''])[0]
-            hourly_rate = params.get('hourly_rate', [''])[0]
-            ssn = params.get('ssn', [''])[0]
-            address = params.get('address', [''])[0]
-            email = params.get('email', [''])[0]
-            visa_status = params.get('visa_status', [''])[0]
-            w4_nonresident_alien = 'yes' if ('w4_nonresident_alien' in params) else ''
-            pin = params.get('pin', [''])[0]
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                if employee_id not in self.employees:
-                    response = "<h2>Error: Employee not found</h2><a href='/'>Back</a>"
-                else:
-                    try:
-                        hourly_rate = float(hourly_rate) if hourly_rate else self.employees[employee_id]['hourly_rate']
-                        save_employee(
-                            employee_id,
-                            name or self.employees[employee_id]['name'],
-                            hourly_rate,
-                            ssn or self.employees[employee_id]['ssn'],
-                            address or self.employees[employee_id]['address'],
-                            email or self.employees[employee_id].get('email',''),
-                            visa_status or self.employees[employee_id].get('visa_status',''),
-                            w4_nonresident_alien or self.employees[employee_id].get('w4_nonresident_alien',''),
-                            self.employees[employee_id].get('payment_method',''),
-                            self.employees[employee_id].get('bank_routing',''),
-                            self.employees[employee_id].get('bank_account',''),
-                            self.employees[employee_id].get('payroll_card_id',''),
-                            pin or self.employees[employee_id].get('pin',''),
-                        )
-                        self.employees = load_employees()
-                        response = "<h2>Employee updated</h2><a href='/'>Back</a>"
-                    except ValueError:
-                        response = "<h2>Error: Invalid hourly rate</h2><a href='/'>Back</a>"
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/update_payment_method":
-            employee_id = params.get('employee_id', [''])[0]
-            payment_method = params.get('payment_method', [''])[0]
-            bank_routing = params.get('bank_routing', [''])[0]
-            bank_account = params.get('bank_account', [''])[0]
-            payroll_card_id = params.get('payroll_card_id', [''])[0]
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                if employee_id not in self.employees:
-                    response = "<h2>Error: Employee not found</h2><a href='/'>Back</a>"
-                else:
-                    emp = self.employees[employee_id]
-                    save_employee(
-                        employee_id,
-                        emp['name'],
-                        emp['hourly_rate'],
-                        emp['ssn'],
-                        emp['address'],
-                        emp.get('email',''),
-                        emp.get('visa_status',''),
-                        emp.get('w4_nonresident_alien',''),
-                        payment_method or emp.get('payment_method',''),
-                        bank_routing or emp.get('bank_routing',''),
-                        bank_account or emp.get('bank_account',''),
-                        payroll_card_id or emp.get('payroll_card_id',''),
-                    )
-                    self.employees = load_employees()
-                    response = "<h2>Payment method updated</h2><a href='/'>Back</a>"
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/delete_employee":
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                if employee_id not in self.employees:
-                    response = "<h2>Error: Employee not found</h2><a href='/'>Back</a>"
-                else:
-                    emp_name = self.employees[employee_id]['name']
-                    # Remove from employees
-                    del self.employees[employee_id]
-                    # Remove from time logs if exists
-                    if employee_id in self.time_logs:
-                        del self.time_logs[employee_id]
-                    # Save changes
-                    self.save_all_employees()
-                    save_time_logs(self.time_logs)
-                    response = f"<h2>Employee {emp_name} has been deleted</h2><a href='/'>Back</a>"
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/run_payroll":
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.run_payroll()
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/set_override":
-            print(f"[DEBUG] Override POST - Received employee_id: {employee_id}")
-            print(f"[DEBUG] Override POST - Received clock_in_time: {clock_in_time}")
-            print(f"[DEBUG] Override POST - Received PIN: {pin}")
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.override_clock_in(employee_id, clock_in_time)
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/set_override_clockout":
-            clock_out_time = params.get('clock_out_time', [''])[0]
-            if hashlib.sha256(pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                response = self.override_clock_out(employee_id, clock_out_time)
-            else:
-                response = "<h2>Invalid PIN</h2><a href='/'>Back</a>"
-        elif self.path == "/edit_time_log":
-            emp_id = params.get('employee_id', [''])[0]
-            session_index = int(params.get('session_index', [-1])[0])
-            new_clock_in = params.get('new_clock_in', [''])[0]
-            new_clock_out = params.get('new_clock_out', [''])[0]
-            admin_pin = params.get('admin_pin', [''])[0]
-            
-            if hashlib.sha256(admin_pin.encode()).hexdigest() == ADMIN_PIN_HASH:
-                if edit_time_log_session(emp_id, session_index, new_clock_in, new_clock_out):
-                    self.time_logs = load_time_logs() # Refresh time logs in handler
-                    response = f"<h2>Time log for {emp_id} (session {session_index}) updated successfully.</h2><a href=\"/admin?pin={admin_pin}\">Back to Admin</a>"
-                else:
-                    response = "<h2>Error: Failed to update time log. Invalid employee ID or session index.</h2><a href='/'>Back</a>"
-            else:
-                response = "<h2>Invalid Admin PIN</h2><a href='/'>Back</a>"
-        else:
-            if employee_id not in self.employees:
-                response = "<h2>Error: Invalid Employee ID</h2><a href='/'>Back</a>"
-            elif self.employees[employee_id].get('pin') != pin:
-                response = "<h2>Error: Invalid PIN</h2><a href='/'>Back</a>"
-            elif not latitude or not longitude:
-                response = "<h2>Error: Location not provided</h2><a href='/'>Back</a>"
-            else:
-                try:
-                    lat = float(latitude)
-                    lon = float(longitude)
-                    distance = haversine_distance(lat, lon, SHOP_LAT, SHOP_LON)
-                    if distance > ALLOWED_RADIUS_METERS:
-                        response = f"<h2>Error: You are {distance:.0f}m away from Freezy Frenzy. Must be within {ALLOWED_RADIUS_METERS}m.</h2><a href='/'>Back</a>"
-                    elif action == "Clock In":
-                        if employee_id in self.time_logs and self.time_logs[employee_id].get('clock_in'):
-                            response = "<h2>Error: Already clocked in</h2><a href='/'>Back</a>"
-                        else:
-                            clock_in_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            self.time_logs[employee_id] = {
-                                'name': self.employees[employee_id]['name'],
-                                'clock_in': clock_in_time,
-                                'sessions': self.time_logs.get(employee_id, {}).get('sessions', []),
-                                'last_location': {'lat': lat, 'lon': lon}
-                            }
-                            save_time_logs(self.time_logs)
-                            response = f"<h2>Clocked in at {clock_in_time}</h2><p>Employee: {self.employees[employee_id]['name']}</p><a href='/'>Back</a>"
-                    elif action == "Clock Out":
-                        if employee_id not in self.time_logs or not self.time_logs[employee_id].get('clock_in'):
-                            response = "<h2>Error: Not clocked in</h2><a href='/'>Back</a>"
-                        else:
-                            clock_out_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            hours = calculate_hours(self.time_logs[employee_id]['clock_in'], clock_out_time)
-                            self.time_logs[employee_id]['sessions'].append({
-                                'clock_in': self.time_logs[employee_id]['clock_in'],
-                                'clock_out': clock_out_time,
-                                'hours': hours,
-                                'location': {'lat': lat, 'lon': lon}
-                            })
-                            del self.time_logs[employee_id]['clock_in']
-                            save_time_logs(self.time_logs)
-                            response = f"<h2>Clocked out at {clock_out_time}. Hours: {hours:.2f}</h2><p>Employee: {self.employees[employee_id]['name']}</p><a href='/'>Back</a>"
-                except ValueError:
-                    response = "<h2>Error: Invalid location data</h2><a href='/'>Back</a>"
+    def update_payment_method(self, employee_id, payment_method, bank_routing, bank_account, payroll_card_id, pin):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        if employee_id not in self.employees:
+            return EMPLOYEE_NOT_FOUND
+        emp = self.employees[employee_id]
+        self.repo.save_employee(
+            employee_id,
+            emp['name'],
+            emp['hourly_rate'],
+            emp['ssn'],
+            emp['address'],
+            emp.get('email',''),
+            emp.get('visa_status',''),
+            emp.get('w4_nonresident_alien',''),
+            payment_method or emp.get('payment_method',''),
+            bank_routing or emp.get('bank_routing',''),
+            bank_account or emp.get('bank_account',''),
+            payroll_card_id or emp.get('payroll_card_id',''),
+        )
+        return "<h2>Payment method updated</h2><a href='/'>Back</a>"
+
+    def delete_employee(self, employee_id, pin):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        if employee_id not in self.employees:
+            return EMPLOYEE_NOT_FOUND
+        emp_name = self.employees[employee_id]['name']
+        # Remove the employee and their time logs
+        self.repo.delete_employee(employee_id)
+        return MESSAGE.render(message=f"Employee {emp_name} has been deleted")
+
+    def start_payroll(self, pin):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        if not self.repo.payroll_lock.acquire(blocking=False):
+            return "<h2>Payroll is already running. Try again when it finishes.</h2><a href='/'>Back</a>"
+        try:
+            return self.run_payroll()
+        finally:
+            self.repo.payroll_lock.release()
+
+    def set_override(self, employee_id, clock_in_time, pin):
+        print(f"[DEBUG] Override POST - Received employee_id: {employee_id}")
+        print(f"[DEBUG] Override POST - Received clock_in_time: {clock_in_time}")
+        print(f"[DEBUG] Override POST - Received PIN: {pin}")
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        return self.override_clock_in(employee_id, clock_in_time)
+
+    def set_override_clockout(self, employee_id, clock_out_time, pin):
+        if not is_admin_pin(pin):
+            return INVALID_PIN
+        return self.override_clock_out(employee_id, clock_out_time)
+
+    def edit_time_log(self, employee_id, session_index, new_clock_in, new_clock_out, admin_pin):
+        if not is_admin_pin(admin_pin):
+            return "<h2>Invalid Admin PIN</h2><a href='/'>Back</a>"
+        try:
+            session_index = int(session_index or -1)
+        except ValueError:
+            session_index = -1
+        try:
+            edited = self.repo.edit_session(employee_id, session_index, new_clock_in, new_clock_out)
+        except ValueError:
+            return "<h2>Error: Invalid time format (use YYYY-MM-DD HH:MM:SS)</h2><a href='/'>Back</a>"
+        if edited:
+            return TIME_LOG_UPDATED.render(employee_id=employee_id, session_index=session_index, pin=quote(admin_pin))
+        return "<h2>Error: Failed to update time log. Invalid employee ID or session index.</h2><a href='/'>Back</a>"
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(response.encode())
+    def clock(self, employee_id, pin, action, latitude, longitude):
+        if employee_id not in self.employees:
+            return "<h2>Error: Invalid Employee ID</h2><a href='/'>Back</a>"
+        if self.employees[employee_id].get('pin') != pin:
+            return "<h2>Error: Invalid PIN</h2><a href='/'>Back</a>"
+        if not latitude or not longitude:
+            return "<h2>Error: Location not provided</h2><a href='/'>Back</a>"
+        try:
+            lat = float(latitude)
+            lon = float(longitude)
+        except ValueError:
+            return "<h2>Error: Invalid location data</h2><a href='/'>Back</a>"
+        distance = haversine_distance(lat, lon, SHOP_LAT, SHOP_LON)
+        if distance > ALLOWED_RADIUS_METERS:
+            return MESSAGE.render(message=f"Error: You are {distance:.0f}m away from Freezy Frenzy. Must be within {ALLOWED_RADIUS_METERS}m.")
+        if action == "Clock In":
+            try:
+                clock_in_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.repo.clock_in(employee_id, clock_in_time, location={'lat': lat, 'lon': lon})
+                return EMPLOYEE_MESSAGE.render(message=f"Clocked in at {clock_in_time}", name=self.employees[employee_id]['name'])
+            except AlreadyClockedIn:
+                return "<h2>Error: Already clocked in</h2><a href='/'>Back</a>"
+        if action == "Clock Out":
+            try:
+                clock_out_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                session = self.repo.clock_out(employee_id, clock_out_time, location={'lat': lat, 'lon': lon})
+                hours = session['hours']
+                return EMPLOYEE_MESSAGE.render(message=f"Clocked out at {clock_out_time}. Hours: {hours:.2f}", name=self.employees[employee_id]['name'])
+            except NotClockedIn:
+                return "<h2>Error: Not clocked in</h2><a href='/'>Back</a>"
+            except ValueError:
+                # The stored clock-in time is unreadable; a manager has to fix it
+                logging.exception(f"[clock] Could not clock out employee_id: {employee_id}")
+                return "<h2>Error: Could not clock out; ask a manager to correct your clock-in time</h2><a href='/'>Back</a>"
+        return ""
 
     def admin_form(self):
-        return """
-        <html>
-        <head>
-            <title>Admin Panel</title>
-            <meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\">
-            <link rel=\"stylesheet\" href=\"/style.css\">
-            <style>
-                .tab { display: none; }
-                .tab.active { display: block; }
-                .tab-buttons button { margin-right: 10px; }
-            </style>
-                            <script>
-                    function showTab(tabId) {
-                        console.log('Switching to tab:', tabId);
-                        var tabs = document.getElementsByClassName('tab');
-                        for (var i = 0; i < tabs.length; i++) {
-                            tabs[i].classList.remove('active');
-                        }
-                        var targetTab = document.getElementById(tabId);
-                        if (targetTab) {
-                            targetTab.classList.add('active');
-                            console.log('Tab', tabId, 'is now active');
-                        } else {
-                            console.error('Could not find tab:', tabId);
-                        }
-                        
-                        // Load employees when view-employees tab is shown
-                        if (tabId === 'view-employees') {
-                            console.log('Loading employees for view-employees tab');
-                            setTimeout(loadEmployees, 100); // Small delay to ensure DOM is ready
-                        }
-                        
-                        // Load time logs when view-time-logs tab is shown
-                        if (tabId === 'view-time-logs') {
-                            console.log('Loading time logs for view-time-logs tab');
-                            setTimeout(loadTimeLogs, 100); // Small delay to ensure DOM is ready
-                        }
-                    }
-                    
-                    function loadEmployees() {
-                        console.log('Loading employees...');
-                        fetch('/get_employees')
-                            .then(response => {
-                                console.log('Response status:', response.status);
-                                return response.json();
-                            })
-                            .then(data => {
-                                console.log('Employees data:', data);
-                                const tbody = document.getElementById('employees-tbody');
-                                if (!tbody) {
-                                    console.error('Could not find employees-tbody element');
-                                    return;
-                                }
-                                tbody.innerHTML = '';
-                                
-                                if (data.length === 0) {
-                                    tbody.innerHTML = '<tr><td colspan=\"5\" style=\"text-align: center; padding: 20px;\">No employees found</td></tr>';
-                                    return;
-                                }
-                                
-                                data.forEach(emp => {
-                                    const row = document.createElement('tr');
-                                    row.style.cursor = 'pointer';
-                                    row.onclick = function() { editEmployee(emp); };
-                                    row.innerHTML = `
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${emp.employee_id}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${emp.name}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\" class=\"hide-mobile\">$${emp.hourly_rate}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\" class=\"hide-mobile\">${emp.ssn}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">
-                                            <button onclick=\"editEmployee(${JSON.stringify(emp).replace(/"/g, '&quot;')})\" style=\"padding: 5px 10px; background-color: #2196F3; color: white; border: none; border-radius: 3px; cursor: pointer; margin-right: 5px;\">Edit</button>
-                                            <button onclick=\"deleteEmployee('${emp.employee_id}', '${emp.name}')\" style=\"padding: 5px 10px; background-color: #f44336; color: white; border: none; border-radius: 3px; cursor: pointer;\">Delete</button>
-                                        </td>
-                                    `;
-                                    tbody.appendChild(row);
-                                });
-                                console.log('Employees table populated with', data.length, 'rows');
-                            })
-                            .catch(error => {
-                                console.error('Error loading employees:', error);
-                                const tbody = document.getElementById('employees-tbody');
-                                if (tbody) {
-                                    tbody.innerHTML = '<tr><td colspan=\"5\" style=\"text-align: center; padding: 20px; color: red;\">Error loading employees: ' + error.message + '</td></tr>';
-                                }
-                            });
-                    }
-                    
-                    function editEmployee(emp) {
-                        // Populate edit form fields
-                        document.getElementById('edit_emp_id').value = emp.employee_id;
-                        document.getElementById('edit_name').value = emp.name;
-                        document.getElementById('edit_rate').value = emp.hourly_rate;
-                        document.getElementById('edit_ssn').value = emp.ssn;
-                        document.getElementById('edit_address').value = emp.address || '';
-                        document.getElementById('edit_email').value = emp.email || '';
-                        document.getElementById('edit_visa').value = emp.visa_status || '';
-                        document.getElementById('edit_nra').checked = emp.w4_nonresident_alien === 'yes' || emp.w4_nonresident_alien === 'true' || emp.w4_nonresident_alien === '1';
-                        document.getElementById('edit_pin').value = emp.pin || '';
-                        
-                        // Switch to edit tab
-                        showTab('edit-employee');
-                    }
-                    
-                    function deleteEmployee(empId, empName) {
-                        const adminPin = document.getElementById('admin_pin_for_actions').value;
-                        if (!adminPin) {
-                            alert('Please enter the Admin PIN first');
-                            return;
-                        }
-                        if (confirm('Are you sure you want to delete employee ' + empName + ' (ID: ' + empId + ')?')) {
-                            fetch('/delete_employee', {
-                                method: 'POST',
-                                headers: {
-                                    'Content-Type': 'application/x-www-form-urlencoded',
-                                },
-                                body: 'employee_id=' + encodeURIComponent(empId) + '&pin=' + encodeURIComponent(adminPin)
-                            })
-                            .then(response => response.text())
-                            .then(data => {
-                                alert('Employee deleted successfully');
-                                loadEmployees();
-                            })
-                            .catch(error => {
-                                console.error('Error deleting employee:', error);
-                                alert('Error deleting employee');
-                            });
-                        }
-                    }
-                    
-                    function refreshEmployees() {
-                        loadEmployees();
-                    }
-                    
-                    function loadTimeLogs() {
-                        console.log('Loading time logs...');
-                        fetch('/get_time_logs')
-                            .then(response => {
-                                console.log('Time logs response status:', response.status);
-                                return response.json();
-                            })
-                            .then(data => {
-                                console.log('Time logs data:', data);
-                                const tbody = document.getElementById('time-logs-tbody');
-                                if (!tbody) {
-                                    console.error('Could not find time-logs-tbody element');
-                                    return;
-                                }
-                                tbody.innerHTML = '';
-                                
-                                if (data.length === 0) {
-                                    tbody.innerHTML = '<tr><td colspan=\"6\" style=\"text-align: center; padding: 20px;\">No time logs found</td></tr>';
-                                    return;
-                                }
-                                
-                                data.forEach(log => {
-                                    const row = document.createElement('tr');
-                                    row.innerHTML = `
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.employee_id}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.name}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.type}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.time}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.hours}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">${log.location}</td>
-                                        <td style=\"border: 1px solid #ddd; padding: 8px;\">
-                                            <button onclick=\"editTimeLog(${JSON.stringify(log).replace(/"/g, '&quot;')})\" style=\"padding: 5px 10px; background-color: #2196F3; color: white; border: none; border-radius: 3px; cursor: pointer;\">Edit</button>
-                                        </td>
-                                    `;
-                                    tbody.appendChild(row);
-                                });
-                                console.log('Time logs table populated with', data.length, 'rows');
-                            })
-                            .catch(error => {
-                                console.error('Error loading time logs:', error);
-                                const tbody = document.getElementById('time-logs-tbody');
-                                if (tbody) {
-                                    tbody.innerHTML = '<tr><td colspan=\"6\" style=\"text-align: center; padding: 20px; color: red;\">Error loading time logs: ' + error.message + '</td></tr>';
-                                }
-                            });
-                    }
-                    
-                    function editTimeLog(logEntry) {
-                        // This function will be implemented to open a modal or new form for editing.
-                        // For now, let's just log the entry.
-                        console.log('Editing time log:', logEntry);
-                        
-                        const adminPin = document.getElementById('admin_pin_for_actions_time_logs').value;
-                        if (!adminPin) {
-                            alert('Please enter the Admin PIN first to edit time logs.');
-                            return;
-                        }
-
-                        const newClockIn = prompt("Enter new Clock-In Time (YYYY-MM-DD HH:MM:SS)", logEntry.time);
-                        if (!newClockIn) return;
-
-                        const newClockOut = prompt("Enter new Clock-Out Time (YYYY-MM-DD HH:MM:SS)", logEntry.hours === 'Active' ? "" : logEntry.time);
-                        if (!newClockOut) return;
-
-                        fetch('/edit_time_log', {
-                            method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/x-www-form-urlencoded',
-                            },
-                            body: 'employee_id=' + encodeURIComponent(logEntry.employee_id) +
-                                  '&session_index=' + encodeURIComponent(logEntry.session_index) + 
-                                  '&new_clock_in=' + encodeURIComponent(newClockIn) +
-                                  '&new_clock_out=' + encodeURIComponent(newClockOut) +
-                                  '&admin_pin=' + encodeURIComponent(adminPin)
-                        })
-                        .then(response => response.text())
-                        .then(data => {
-                            alert(data);
-                            loadTimeLogs();
-                        })
-                        .catch(error => {
-                            console.error('Error editing time log:', error);
-                            alert('Error editing time log.');
-                        });
-                    }
-                    
-                    function refreshTimeLogs() {
-                        loadTimeLogs();
-                    }
-                    
-                    window.onload = function() {
-                        showTab('add-employee');
-                    }
-                </script>
-        </head>
-        <body>
-            <h2>Admin Panel</h2>
-            <div class=\"tab-buttons\">
-                <button onclick=\"showTab('add-employee')\">Add Employee</button>
-                <button onclick=\"showTab('edit-employee')\">Edit Employee</button>
-                <button onclick=\"showTab('view-employees')\">View Employees</button>
-                <button onclick=\"showTab('view-time-logs')\">View Time Logs</button>
-                <button onclick=\"showTab('payment-method')\">Payment Method</button>
-                <button onclick=\"showTab('run-payroll')\">Run Payroll</button>
-                <button onclick=\"showTab('manager-override')\">Manager Override</button>
-                <button onclick=\"showTab('view-report')\">View Report</button>
-            </div>
-            <div id=\"add-employee\" class=\"tab\">
-                <h3>Add Employee</h3>
-                <form method=\"POST\" action=\"/save_employee\">
-                    Employee ID: <input type=\"text\" name=\"employee_id\"><br><br>
-                    Name: <input type=\"text\" name=\"name\"><br><br>
-                    Hourly Rate ($): <input type=\"text\" name=\"hourly_rate\"><br><br>
-                    SSN: <input type=\"text\" name=\"ssn\"><br><br>
-                    Address: <input type=\"text\" name=\"address\"><br><br>
-                    Email: <input type=\"email\" name=\"email\"><br><br>
-                    Visa Status: <input type=\"text\" name=\"visa_status\"><br><br>
-                    Nonresident Alien (W-4): <input type=\"checkbox\" name=\"w4_nonresident_alien\"><br><br>
-                    PIN: <input type=\"password\" name=\"pin\"><br><br>
-                    <input type=\"submit\" value=\"Save Employee\">
-                </form>
-            </div>
-            <div id=\"edit-employee\" class=\"tab\">
-                <h3>Edit Employee</h3>
-                <form method=\"POST\" action=\"/update_employee\">
-                    Employee ID: <input type=\"text\" name=\"employee_id\" id=\"edit_emp_id\"><br><br>
-                    Name: <input type=\"text\" name=\"name\" id=\"edit_name\"><br><br>
-                    Hourly Rate ($): <input type=\"text\" name=\"hourly_rate\" id=\"edit_rate\"><br><br>
-                    SSN: <input type=\"text\" name=\"ssn\" id=\"edit_ssn\"><br><br>
-                    Address: <input type=\"text\" name=\"address\" id=\"edit_address\"><br><br>
-                    Email: <input type=\"email\" name=\"email\" id=\"edit_email\"><br><br>
-                    Visa Status: <input type=\"text\" name=\"visa_status\" id=\"edit_visa\"><br><br>
-                    Nonresident Alien (W-4): <input type=\"checkbox\" name=\"w4_nonresident_alien\" id=\"edit_nra\"><br><br>
-                    PIN: <input type=\"password\" name=\"pin\" id=\"edit_pin\"><br><br>
-                    <input type=\"submit\" value=\"Update Employee\">
-                </form>
-            </div>
-            <div id=\"view-employees\" class=\"tab\">
-                <h3>View All Employees</h3>
-                <div style=\"margin-bottom: 20px; padding: 15px; background-color: #f8f9fa; border-radius: 8px; border: 1px solid #dee2e6;\">
-                    <strong>Admin PIN Required for Actions:</strong><br>
-                    <input type=\"password\" id=\"admin_pin_for_actions\" placeholder=\"Enter Admin PIN\" style=\"width: 200px; margin-top: 10px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;\">
-                </div>
-                <div id=\"employees-table\" class=\"table-container\">
-                    <table style=\"width: 100%; border-collapse: collapse; margin-top: 20px;\">
-                        <thead>
-                            <tr style=\"background-color: #f2f2f2;\">
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">ID</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Name</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\" class=\"hide-mobile\">Rate</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\" class=\"hide-mobile\">SSN</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Actions</th>
-                            </tr>
-                        </thead>
-                        <tbody id=\"employees-tbody\">
-                            <!-- Employee rows will be populated here -->
-                        </tbody>
-                    </table>
-                </div>
-                <button onclick=\"refreshEmployees()\" style=\"margin-top: 20px; padding: 10px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer;\">Refresh Table</button>
-            </div>
-            <div id=\"view-time-logs\" class=\"tab\">
-                <h3>View All Time Logs</h3>
-                <div style=\"margin-bottom: 20px; padding: 15px; background-color: #f8f9fa; border-radius: 8px; border: 1px solid #dee2e6;\">
-                    <strong>Admin PIN Required for Actions:</strong><br>
-                    <input type=\"password\" id=\"admin_pin_for_actions_time_logs\" placeholder=\"Enter Admin PIN\" style=\"width: 200px; margin-top: 10px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;\">
-                </div>
-                <div id=\"time-logs-table\" class=\"table-container\">
-                    <table style=\"width: 100%; border-collapse: collapse; margin-top: 20px;\">
-                        <thead>
-                            <tr style=\"background-color: #f2f2f2;\">
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Employee ID</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Name</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Type</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Time</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Hours</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Location</th>
-                                <th style=\"border: 1px solid #ddd; padding: 8px; text-align: left;\">Actions</th>
-                            </tr>
-                        </thead>
-                        <tbody id=\"time-logs-tbody\">
-                            <!-- Time log rows will be populated here -->
-                        </tbody>
-                    </table>
-                </div>
-                <button onclick=\"refreshTimeLogs()\" style=\"margin-top: 20px; padding: 10px; background-color: #4CAF50; color: white; border: none; border-radius: 4px; cursor: pointer;\">Refresh Table</button>
-            </div>
-            <div id=\"payment-method\" class=\"tab\">
-                <h3>Payment Method</h3>
-                <form method=\"POST\" action=\"/update_payment_method\">
-                    Employee ID: <input type=\"text\" name=\"employee_id\"><br><br>
-                    Payment Method: 
-                    <select name=\"payment_method\">
-                        <option value=\"direct_deposit\">Direct Deposit</option>
-                        <option value=\"payroll_card\">Payroll Card</option>
-                    </select><br><br>
-                    Bank Routing #: <input type=\"text\" name=\"bank_routing\"><br><br>
-                    Bank Account #: <input type=\"text\" name=\"bank_account\"><br><br>
-                    Payroll Card ID: <input type=\"text\" name=\"payroll_card_id\"><br><br>
-                    PIN: <input type=\"password\" name=\"pin\"><br><br>
-                    <input type=\"submit\" value=\"Update Payment Method\">
-                </form>
-            </div>
-            <div id=\"run-payroll\" class=\"tab\">
-                <h3>Run Payroll</h3>
-                <form method=\"POST\" action=\"/run_payroll\">
-                    PIN: <input type=\"password\" name=\"pin\"><br><br>
-                    <input type=\"submit\" value=\"Run Payroll\">
-                </form>
-            </div>
-            <div id=\"manager-override\" class=\"tab\">
-                <h3>Manager Override</h3>
-                <form method=\"POST\" action=\"/set_override\">
-                    Employee ID: <input type=\"text\" name=\"employee_id\"><br><br>
-                    Clock-In Time (YYYY-MM-DD HH:MM:SS): <input type=\"text\" name=\"clock_in_time\" id=\"clock_in_time\"><br><br>
-                    PIN: <input type=\"password\" name=\"pin\"><br><br>
-                    <input type=\"submit\" value=\"Set Clock-In\">
-                </form>
-                <form method=\"POST\" action=\"/set_override_clockout\">
-                    Employee ID: <input type=\"text\" name=\"employee_id\"><br><br>
-                    Clock-Out Time (YYYY-MM-DD HH:MM:SS): <input type=\"text\" name=\"clock_out_time\" id=\"clock_out_time\"><br><br>
-                    PIN: <input type=\"password\" name=\"pin\"><br><br>
-                    <input type=\"submit\" value=\"Set Clock-Out\">
-                </form>
-                <script>
-                    function getCurrentDateTime() {
-                        const now = new Date();
-                        const year = now.getFullYear();
-                        const month = String(now.getMonth() + 1).padStart(2, '0');
-                        const day = String(now.getDate()).padStart(2, '0');
-                        const hours = String(now.getHours()).padStart(2, '0');
-                        const minutes = String(now.getMinutes()).padStart(2, '0');
-                        const seconds = String(now.getSeconds()).padStart(2, '0');
-                        return `${year}-${month}-${day} ${hours}:${minutes}:${seconds}`;
-                    }
-                    document.addEventListener('DOMContentLoaded', function() {
-                        document.getElementById('clock_in_time').value = getCurrentDateTime();
-                        document.getElementById('clock_out_time').value = getCurrentDateTime();
-                    });
-                </script>
-            </div>
-            <div id=\"view-report\" class=\"tab\">
-                <h3>View Payroll Report</h3>
-                <a href='/report' target='_blank'>Open Payroll Report</a>
-            </div>
-            <br>
-            <a href='/'>Back</a>
-        </body>
-        </html>
-        """
+        return ADMIN_PAGE.current()
 
     def save_employee(self, employee_id, name, hourly_rate, ssn, address, email="", visa_status="", w4_nonresident_alien="", payment_method="", bank_routing="", bank_account="", payroll_card_id="", pin=""):
         try:
@@ -902,8 +628,7 @@ class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
                 return "<h2>Error: All fields required</h2><a href='/'>Back</a>"
             if employee_id in self.employees:
                 return "<h2>Error: Employee ID exists</h2><a href='/'>Back</a>"
-            save_employee(employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, payment_method, bank_routing, bank_account, payroll_card_id, pin)
-            self.employees = load_employees()
+            self.repo.save_employee(employee_id, name, hourly_rate, ssn, address, email, visa_status, w4_nonresident_alien, payment_method, bank_routing, bank_account, payroll_card_id, pin)
             return "<h2>Employee added</h2><a href='/'>Back</a>"
         except ValueError:
             return "<h2>Error: Invalid hourly rate</h2><a href='/'>Back</a>"
@@ -911,324 +636,114 @@ class TimeClockHandler(http.server.SimpleHTTPRequestHandler):
     def override_clock_in(self, employee_id, clock_in_time):
         if not employee_id or employee_id not in self.employees:
             return "<h2>Error: Invalid Employee ID</h2><a href='/'>Back</a>"
-        if employee_id in self.time_logs and self.time_logs[employee_id].get('clock_in'):
-            return "<h2>Error: Employee already clocked in</h2><a href='/'>Back</a>"
         try:
-            datetime.datetime.strptime(clock_in_time, "%Y-%m-%d %H:%M:%S")
-            self.time_logs[employee_id] = {
-                'name': self.employees[employee_id]['name'],
-                'clock_in': clock_in_time,
-                'sessions': self.time_logs.get(employee_id, {}).get('sessions', []),
-                'manager_override': True
-            }
-            save_time_logs(self.time_logs)
-            return f"<h2>Clock-in time set to {clock_in_time} for {self.employees[employee_id]['name']}</h2><a href='/'>Back</a>"
+            clock_in_time = normalize_timestamp(clock_in_time)
+            self.repo.clock_in(employee_id, clock_in_time, manager_override=True)
+            return MESSAGE.render(message=f"Clock-in time set to {clock_in_time} for {self.employees[employee_id]['name']}")
+        except AlreadyClockedIn:
+            return "<h2>Error: Employee already clocked in</h2><a href='/'>Back</a>"
         except ValueError:
             return "<h2>Error: Invalid time format (use YYYY-MM-DD HH:MM:SS)</h2><a href='/'>Back</a>"
 
     def override_clock_out(self, employee_id, clock_out_time):
         if not employee_id or employee_id not in self.employees:
             return "<h2>Error: Invalid Employee ID</h2><a href='/'>Back</a>"
-        if employee_id not in self.time_logs or not self.time_logs[employee_id].get('clock_in'):
-            return "<h2>Error: Not clocked in</h2><a href='/'>Back</a>"
         try:
-            datetime.datetime.strptime(clock_out_time, "%Y-%m-%d %H:%M:%S")
-            clock_in_time = self.time_logs[employee_id]['clock_in']
-            hours = calculate_hours(clock_in_time, clock_out_time)
-            self.time_logs[employee_id]['sessions'].append({
-                'clock_in': clock_in_time,
-                'clock_out': clock_out_time,
-                'hours': hours,
-                'manager_override': True
-            })
-            del self.time_logs[employee_id]['clock_in']
-            save_time_logs(self.time_logs)
-            return f"<h2>Clock-out time set to {clock_out_time} for {self.employees[employee_id]['name']}. Hours: {hours:.2f}</h2><a href='/'>Back</a>"
+            clock_out_time = normalize_timestamp(clock_out_time)
+            session = self.repo.clock_out(employee_id, clock_out_time, manager_override=True)
+            hours = session['hours']
+            return MESSAGE.render(message=f"Clock-out time set to {clock_out_time} for {self.employees[employee_id]['name']}. Hours: {hours:.2f}")
+        except NotClockedIn:
+            return "<h2>Error: Not clocked in</h2><a href='/'>Back</a>"
         except ValueError:
             return "<h2>Error: Invalid time format (use YYYY-MM-DD HH:MM:SS)</h2><a href='/'>Back</a>"
 
     def run_payroll(self):
-        pay_period_start = (datetime.datetime.now() - datetime.timedelta(days=14)).strftime("%Y-%m-%d")
-        report = ["Payroll Report", f"Pay Period: {pay_period_start} to {datetime.datetime.now().strftime('%Y-%m-%d')}\n"]
-        payments = [["employee_id","name","method","routing","account","amount","date"]]
-        tax_deposits = [["date","federal_withholding_total"]]
-        total_federal = 0.0
-
-        os.makedirs("paystubs", exist_ok=True)
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        run = run_payroll(self.repo)
+        if run.paystub_failures:
+            return MESSAGE.render(message=f"Payroll complete, but paystubs could not be generated for employee(s) {', '.join(run.paystub_failures)}; see app.log.")
+        return "<h2>Payroll complete. Generated payroll_report.csv, payments.csv, tax_deposit.csv, w2_summary.csv and paystubs/ (emails sent if configured).</h2><a href='/'>Back</a>"
 
-        for emp_id, data in self.time_logs.items():
-            if 'sessions' not in data:
-                continue
-            total_hours = sum(session['hours'] for session in data['sessions'] if session['clock_out'] >= pay_period_start)
-            if total_hours == 0:
-                continue
-            is_nra = str(self.employees[emp_id].get('w4_nonresident_alien', '')).lower() in ['yes', 'true', '1']
-            hourly_rate = self.employees[emp_id]['hourly_rate']
-            gross, federal_tax, state_tax, net_pay = calculate_pay_with_profile(total_hours, hourly_rate, is_nra)
-
-            report.append(f"Employee: {data['name']} (ID: {emp_id})")
-            report.append(f"Total Hours: {total_hours:.2f}")
-            report.append(f"Gross Pay: ${gross:.2f}")
-            report.append(f"Federal Tax: ${federal_tax:.2f}")
-            report.append(f"Net Pay: ${net_pay:.2f}\n")
-
-            total_federal += federal_tax
-
-            method = self.employees[emp_id].get('payment_method','') or 'payroll_card'
-            routing = self.employees[emp_id].get('bank_routing','')
-            account = self.employees[emp_id].get('bank_account','')
-            payroll_card_id = self.employees[emp_id].get('payroll_card_id','')
-            routing_mask = (routing[-4:]).rjust(len(routing), '•') if routing else ''
-            account_mask = (account[-4:]).rjust(len(account), '•') if account else payroll_card_id
-            payments.append([emp_id, data['name'], method, routing_mask, account_mask, f"{net_pay:.2f}", today])
-
-            # Generate paystub HTML
-            email_addr = self.employees[emp_id].get('email','')
-            stub_path = os.path.join('paystubs', f"{emp_id}_{today}.html")
-            with open(stub_path, 'w', encoding='utf-8') as sf:
-                sf.write(f"""
-                <html><body>
-                <h3>Paystub - {today}</h3>
-                <p>Employee: {data['name']} (ID: {emp_id})</p>
-                <p>Total Hours: {total_hours:.2f}</p>
-                <p>Hourly Rate: ${hourly_rate:.2f}</p>
-                <p>Gross Pay: ${gross:.2f}</p>
-                <p>Federal Tax: ${federal_tax:.2f}</p>
-                <p>State Tax: ${state_tax:.2f}</p>
-                <p>Net Pay: ${net_pay:.2f}</p>
-                <p>Payment Method: {method}</p>
-                </body></html>
-                """)
-
-            # Generate paystub PDF (styled)
-            pdf_path = os.path.join('paystubs', f"{emp_id}_{today}.pdf")
-            c = canvas.Canvas(pdf_path, pagesize=LETTER)
-            width, height = LETTER
-            margin = 54
-
-            # Outer border removed for cleaner spacing
-
-            # Header banner
-            header_h = 70
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.roundRect(margin, height - margin - header_h, width - 2*margin, header_h, 12, stroke=0, fill=1)
-            c.setFillColor(colors.white)
-            company_name = "Freezy Frenzy"
-            company_address = "17458 Northwest Fwy, Jersey Village, TX 77040"
-            c.setFont("Helvetica-Bold", 20)
-            c.drawString(margin + 16, height - margin - 40, f"{company_name}")
-            c.setFont("Helvetica", 10)
-            c.drawString(margin + 16, height - margin - 56, company_address)
-            c.setFont("Helvetica", 12)
-            c.drawRightString(width - margin - 16, height - margin - 46, f"Paystub • {today}")
-
-            content_top = height - margin - header_h - 12
-
-            # Employee and Period boxes
-            col_gap = 12
-            col_w = (width - 2*margin - col_gap) / 2
-            box_h = 100
-            # Employee box
-            c.setStrokeColor(colors.HexColor("#8792B0"))
-            c.roundRect(margin, content_top - box_h, col_w, box_h, 8, stroke=1, fill=0)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + 10, content_top - 18, "Employee")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-            c.drawString(margin + 10, content_top - 36, f"Name: {data['name']}")
-            c.drawString(margin + 10, content_top - 52, f"Employee ID: {emp_id}")
-            addr = self.employees[emp_id].get('address', '') or ''
-            parts = [p.strip() for p in addr.replace('\n', ', ').split(',') if p.strip()]
-            if len(parts) >= 3:
-                addr_line1 = ', '.join(parts[:-2])
-                addr_line2 = ', '.join(parts[-2:])
-            elif len(parts) == 2:
-                addr_line1 = parts[0]
-                addr_line2 = parts[1]
+EMPLOYEE_FIELDS = ("employee_id", "name", "hourly_rate", "ssn", "address", "email", "visa_status", "w4_nonresident_alien", "pin")
+PAYMENT_FIELDS = ("payment_method", "bank_routing", "bank_account", "payroll_card_id")
+
+def static_route(path, filename, content_type):
+    """Route serving a file through the static asset cache."""
+    asset = StaticAsset(filename, content_type)
+    return Route(path, lambda request: request.send_static(asset), content_type=content_type)
+
+def compile_routes(routes):
+    """(method, path) -> Route, for dispatch to look up in one step."""
+    return {(method, route.path): route for route in routes for method in route.methods}
+
+# A request whose path is here but whose method isn't listed gets a 405; any
+# other path a 404.
+ROUTES = compile_routes([
+    static_route("/", os.path.join(TEMPLATES_DIR, "index.html"), "text/html"),
+    Route("/", TimeClockHandler.clock, methods=("POST",), params=("employee_id", "pin", "action", "latitude", "longitude")),
+    static_route("/style.css", "style.css", "text/css"),
+    Route("/status", TimeClockHandler.show_status, params=("employee_id", "pin")),
+    Route("/get_employees", TimeClockHandler.get_employees_json, content_type="application/json", hooks=(conditional(employees_generation),)),
+    Route("/get_time_logs", TimeClockHandler.get_time_logs_json, params=("employee_id", "start", "end", "type", "limit", "cursor", "since"), content_type="application/json", hooks=(timed, conditional(time_logs_generation))),
+    Route("/report", TimeClockHandler.view_report, hooks=(timed,)),
+    Route("/events", TimeClockHandler.event_stream),
+    Route("/override", TimeClockHandler.override, params=("pin",)),
+    Route("/admin", TimeClockHandler.admin, methods=("GET", "POST"), params=("pin",)),
+    Route("/save_employee", TimeClockHandler.add_employee, methods=("POST",), params=EMPLOYEE_FIELDS + PAYMENT_FIELDS),
+    Route("/update_employee", TimeClockHandler.update_employee, methods=("POST",), params=EMPLOYEE_FIELDS),
+    Route("/update_payment_method", TimeClockHandler.update_payment_method, methods=("POST",), params=("employee_id",) + PAYMENT_FIELDS + ("pin",)),
+    Route("/delete_employee", TimeClockHandler.delete_employee, methods=("POST",), params=("employee_id", "pin")),
+    Route("/run_payroll", TimeClockHandler.start_payroll, methods=("POST",), params=("pin",), hooks=(timed,)),
+    Route("/set_override", TimeClockHandler.set_override, methods=("POST",), params=("employee_id", "clock_in_time", "pin")),
+    Route("/set_override_clockout", TimeClockHandler.set_override_clockout, methods=("POST",), params=("employee_id", "clock_out_time", "pin")),
+    Route("/edit_time_log", TimeClockHandler.edit_time_log, methods=("POST",), params=("employee_id", "session_index", "new_clock_in", "new_clock_out", "admin_pin")),
+])
+ROUTE_PATHS = {path for _, path in ROUTES}
+
+class PooledHTTPServer(socketserver.TCPServer):
+    """TCPServer that hands each connection to a bounded pool of worker threads.
+
+    A slow client or a long payroll run ties up one worker instead of the
+    whole server. When every worker is busy the accept loop waits, so extra
+    connections queue in the listen backlog rather than spawning threads.
+    Time log consistency comes from the repository lock, not from here.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=HTTP_WORKERS, bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self.slots = threading.BoundedSemaphore(workers)
+        self.detached = set()
+
+    def detach(self, request):
+        """Leave a connection open after its handler returns; whoever it was handed to closes it."""
+        self.detached.add(request)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        self.pool.submit(self.process_request_in_worker, request, client_address)
+
+    def process_request_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if request in self.detached:
+                self.detached.discard(request)
             else:
-                # Fallback simple wrap if no commas present
-                words = addr.split()
-                split_index = max(1, min(len(words), len(words) // 2))
-                addr_line1 = ' '.join(words[:split_index])
-                addr_line2 = ' '.join(words[split_index:])
-            c.drawString(margin + 10, content_top - 68, "Address:")
-            c.drawString(margin + 70, content_top - 68, addr_line1)
-            if addr_line2:
-                c.drawString(margin + 70, content_top - 84, addr_line2)
-            # Method shown in net section or can be appended here if needed
-
-            # Period box
-            c.roundRect(margin + col_w + col_gap, content_top - box_h, col_w, box_h, 8, stroke=1, fill=0)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + col_w + col_gap + 10, content_top - 18, "Pay Period")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-            c.drawString(margin + col_w + col_gap + 10, content_top - 36, f"Start: {pay_period_start}")
-            c.drawString(margin + col_w + col_gap + 10, content_top - 52, f"End: {today}")
-
-            # Earnings box
-            earnings_top = content_top - box_h - 16
-            earnings_h = 180
-            c.setStrokeColor(colors.HexColor("#8792B0"))
-            c.roundRect(margin, earnings_top - earnings_h, width - 2*margin, earnings_h, 8, stroke=1, fill=0)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(margin + 10, earnings_top - 18, "Earnings & Deductions")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-
-            # Table rows
-            row_y = earnings_top - 40
-            row_h = 22
-            left_x = margin + 14
-            right_x = width - margin - 14
-            def row(label, value):
-                nonlocal row_y
-                c.drawString(left_x, row_y, label)
-                c.drawRightString(right_x, row_y, value)
-                c.setStrokeColor(colors.HexColor("#E1E5EE"))
-                c.line(margin + 10, row_y - 6, width - margin - 10, row_y - 6)
-                row_y -= row_h
-
-            row("Hours", f"{total_hours:.2f}")
-            row("Hourly Rate", f"${hourly_rate:.2f}")
-            row("Gross Pay", f"${gross:.2f}")
-            row("Federal Tax", f"${federal_tax:.2f}")
-            row("State Tax", f"${state_tax:.2f}")
-
-            # Net pay highlight box
-            net_box_h = 70
-            net_box_y = margin + 30
-            c.setStrokeColor(colors.HexColor("#2E3A59"))
-            c.roundRect(margin, net_box_y, width - 2*margin, net_box_h, 10, stroke=1, fill=0)
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColor(colors.HexColor("#2E3A59"))
-            c.drawString(margin + 16, net_box_y + net_box_h - 24, "Net Pay")
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica-Bold", 18)
-            c.drawRightString(width - margin - 16, net_box_y + net_box_h - 28, f"${net_pay:.2f}")
-
-            # Footer note
-            c.setFont("Helvetica", 8)
-            c.setFillColor(colors.HexColor("#666666"))
-            c.drawCentredString(width / 2, margin + 10, "This is a computer-generated paystub.")
-
-            c.showPage()
-            c.save()
-
-            # Email paystub if SMTP configured and email provided
-            try:
-                logging.info(f"Attempting to send paystub email to {email_addr}")
-                smtp_host = 'smtp.gmail.com'
-                smtp_port = int(os.getenv('SMTP_PORT', '0') or 0)
-                smtp_user = os.getenv('SMTP_USER')
-                smtp_pass = os.getenv('SMTP_PASS')
-                from_email = os.getenv('FROM_EMAIL') or smtp_user
-                smtp_use_ssl = str(os.getenv('SMTP_USE_SSL', 'true')).lower() in ['1','true','yes']
-                smtp_use_starttls = str(os.getenv('SMTP_USE_STARTTLS', 'false')).lower() in ['1','true','yes']
-                if smtp_host and smtp_port and smtp_user and smtp_pass and from_email and email_addr:
-                    logging.info(f"SMTP attempt host={smtp_host} port={smtp_port} ssl={smtp_use_ssl} starttls={smtp_use_starttls} from={from_email} to={email_addr}")
-                    with open(stub_path, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    msg = MIMEMultipart('alternative')
-                    msg['Subject'] = f"Paystub - {today}"
-                    msg['From'] = from_email
-                    msg['To'] = email_addr
-                    part = MIMEText(html_content, 'html')
-                    msg.attach(part)
-                    if smtp_use_ssl:
-                        with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
-                            server.login(smtp_user, smtp_pass)
-                            server.sendmail(from_email, [email_addr], msg.as_string())
-                    else:
-                        with smtplib.SMTP(smtp_host, smtp_port) as server:
-                            if smtp_use_starttls:
-                                server.starttls()
-                            server.login(smtp_user, smtp_pass)
-                            server.sendmail(from_email, [email_addr], msg.as_string())
-                    logging.info(f"SMTP sent paystub to {email_addr}")
-                else:
-                    logging.warning("SMTP not configured or recipient email missing; skipping send")
-            except Exception as e:
-                logging.error(f"Failed to send paystub email to {email_addr}: {e}")
-
-        tax_deposits.append([today, f"{total_federal:.2f}"])
+                self.shutdown_request(request)
+            self.slots.release()
 
-        with open("payroll_report.csv", 'w', newline='') as f:
-            writer = csv.writer(f)
-            for line in report:
-                writer.writerow([line])
-
-        with open("payments.csv", 'w', newline='') as pf:
-            writer = csv.writer(pf)
-            writer.writerows(payments)
-
-        with open("tax_deposit.csv", 'w', newline='') as tf:
-            writer = csv.writer(tf)
-            writer.writerows(tax_deposits)
-
-        with open("w2_summary.csv", 'w', newline='') as wf:
-            w = csv.writer(wf)
-            w.writerow(["employee_id","name","ssn","wages","federal_income_tax_withheld","year"])
-            year = datetime.datetime.now().strftime('%Y')
-            for emp_id, data in self.time_logs.items():
-                if 'sessions' not in data:
-                    continue
-                hours_ytd = 0
-                for s in data['sessions']:
-                    if s.get('clock_out','').startswith(year):
-                        hours_ytd += s.get('hours', 0)
-                if hours_ytd == 0:
-                    continue
-                is_nra = str(self.employees[emp_id].get('w4_nonresident_alien', '')).lower() in ['yes','true','1']
-                gross, fed, state, net = calculate_pay_with_profile(hours_ytd, self.employees[emp_id]['hourly_rate'], is_nra)
-                w.writerow([emp_id, data['name'], self.employees[emp_id]['ssn'], f"{gross:.2f}", f"{fed:.2f}", year])
-
-        return "<h2>Payroll complete. Generated payroll_report.csv, payments.csv, tax_deposit.csv, w2_summary.csv and paystubs/ (emails sent if configured).</h2><a href='/'>Back</a>"
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
 
-    def save_all_employees(self):
-        """Save all employees to the CSV file"""
-        with open("employees.csv", "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "employee_id",
-                "name",
-                "hourly_rate",
-                "ssn",
-                "address",
-                "email",
-                "visa_status",
-                "w4_nonresident_alien",
-                "payment_method",
-                "bank_routing",
-                "bank_account",
-                "payroll_card_id",
-                "pin",
-            ])
-            for emp_id, data in self.employees.items():
-                writer.writerow([
-                    emp_id,
-                    data.get('name', ''),
-                    data.get('hourly_rate', 0),
-                    data.get('ssn', ''),
-                    data.get('address', ''),
-                    data.get('email', ''),
-                    data.get('visa_status', ''),
-                    data.get('w4_nonresident_alien', ''),
-                    data.get('payment_method', ''),
-                    data.get('bank_routing', ''),
-                    data.get('bank_account', ''),
-                    data.get('payroll_card_id', ''),
-                    data.get('pin', ''),
-                ])
-
-def run_server():
-    PORT = 8000
-    server = socketserver.TCPServer(("0.0.0.0", PORT), TimeClockHandler)
-    logging.info(f"HTTP server running at http://{get_local_ip()}:{PORT}")
+def run_server(port=8000, workers=HTTP_WORKERS):
+    server = PooledHTTPServer(("0.0.0.0", port), TimeClockHandler, workers)
+    logging.info(f"HTTP server running at http://{get_local_ip()}:{port} with {workers} workers")
     server.serve_forever()
 
 def get_local_ip():
@@ -0,0 +1,341 @@
+import json
+import os
+import sqlite3
+import threading
+import logging
+import sys
+from data import EMPLOYEE_FIELDS, DATABASE_FILE, FileBackend, Session
+from payrollutils import parse_timestamp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    employee_id TEXT PRIMARY KEY,
+    name TEXT,
+    hourly_rate REAL,
+    ssn TEXT,
+    address TEXT,
+    email TEXT,
+    visa_status TEXT,
+    w4_nonresident_alien TEXT,
+    payment_method TEXT,
+    bank_routing TEXT,
+    bank_account TEXT,
+    payroll_card_id TEXT,
+    pin TEXT
+);
+-- One row per employee that has ever clocked in (the top level of timelogs.json)
+CREATE TABLE IF NOT EXISTS time_clock (
+    employee_id TEXT PRIMARY KEY,
+    name TEXT,
+    clock_in TEXT,
+    manager_override INTEGER,
+    last_lat REAL,
+    last_lon REAL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    employee_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    clock_in TEXT NOT NULL,
+    clock_out TEXT NOT NULL,
+    hours REAL NOT NULL,
+    manager_override INTEGER,
+    lat REAL,
+    lon REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS sessions_employee_position ON sessions (employee_id, position);
+CREATE INDEX IF NOT EXISTS sessions_employee_clock_out ON sessions (employee_id, clock_out);
+CREATE INDEX IF NOT EXISTS sessions_clock_out ON sessions (clock_out);
+-- Write generation per data set, bumped in the same transaction as the
+-- change so every connection (and process) can cheaply tell if it's stale
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO versions (name, version) VALUES ('employees', 0), ('time_logs', 0);
+-- Recent clock events keyed by the time_logs version they produced, so other
+-- processes sharing the database can replay them instead of reloading
+CREATE TABLE IF NOT EXISTS time_log_events (
+    version INTEGER PRIMARY KEY,
+    event TEXT NOT NULL
+);
+"""
+
+EMPLOYEE_COLUMNS = ", ".join(["employee_id"] + EMPLOYEE_FIELDS)
+EMPLOYEE_UPSERT = (
+    f"INSERT INTO employees ({EMPLOYEE_COLUMNS}) VALUES ({', '.join('?' * (len(EMPLOYEE_FIELDS) + 1))}) "
+    f"ON CONFLICT(employee_id) DO UPDATE SET {', '.join(f'{key} = excluded.{key}' for key in EMPLOYEE_FIELDS)}"
+)
+
+# How many versions of time_log_events to keep; a process further behind reloads in full
+EVENT_HISTORY = 10000
+
+def _flag(value):
+    return None if value is None else int(bool(value))
+
+class SQLiteBackend:
+    """Employees and time logs in a local SQLite database (WAL mode).
+
+    Same contract as data.FileBackend, but single-employee upserts, clock
+    events and session edits touch only the affected rows.
+    """
+
+    # backup_files() makes its own consistent copy
+    BACKUP_NEEDS_LOCK = False
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        # sqlite3 connections can't be shared across threads; the GUI and
+        # the HTTP server each get their own.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _version(self, name):
+        return self.connect().execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()[0]
+
+    def _bump(self, conn, name):
+        conn.execute("UPDATE versions SET version = version + 1 WHERE name = ?", (name,))
+        # Still inside the write transaction, so this is exactly our version
+        return conn.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()[0]
+
+    def _log_event(self, conn, event):
+        version = self._bump(conn, 'time_logs')
+        conn.execute("INSERT INTO time_log_events (version, event) VALUES (?, ?)",
+                     (version, json.dumps(event, separators=(',', ':'))))
+        conn.execute("DELETE FROM time_log_events WHERE version <= ?", (version - EVENT_HISTORY,))
+
+    def time_log_events_since(self, version):
+        """[(version, event)] for clock events after `version`, oldest first."""
+        rows = self.connect().execute(
+            "SELECT version, event FROM time_log_events WHERE version > ? ORDER BY version", (version,))
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def employees_version(self):
+        return self._version('employees')
+
+    def time_logs_version(self):
+        return self._version('time_logs')
+
+    def load_employees(self):
+        employees = {}
+        rows = self.connect().execute(f"SELECT {EMPLOYEE_COLUMNS} FROM employees ORDER BY rowid")
+        for row in rows:
+            record = {key: ('' if value is None else value) for key, value in zip(EMPLOYEE_FIELDS, row[1:])}
+            record['hourly_rate'] = float(record['hourly_rate'] or 0)
+            employees[row[0]] = record
+        return employees
+
+    def _employee_row(self, employee_id, record):
+        return [employee_id] + [record.get(key, 0 if key == 'hourly_rate' else '') for key in EMPLOYEE_FIELDS]
+
+    def save_employee(self, employee_id, record):
+        with self.connect() as conn:
+            conn.execute(EMPLOYEE_UPSERT, self._employee_row(employee_id, record))
+            self._bump(conn, 'employees')
+
+    def upsert_employees(self, employees):
+        with self.connect() as conn:
+            conn.executemany(EMPLOYEE_UPSERT, [self._employee_row(emp_id, record) for emp_id, record in employees.items()])
+            self._bump(conn, 'employees')
+
+    def delete_employee(self, employee_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM employees WHERE employee_id = ?", (employee_id,))
+            self._bump(conn, 'employees')
+
+    def save_employees(self, employees):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM employees")
+            conn.executemany(EMPLOYEE_UPSERT, [self._employee_row(emp_id, record) for emp_id, record in employees.items()])
+            self._bump(conn, 'employees')
+
+    def load_time_logs(self):
+        conn = self.connect()
+        logs = {}
+        for employee_id, name, clock_in, manager_override, last_lat, last_lon in conn.execute(
+            "SELECT employee_id, name, clock_in, manager_override, last_lat, last_lon FROM time_clock ORDER BY rowid"
+        ):
+            entry = {'name': name or ''}
+            if clock_in is not None:
+                entry['clock_in'] = clock_in
+            entry['sessions'] = []
+            if last_lat is not None and last_lon is not None:
+                entry['last_location'] = {'lat': last_lat, 'lon': last_lon}
+            if manager_override is not None:
+                entry['manager_override'] = bool(manager_override)
+            logs[employee_id] = entry
+        for row in conn.execute(
+            "SELECT employee_id, clock_in, clock_out, hours, manager_override, lat, lon "
+            "FROM sessions ORDER BY employee_id, position"
+        ):
+            entry = logs.setdefault(row[0], {'name': '', 'sessions': []})
+            entry['sessions'].append(self._session(row[1:]))
+        return logs
+
+    def _session(self, row):
+        clock_in, clock_out, hours, manager_override, lat, lon = row
+        if lat is None or lon is None:
+            lat = lon = None
+        return Session(
+            parse_timestamp(clock_in),
+            parse_timestamp(clock_out),
+            hours,
+            None if manager_override is None else bool(manager_override),
+            lat,
+            lon,
+        )
+
+    def save_time_logs(self, logs):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM time_clock")
+            for employee_id, entry in logs.items():
+                location = entry.get('last_location') or {}
+                conn.execute(
+                    "INSERT INTO time_clock (employee_id, name, clock_in, manager_override, last_lat, last_lon) VALUES (?, ?, ?, ?, ?, ?)",
+                    (employee_id, entry.get('name', ''), entry.get('clock_in'), _flag(entry.get('manager_override')),
+                     location.get('lat'), location.get('lon')),
+                )
+                for position, session in enumerate(entry.get('sessions', [])):
+                    self._insert_session(conn, employee_id, position, session)
+            self._bump(conn, 'time_logs')
+
+    def _insert_session(self, conn, employee_id, position, session):
+        location = session.get('location') or {}
+        conn.execute(
+            "INSERT INTO sessions (employee_id, position, clock_in, clock_out, hours, manager_override, lat, lon) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (employee_id, position, session['clock_in'], session['clock_out'], session['hours'],
+             _flag(session.get('manager_override')), location.get('lat'), location.get('lon')),
+        )
+
+    def append_time_log_event(self, event):
+        employee_id = event['employee_id']
+        kind = event['type']
+        with self.connect() as conn:
+            if kind == 'clock_in':
+                location = event.get('last_location') or {}
+                conn.execute(
+                    "INSERT INTO time_clock (employee_id, name, clock_in, manager_override, last_lat, last_lon) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(employee_id) DO UPDATE SET "
+                    "name = excluded.name, clock_in = excluded.clock_in, manager_override = excluded.manager_override, "
+                    "last_lat = excluded.last_lat, last_lon = excluded.last_lon",
+                    (employee_id, event.get('name', ''), event['clock_in'], 1 if event.get('manager_override') else None,
+                     location.get('lat'), location.get('lon')),
+                )
+            elif kind == 'clock_out':
+                conn.execute(
+                    "INSERT OR IGNORE INTO time_clock (employee_id, name) VALUES (?, ?)",
+                    (employee_id, event.get('name', '')),
+                )
+                position = conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM sessions WHERE employee_id = ?", (employee_id,)
+                ).fetchone()[0]
+                self._insert_session(conn, employee_id, position, event['session'])
+                conn.execute("UPDATE time_clock SET clock_in = NULL WHERE employee_id = ?", (employee_id,))
+            elif kind == 'edit':
+                self._update_session(conn, employee_id, event['session_index'], event['changes'])
+            elif kind == 'delete':
+                conn.execute("DELETE FROM sessions WHERE employee_id = ?", (employee_id,))
+                conn.execute("DELETE FROM time_clock WHERE employee_id = ?", (employee_id,))
+            else:
+                logging.warning(f"[SQLiteBackend] Unknown event type: {kind}")
+                return
+            self._log_event(conn, event)
+
+    def _update_session(self, conn, employee_id, session_index, changes):
+        cursor = conn.execute(
+            "UPDATE sessions SET clock_in = ?, clock_out = ?, hours = ?, manager_override = ? "
+            "WHERE employee_id = ? AND position = ?",
+            (changes['clock_in'], changes['clock_out'], changes['hours'], _flag(changes.get('manager_override')),
+             employee_id, session_index),
+        )
+        return cursor.rowcount > 0
+
+    def storage_files(self):
+        return [path for path in (self.path, self.path + "-wal", self.path + "-shm") if os.path.exists(path)]
+
+    def backup_files(self, workdir):
+        """A consistent copy of the database (via the online backup API) under workdir."""
+        copy_path = os.path.join(workdir, os.path.basename(self.path))
+        target = sqlite3.connect(copy_path)
+        try:
+            self.connect().backup(target)
+        finally:
+            target.close()
+        return {self.path: copy_path}
+
+    def _select_sessions(self, employee_id, start, end):
+        query = ("SELECT employee_id, position, clock_in, clock_out, hours, manager_override, lat, lon "
+                 "FROM sessions WHERE 1 = 1")
+        args = []
+        if start is not None:
+            query += " AND clock_out >= ?"
+            args.append(start)
+        if end is not None:
+            query += " AND clock_out < ?"
+            args.append(end)
+        if employee_id is not None:
+            query += " AND employee_id = ?"
+            args.append(employee_id)
+        # No ORDER BY: sorting on anything but the range column would make
+        # SQLite buffer the whole result in a temp B-tree before the first row
+        return self.connect().execute(query, args)
+
+    def iter_time_logs(self, employee_id=None, start=None, end=None):
+        """(employee_id, session) with start <= clock_out < end, streamed off the clock_out indexes.
+
+        Rows come in index order, not grouped by employee.
+        """
+        for row in self._select_sessions(employee_id, start, end):
+            yield row[0], self._session(row[2:])
+
+    def load_sessions_since(self, since, employee_id=None):
+        sessions = {}
+        for row in self._select_sessions(employee_id, since, None):
+            sessions.setdefault(row[0], []).append((row[1], self._session(row[2:])))
+        return {emp_id: [session for _, session in sorted(indexed, key=lambda item: item[0])]
+                for emp_id, indexed in sessions.items()}
+
+def migrate_files_to_sqlite(db_path=DATABASE_FILE):
+    """One-shot import of employees.csv and timelogs.json (+ journal) into SQLite."""
+    files = FileBackend()
+    employees = files.load_employees()
+    logs = files.load_time_logs()
+    # Build the whole database under a temporary name and rename it into
+    # place, so a crash part way through never leaves a half-migrated
+    # database that get_backend() would take as the real thing.
+    tmp_path = db_path + ".migrating"
+    for path in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    staging = SQLiteBackend(tmp_path)
+    staging.save_employees(employees)
+    staging.save_time_logs(logs)
+    # Closing the only connection checkpoints the WAL back into the main file
+    staging.close()
+    os.replace(tmp_path, db_path)
+    sessions = sum(len(entry.get('sessions', [])) for entry in logs.values())
+    logging.info(f"Migrated {len(employees)} employees and {sessions} sessions into {db_path}")
+    return SQLiteBackend(db_path)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    migrate_files_to_sqlite(sys.argv[1] if len(sys.argv) > 1 else DATABASE_FILE)
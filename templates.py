@@ -0,0 +1,34 @@
+import html
+import os
+import re
+
+# Page templates live in templates/ next to this file. A template is compiled
+# once: its literal text is split around {{ name }} placeholders and encoded to
+# bytes, so rendering only escapes and encodes the values it's given.
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+class Template:
+    """A compiled page. render(**values) returns the page as bytes.
+
+    str (and number) values are HTML-escaped. bytes values are inserted as
+    they are: use them for fragments that are already rendered, like the
+    output of another template.
+    """
+
+    def __init__(self, source):
+        parts = PLACEHOLDER.split(source)
+        self.literals = [part.encode() for part in parts[0::2]]
+        self.fields = parts[1::2]
+
+    def render(self, **values):
+        out = [self.literals[0]]
+        for name, literal in zip(self.fields, self.literals[1:]):
+            value = values[name]
+            out.append(value if isinstance(value, bytes) else html.escape(str(value)).encode())
+            out.append(literal)
+        return b"".join(out)
+
+def load_template(name):
+    with open(os.path.join(TEMPLATES_DIR, name), 'r', encoding='utf-8') as f:
+        return Template(f.read())
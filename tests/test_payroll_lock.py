@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from repository import PayrollLock
+
+# Holds the payroll lock the way a pre-fork worker running payroll would
+HOLDER = """
+import sys
+from repository import PayrollLock
+lock = PayrollLock(shared=True)
+lock.acquire()
+print("held", flush=True)
+sys.stdin.readline()
+lock.release()
+"""
+
+def test_shared_payroll_lock_excludes_other_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    holder = subprocess.Popen([sys.executable, "-c", HOLDER], cwd=tmp_path, env=env,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "held"
+        lock = PayrollLock(shared=True)
+        assert not lock.acquire(blocking=False)
+        # A failed attempt must not leave the thread lock held either
+        assert lock._lock.acquire(blocking=False)
+        lock._lock.release()
+        holder.stdin.write("\n")
+        holder.stdin.flush()
+        assert holder.wait(timeout=30) == 0
+        assert lock.acquire(blocking=False)
+        lock.release()
+    finally:
+        if holder.poll() is None:
+            holder.kill()
+
+def test_payroll_lock_excludes_threads():
+    lock = PayrollLock()
+    with lock:
+        assert not lock.acquire(blocking=False)
+    assert lock.acquire(blocking=False)
+    lock.release()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import payrollutils
+from payrollutils import calculate_pay_batch, calculate_pay_with_profile
+
+HOURS = [0.0, 1.5, 37.25, 80.0, 12.333333333333334, 40.0]
+RATES = [15.0, 0.0, 17.35, 22.1, 9.99, 1234.567]
+NRA = [False, True, False, True, True, False]
+
+def scalar_loop(hours, rates, nra):
+    pay = [calculate_pay_with_profile(h, r, n) for h, r, n in zip(hours, rates, nra)]
+    return tuple([row[column] for row in pay] for column in range(4))
+
+@pytest.fixture(params=["numpy", "fallback"])
+def batch(request, monkeypatch):
+    if request.param == "numpy":
+        if payrollutils.numpy is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(payrollutils, "numpy", None)
+    return calculate_pay_batch
+
+def test_batch_matches_scalar_loop(batch):
+    assert batch(HOURS, RATES, NRA) == scalar_loop(HOURS, RATES, NRA)
+
+def test_batch_nonresident_alien_flag(batch):
+    gross, federal, state, net = batch([10.0, 10.0], [20.0, 20.0], [False, True])
+    assert gross == [200.0, 200.0]
+    assert federal == [200.0 * payrollutils.FEDERAL_TAX_RATE, 200.0 * payrollutils.NONRESIDENT_ALIEN_TAX_RATE]
+    assert state == [payrollutils.STATE_TAX, payrollutils.STATE_TAX]
+    assert net == [200.0 - federal[0], 200.0 - federal[1]]
+
+def test_batch_empty_input(batch):
+    assert tuple(batch([], [], [])) == ([], [], [], [])
@@ -0,0 +1,55 @@
+import datetime
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import datetime
+from repository import init_repository
+repo = init_repository(shared=True)
+repo.save_employee("1", "Ann", 10.0, "123456789", "1 Main St")
+day = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+repo.clock_in("1", day + " 08:00:00", manager_override=True)
+repo.clock_out("1", day + " 10:00:00", manager_override=True)
+"""
+
+# Serves /report, waits for the other process's write, then catches up the way do_GET does
+READER = """
+import sys
+from repository import init_repository
+import server
+repo = init_repository(shared=True)
+handler = server.TimeClockHandler.__new__(server.TimeClockHandler)
+print(handler.view_report().body.decode(), flush=True)
+print("===", flush=True)
+sys.stdin.readline()
+repo.sync()
+print(handler.view_report().body.decode(), flush=True)
+"""
+
+WRITER = """
+from repository import init_repository
+init_repository(shared=True).save_employee("1", "Ann", 99.0, "123456789", "1 Main St")
+"""
+
+def run(script, cwd, **kwargs):
+    env = dict(os.environ, PAYROLL_STORAGE="sqlite", PYTHONPATH=REPO_DIR)
+    return subprocess.Popen([sys.executable, "-c", script], cwd=cwd, env=env, text=True, **kwargs)
+
+def test_report_follows_rate_change_from_another_process(tmp_path):
+    assert run(SETUP, tmp_path).wait(timeout=60) == 0
+    reader = run(READER, tmp_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    before = []
+    for line in reader.stdout:
+        if line.strip() == "===":
+            break
+        before.append(line)
+    assert "Gross Pay: $20.00" in "".join(before)
+
+    assert run(WRITER, tmp_path).wait(timeout=60) == 0
+    after, _ = reader.communicate("go\n", timeout=60)
+    assert reader.returncode == 0
+    assert "Gross Pay: $198.00" in after
+    assert "Gross Pay: $20.00" not in after
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import data
+from data import record_clock_in, record_clock_out
+
+class FullDiskBackend:
+    def append_time_log_event(self, event):
+        raise OSError(28, "No space left on device")
+
+@pytest.fixture
+def full_disk(monkeypatch):
+    monkeypatch.setattr(data, "_backend", FullDiskBackend())
+
+def test_failed_clock_in_leaves_logs_unchanged(full_disk):
+    logs = {}
+    with pytest.raises(OSError):
+        record_clock_in(logs, "1", "Ann", "2026-10-17 08:00:00")
+    assert logs == {}
+
+def test_failed_clock_out_leaves_employee_clocked_in(full_disk):
+    logs = {"1": {"name": "Ann", "clock_in": "2026-10-17 08:00:00", "sessions": []}}
+    with pytest.raises(OSError):
+        record_clock_out(logs, "1", "2026-10-17 10:00:00")
+    assert logs == {"1": {"name": "Ann", "clock_in": "2026-10-17 08:00:00", "sessions": []}}
@@ -0,0 +1,117 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right, insort
+
+# A time log row is one clock-in or clock-out. Its key sorts by time:
+# (time, employee_id, session_index, kind), where kind is 'in' or 'out' and
+# an open clock-in (no session yet) has session_index -1.
+OPEN_SESSION = -1
+KINDS = ('in', 'out')
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """The key a cursor points at. Raises ValueError for anything we didn't issue."""
+    try:
+        time, employee_id, session_index, kind = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    if not (isinstance(time, str) and isinstance(employee_id, str) and isinstance(session_index, int) and kind in KINDS):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return (time, employee_id, session_index, kind)
+
+class TimeLogIndex:
+    """Sorted row keys for paging through time logs newest first.
+
+    Keys are kept in one sorted list per (employee_id or None, kind or None)
+    filter combination, so a page is two bisects and a slice whatever the
+    filters. The index follows the Repository's ChangeEvents; it's built
+    from `time_logs` on first use and again after a 'reloaded' event.
+    Callers hold the repository lock.
+    """
+
+    def __init__(self, time_logs):
+        self.time_logs = time_logs
+        self.lists = None
+
+    def _build(self):
+        self.lists = {}
+        self.open_keys = {}
+        self.session_keys = {}
+        for employee_id, data in self.time_logs.items():
+            if data.get('clock_in'):
+                self._add_open(employee_id, data['clock_in'])
+            for index, session in enumerate(data.get('sessions', [])):
+                self._add_session(employee_id, index, session)
+
+    def _insert(self, key):
+        employee_id, kind = key[1], key[3]
+        for filter_key in ((None, None), (None, kind), (employee_id, None), (employee_id, kind)):
+            insort(self.lists.setdefault(filter_key, []), key)
+
+    def _remove(self, key):
+        employee_id, kind = key[1], key[3]
+        for filter_key in ((None, None), (None, kind), (employee_id, None), (employee_id, kind)):
+            keys = self.lists.get(filter_key, [])
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def _add_open(self, employee_id, clock_in):
+        key = (clock_in, employee_id, OPEN_SESSION, 'in')
+        self.open_keys[employee_id] = key
+        self._insert(key)
+
+    def _add_session(self, employee_id, index, session):
+        keys = (
+            (session['clock_in'], employee_id, index, 'in'),
+            (session['clock_out'], employee_id, index, 'out'),
+        )
+        self.session_keys[(employee_id, index)] = keys
+        for key in keys:
+            self._insert(key)
+
+    def _remove_open(self, employee_id):
+        key = self.open_keys.pop(employee_id, None)
+        if key is not None:
+            self._remove(key)
+
+    def on_change(self, event):
+        """Repository subscriber: keep the index in step with the time logs."""
+        if self.lists is None:
+            return  # Not built yet; it will be built from the current time logs
+        if event.kind == 'clock_in':
+            self._add_open(event.employee_id, event.data['clock_in'])
+        elif event.kind == 'clock_out':
+            self._remove_open(event.employee_id)
+            self._add_session(event.employee_id, event.data['session_index'], event.data['session'])
+        elif event.kind == 'edit':
+            for key in self.session_keys.pop((event.employee_id, event.data['session_index']), ()):
+                self._remove(key)
+            self._add_session(event.employee_id, event.data['session_index'], event.data['session'])
+        elif event.kind == 'employee_deleted':
+            for key in list(self.lists.get((event.employee_id, None), [])):
+                self._remove(key)
+            self.open_keys.pop(event.employee_id, None)
+            for session_key in [k for k in self.session_keys if k[0] == event.employee_id]:
+                del self.session_keys[session_key]
+        elif event.kind == 'reloaded':
+            self.lists = None
+
+    def page(self, employee_id=None, kind=None, start=None, end=None, limit=100, after=None):
+        """Up to `limit` keys, newest first, and the key to continue after (None on the last page).
+
+        `start`/`end` bound the row time inclusively; a date ("YYYY-MM-DD")
+        covers the whole day. `after` is the last key of the previous page.
+        """
+        if self.lists is None:
+            self._build()
+        keys = self.lists.get((employee_id, kind), [])
+        low = bisect_left(keys, (start,)) if start else 0
+        high = bisect_right(keys, (end + "\uffff",)) if end else len(keys)
+        if after is not None:
+            high = min(high, bisect_left(keys, after))
+        first = max(low, high - limit)
+        return keys[first:high][::-1], (keys[first] if first > low else None)